@@ -0,0 +1,405 @@
+import argparse as argp
+import json
+import multiprocessing as mp
+import os
+import random
+import shlex
+import shutil
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter, time
+
+SRC_DIR = Path(__file__).parent.parent.joinpath("src")
+sys.path.insert(0, str(SRC_DIR))
+from vmaf_state_handler import VMAF_State_Handler  # noqa: E402
+
+# The stand-in for the ffmpeg and ffprobe executables
+FAKE_FFMPEG = Path(__file__).parent.joinpath("fake_ffmpeg.py")
+
+# History of how fast every VMAF model ran, which the calculator learns from
+# and which is restored after every run so that every run starts out the same
+HISTORY_FILE = SRC_DIR.joinpath("vmaf_history.json")
+# Probed info of the video files, restored after every run the same way so
+# that every run probes its own batch
+PROBE_CACHE_FILE = SRC_DIR.joinpath("vmaf_probes.json")
+
+# Resolutions of the distorted video files, in the same layout as an encoding ladder
+LADDER = [
+    (640, 360),
+    (960, 540),
+    (1280, 720),
+    (1920, 1080),
+]
+
+# Number of status changes the calculator saves for every dist-model pair, for
+# STARTED, DONE and MOVED
+RECORDS_PER_PAIR = 3
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for benchmarking the orchestration of the VMAF Calculator."""
+    main_help = "Benchmark how the VMAF Calculator schedules synthetic batches of calculations, "
+    main_help += "using a stand-in FFmpeg that spends the cost of every calculation without decoding any video.\n"
+    main_help += "Prints one JSON object of results per run, for comparing ordering and parallelism changes."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+
+    jobs_help = "Specify the number of dist-model pairs of every synthetic batch (Default is 10 100)."
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        nargs="+",
+        type=int,
+        default=[10, 100],
+        help=jobs_help,
+    )
+
+    models_help = "Specify the number of VMAF models every distorted video file is calculated with (Default is 1)."
+    parser.add_argument(
+        "-m",
+        "--models",
+        dest="models",
+        type=int,
+        default=1,
+        help=models_help,
+    )
+
+    proc_help = (
+        "Specify number of simultaneous VMAF calculation processes to run (Default is the number of CPU threads)."
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        type=int,
+        default=mp.cpu_count(),
+        help=proc_help,
+    )
+
+    frames_help = "Specify the number of frames of the reference video file (Default is 300)."
+    parser.add_argument(
+        "--frames",
+        dest="frames",
+        type=int,
+        default=300,
+        help=frames_help,
+    )
+
+    jitter_help = "Specify the spread of how much slower some distorted video files are to calculate than predicted,\n"
+    jitter_help += "as the sigma of a log-normal slowdown (Default is 0.5, 0 for none)."
+    parser.add_argument(
+        "--jitter",
+        dest="jitter",
+        type=float,
+        default=0.5,
+        help=jitter_help,
+    )
+
+    cost_scale_help = "Multiply the cost of every stand-in FFmpeg calculation by this factor (Default is 1)."
+    parser.add_argument(
+        "--cost-scale",
+        "--cost_scale",
+        dest="cost_scale",
+        type=float,
+        default=1.0,
+        help=cost_scale_help,
+    )
+
+    cpu_share_help = (
+        "Specify the share of every calculation's cost spent burning CPU instead of sleeping (Default is 0.5)."
+    )
+    parser.add_argument(
+        "--cpu-share",
+        "--cpu_share",
+        dest="cpu_share",
+        type=float,
+        default=0.5,
+        help=cpu_share_help,
+    )
+
+    log_format_help = "Specify the VMAF log file format."
+    parser.add_argument(
+        "-l",
+        "--log-format",
+        dest="log_format",
+        choices=["xml", "csv", "json"],
+        default="xml",
+        help=log_format_help,
+    )
+
+    calculator_args_help = 'Extra arguments for the VMAF Calculator, such as "--order lpt --dynamic-threads".'
+    parser.add_argument(
+        "-a",
+        "--calculator-args",
+        "--calculator_args",
+        dest="calculator_args",
+        type=str,
+        default="",
+        help=calculator_args_help,
+    )
+
+    repeat_help = "Specify the number of times every batch is run (Default is 1)."
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=1,
+        help=repeat_help,
+    )
+
+    seed_help = "Specify the seed of the synthetic batches (Default is 0)."
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        default=0,
+        help=seed_help,
+    )
+
+    output_help = "Also append the results to this JSON lines file."
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        type=str,
+        help=output_help,
+    )
+
+    keep_help = "Keep the directories of every run, including the calculator's output, instead of deleting them."
+    parser.add_argument(
+        "-k",
+        "--keep",
+        dest="keep",
+        action="store_true",
+        help=keep_help,
+    )
+
+    return parser.parse_args()
+
+
+def write_video(
+    file,
+    frames,
+    width,
+    height,
+    offset=0.0,
+    jitter=1.0,
+):
+    """Write the placeholder the stand-in FFmpeg reads instead of a video file."""
+    with open(file, "w") as writer:
+        json.dump(
+            {
+                "frames": frames,
+                "fps": 25.0,
+                "width": width,
+                "height": height,
+                "offset": offset,
+                "jitter": jitter,
+            },
+            writer,
+        )
+
+
+def create_batch(
+    run_dir,
+    jobs,
+    models,
+    frames,
+    jitter,
+    seed,
+):
+    """Create the reference, distorted and model files of a synthetic batch, returning the reference and model files."""
+    rng = random.Random(seed)
+    bin_dir = run_dir.joinpath("bin")
+    bin_dir.mkdir()
+    for name in ["ffmpeg", "ffprobe"]:
+        os.symlink(FAKE_FFMPEG.resolve(), bin_dir.joinpath(name))
+
+    reference = run_dir.joinpath("reference.mkv")
+    write_video(reference, frames, *LADDER[-1])
+
+    dist_dir = run_dir.joinpath("distorted")
+    dist_dir.mkdir()
+    for i in range(max(1, -(-jobs // models))):
+        width, height = rng.choice(LADDER)
+        write_video(
+            dist_dir.joinpath("distorted{:05d}.mkv".format(i)),
+            frames,
+            width,
+            height,
+            offset=-rng.uniform(0, 20),
+            jitter=rng.lognormvariate(0, jitter) if jitter > 0 else 1.0,
+        )
+
+    model_files = []
+    for i in range(models):
+        model_files.append(run_dir.joinpath("model{}.json".format(i)))
+        model_files[-1].write_text("{}")
+
+    return reference, model_files
+
+
+def get_percentile(
+    values,
+    percentile,
+):
+    """Get the percentile of a list of values, by the nearest rank."""
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(percentile / 100 * len(values) + 0.5)) - 1))]
+
+
+def time_state(
+    run_dir,
+    pairs,
+):
+    """Time saving the status changes of every dist-model pair of a batch the same way the calculator does."""
+    state = VMAF_State_Handler(run_dir.joinpath("state", "reference.mkv"))
+    run_dir.joinpath("state").mkdir()
+    io = {}
+    start = perf_counter()
+    for i in range(pairs):
+        dist = str(run_dir.joinpath("distorted", "distorted{:05d}.mkv".format(i)))
+        entry = {"status": "STARTED", "log_path": dist + ".xml", "commands": "libvmaf=model_path=model.json"}
+        io[dist] = {"model.json": entry}
+        for status in ["STARTED", "DONE", "MOVED"][:RECORDS_PER_PAIR]:
+            entry["status"] = status
+            state.record(dist, "model.json", entry)
+    journal_bytes = Path(state.get_journal_file()).stat().st_size
+    state.compact(io)
+    state.close()
+
+    return {
+        "state_seconds": perf_counter() - start,
+        "state_records": pairs * RECORDS_PER_PAIR,
+        "journal_bytes": journal_bytes,
+        "completions_bytes": Path(state.get_completions_file()).stat().st_size,
+    }
+
+
+def run_batch(
+    args,
+    jobs,
+    seed,
+):
+    """Run the VMAF Calculator over a synthetic batch, returning the measured results."""
+    run_dir = Path(tempfile.mkdtemp(prefix="vmaf_bench_"))
+    reference, model_files = create_batch(run_dir, jobs, args.models, args.frames, args.jitter, seed)
+    record = run_dir.joinpath("record.jsonl")
+
+    env = dict(os.environ)
+    env["VMAF_FAKE_RECORD"] = str(record)
+    env["VMAF_FAKE_CPU_SHARE"] = str(args.cpu_share)
+    env["VMAF_FAKE_DECODE_COST"] = str(0.00002 * args.cost_scale)
+    env["VMAF_FAKE_VMAF_COST"] = str(0.0001 * args.cost_scale)
+    command = [
+        sys.executable,
+        str(SRC_DIR.joinpath("vmaf_calculator.py")),
+        "--headless",
+        "-r",
+        str(reference),
+        "-d",
+        str(run_dir.joinpath("distorted")),
+        "-m",
+        *[str(model) for model in model_files],
+        "-f",
+        str(run_dir.joinpath("bin", "ffmpeg")),
+        "-p",
+        str(args.processes),
+        "-l",
+        args.log_format,
+        *shlex.split(args.calculator_args),
+    ]
+
+    # Every run starts out from the same learned model speeds and probe cache
+    saved = {file: file.read_bytes() if file.exists() else None for file in [HISTORY_FILE, PROBE_CACHE_FILE]}
+    usage_start = os.times()
+    start = time()
+    try:
+        with open(run_dir.joinpath("calculator.log"), "w") as log:
+            returncode = sp.run(command, stdout=log, stderr=sp.STDOUT, env=env).returncode
+        makespan = time() - start
+        usage_end = os.times()
+    finally:
+        for file, data in saved.items():
+            if data is None:
+                file.unlink(missing_ok=True)
+            else:
+                file.write_bytes(data)
+
+    calculations = []
+    if record.exists():
+        with open(record, "r") as reader:
+            calculations = [json.loads(line) for line in reader]
+    busy = sum([calculation["end"] - calculation["start"] for calculation in calculations])
+    latencies = [calculation["end"] - start for calculation in calculations]
+    durations = [calculation["end"] - calculation["start"] for calculation in calculations]
+    # CPU time of the calculator and of every stand-in FFmpeg it ran
+    cpu_seconds = (usage_end.children_user - usage_start.children_user) + (
+        usage_end.children_system - usage_start.children_system
+    )
+
+    results = {
+        "jobs": jobs,
+        "models": args.models,
+        "processes": args.processes,
+        "frames": args.frames,
+        "jitter": args.jitter,
+        "cost_scale": args.cost_scale,
+        "cpu_share": args.cpu_share,
+        "log_format": args.log_format,
+        "calculator_args": args.calculator_args,
+        "seed": seed,
+        "returncode": returncode,
+        "calculations": len(calculations),
+        "makespan": makespan,
+        # Shares of the run's wall time that the CPU cores were busy, and that
+        # the calculator's process slots had an FFmpeg process running
+        "core_utilisation": cpu_seconds / (makespan * mp.cpu_count()),
+        "slot_utilisation": busy / (makespan * args.processes),
+        # Time lost to the calculator itself, over perfectly packed process slots
+        "overhead_seconds": makespan - busy / args.processes,
+        "first_start": min([calculation["start"] for calculation in calculations]) - start if calculations else None,
+        "latency_p50": get_percentile(latencies, 50),
+        "latency_p90": get_percentile(latencies, 90),
+        "latency_p99": get_percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "duration_p50": get_percentile(durations, 50),
+        "duration_p99": get_percentile(durations, 99),
+        "run_dir": str(run_dir) if args.keep else None,
+    }
+    results.update(time_state(run_dir, jobs))
+    results["state_share"] = results["state_seconds"] / makespan
+
+    if not args.keep:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if os.name != "posix":
+        print("The stand-in FFmpeg is linked in as an executable, which needs a POSIX system.")
+        exit(1)
+
+    makespans = {}
+    for jobs in args.jobs:
+        for i in range(args.repeat):
+            results = run_batch(args, jobs, args.seed + i)
+            print(json.dumps(results), flush=True)
+            if args.output:
+                with open(args.output, "a") as writer:
+                    writer.write(json.dumps(results) + "\n")
+            makespans.setdefault(jobs, []).append(results["makespan"])
+
+    for jobs, times in makespans.items():
+        print(
+            "{} jobs: {:.3f}s median makespan over {} runs".format(jobs, statistics.median(times), len(times)),
+            file=sys.stderr,
+        )
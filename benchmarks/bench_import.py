@@ -0,0 +1,119 @@
+import argparse as argp
+import statistics
+import subprocess as sp
+import sys
+from pathlib import Path
+from time import perf_counter
+
+# Directory holding the tools, which every import is run from
+SRC_DIR = Path(__file__).parent.parent.joinpath("src")
+
+# Tools whose startup is measured, as the module imported and the script run
+TOOLS = {
+    "calculator": "vmaf_calculator",
+    "plotter": "vmaf_plotter",
+}
+
+# Heavy libraries that none of the tools may import before a stage needs them
+HEAVY_MODULES = [
+    "gooey",
+    "wx",
+    "pandas",
+    "numpy",
+    "matplotlib",
+    "tqdm",
+]
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for benchmarking the startup time of the tools."""
+    main_help = "Benchmark how long the VMAF tools take to import and to show their headless help, "
+    main_help += "failing if any of them imports a heavy library at startup or takes longer than the given budget."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+
+    runs_help = "Specify the number of times every tool is started (Default is 10)."
+    parser.add_argument(
+        "-n",
+        "--runs",
+        dest="runs",
+        type=int,
+        default=10,
+        help=runs_help,
+    )
+
+    budget_help = "Specify the median number of seconds a tool may take to show its headless help (Default is 0.5)."
+    parser.add_argument(
+        "-b",
+        "--budget",
+        dest="budget",
+        type=float,
+        default=0.5,
+        help=budget_help,
+    )
+
+    return parser.parse_args()
+
+
+def get_imported_modules(module):
+    """Import a module in a fresh interpreter, returning the top level names of every module it imported."""
+    code = "import sys\nbefore = set(sys.modules)\nimport {}\nprint(' '.join(set(sys.modules) - before))"
+    out = sp.run(
+        [sys.executable, "-c", code.format(module)],
+        cwd=SRC_DIR,
+        stdout=sp.PIPE,
+        stderr=sp.DEVNULL,
+        check=True,
+    ).stdout.decode("utf-8")
+
+    return set([name.split(".")[0] for name in out.split()])
+
+
+def time_help(
+    module,
+    runs,
+):
+    """Time starting a tool in a fresh interpreter until it printed its headless help, returning every run's seconds."""
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        sp.run(
+            [sys.executable, "{}.py".format(module), "--headless", "--help"],
+            cwd=SRC_DIR,
+            stdout=sp.DEVNULL,
+            stderr=sp.DEVNULL,
+            check=True,
+        )
+        times.append(perf_counter() - start)
+
+    return times
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    # The bare interpreter's startup is the floor every tool starts from
+    times = []
+    for _ in range(args.runs):
+        start = perf_counter()
+        sp.run([sys.executable, "-c", "pass"], check=True)
+        times.append(perf_counter() - start)
+    baseline = statistics.median(times)
+    print("Python startup: {:.3f}s".format(baseline))
+
+    failed = False
+    for name, module in TOOLS.items():
+        heavy = sorted(set(HEAVY_MODULES) & get_imported_modules(module))
+        median = statistics.median(time_help(module, args.runs))
+        print(
+            "{}: {:.3f}s median over {} runs, {:.3f}s over Python startup".format(
+                name, median, args.runs, median - baseline
+            )
+        )
+        if len(heavy) > 0:
+            print("\t{} imports {} at startup".format(module, ", ".join(heavy)))
+            failed = True
+        if median > args.budget:
+            print("\t{} took longer than the budget of {:.3f}s".format(module, args.budget))
+            failed = True
+
+    exit(1 if failed else 0)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Stand-in for the ffmpeg and ffprobe executables, for benchmarking the VMAF Calculator without decoding any video.
+
+Video files are small JSON placeholders written by bench_calculator.py, holding the "frames", "fps",
+"width" and "height" of the video along with the "offset" added to its VMAF scores and the "jitter"
+its calculations are slowed down by. Called as ffprobe, the placeholder is reported as a video
+stream, or as its packets when they are asked for, with a key frame every GOP_FRAMES frames. Called as ffmpeg with libvmaf filters, the calculation's cost is spent by burning CPU and
+sleeping, after which every libvmaf filter's log is written from the frames of a template log, and
+its "VMAF score" line is printed to stderr the same way FFmpeg does. Called as ffmpeg with the tee
+muxer, the placeholder of the input is written to every output of the tee, scaled by any scale
+filter and with its VMAF scores lowered by any CRF. Any other FFmpeg command does nothing.
+
+The cost model is set with the following environment variables:
+- VMAF_FAKE_STARTUP: seconds every FFmpeg process takes to start (Default is 0.02).
+- VMAF_FAKE_DECODE_COST: seconds to decode a megapixel of every input (Default is 0.00002).
+- VMAF_FAKE_VMAF_COST: seconds for a libvmaf filter to calculate a megapixel (Default is 0.0001).
+- VMAF_FAKE_ENCODE_COST: seconds to encode a megapixel (Default is 0.0002).
+- VMAF_FAKE_THREAD_SCALING: exponent of the speedup from libvmaf's n_threads (Default is 0.7).
+- VMAF_FAKE_CPU_SHARE: share of the cost spent burning CPU instead of sleeping (Default is 0.5).
+- VMAF_FAKE_TEMPLATE: log whose frames are cloned into every log (Default is report_examples/vmaf_v2.json).
+- VMAF_FAKE_RECORD: file that every calculation appends its start and end times to, if set.
+"""
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from time import perf_counter, sleep, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath("src")))
+from vmaf_log_handler import read_log, write_log  # noqa: E402
+
+# Default log whose frames are cloned into every log
+TEMPLATE_FILE = Path(__file__).resolve().parent.parent.joinpath("report_examples", "vmaf_v2.json")
+
+# Number of times the progress is reported while a calculation runs
+PROGRESS_STEPS = 10
+
+# Frames between the key frames of the reported packets
+GOP_FRAMES = 50
+
+
+def get_setting(
+    name,
+    default,
+):
+    return float(os.environ.get(name, default))
+
+
+def read_video(file):
+    """Read the placeholder of a video file."""
+    # Inputs can be given through FFmpeg's file protocol, or piped in
+    if file.startswith("file:"):
+        file = file[len("file:") :]
+    if file in ["pipe:0", "pipe:", "-"]:
+        video = json.load(sys.stdin)
+    else:
+        with open(file, "r") as reader:
+            video = json.load(reader)
+    video.setdefault("offset", 0.0)
+    video.setdefault("jitter", 1.0)
+    return video
+
+
+def probe(args):
+    """Print the placeholder of the probed video file the same way ffprobe -print_format json does.
+
+    When the packet entries are asked for, they are printed the same way ffprobe -print_format csv does,
+    with key frames ten times the size of the other frames and the other frames sized by the VMAF offset.
+    """
+    video = read_video(args[args.index("-i") + 1] if "-i" in args else args[-1])
+    duration = video["frames"] / video["fps"]
+    if "-show_entries" in args and args[args.index("-show_entries") + 1].startswith("packet="):
+        base = int(video["width"] * video["height"] / 20 * (1 + video["offset"] / 100))
+        for i in range(video["frames"]):
+            key = i % GOP_FRAMES == 0
+            print(
+                "{:.6f},{:.6f},{},{}".format(
+                    i / video["fps"], 1 / video["fps"], base * 10 if key else base, "K__" if key else "___"
+                )
+            )
+        return
+    stream = {
+        "codec_name": "h264",
+        "width": video["width"],
+        "height": video["height"],
+        "pix_fmt": "yuv420p",
+        "avg_frame_rate": "{}/1000".format(int(round(video["fps"] * 1000))),
+        "duration": str(duration),
+        "nb_frames": str(video["frames"]),
+    }
+    print(json.dumps({"streams": [stream], "format": {"duration": str(duration), "size": "1000000"}}))
+
+
+def parse_filters(graph):
+    """Get the options of every libvmaf filter in a filter graph made by build_filter_graph, in the order they appear.
+
+    Every filter's options also get the index of the distorted "input" it is fed by.
+    """
+    # Pads made by splitting or normalising an input, with the index of that input
+    pads = {}
+    filters = []
+    for statement in graph.split(";"):
+        vmaf = re.match(r"\[([^\]]+)\]\[[^\]]+\]libvmaf=(.*)", statement)
+        if vmaf is None:
+            chain = re.match(r"\[([^\]]+)\][^\[]*((?:\[[^\]]+\])+)$", statement)
+            if chain is not None:
+                pad = chain.group(1)
+                index = int(pad.split(":")[0]) if pad.endswith(":v") else pads.get(pad, -1)
+                for out in re.findall(r"\[([^\]]+)\]", chain.group(2)):
+                    pads[out] = index
+            continue
+        pad = vmaf.group(1)
+        options = {"input": int(pad.split(":")[0]) if pad.endswith(":v") else pads[pad]}
+        for option in re.split(r"(?<!\\):", vmaf.group(2)):
+            key, _, value = option.partition("=")
+            options[key] = value.replace("\\\\", "\\").replace("\\:", ":")
+        filters.append(options)
+    return filters
+
+
+def spend(
+    seconds,
+    cpu_share,
+):
+    """Spend the given seconds, burning CPU for cpu_share of them and sleeping for the rest."""
+    end = perf_counter() + seconds * cpu_share
+    while perf_counter() < end:
+        pass
+    sleep(seconds * (1 - cpu_share))
+
+
+def calculate(args):
+    """Spend the cost of a libvmaf calculation and write the logs of every libvmaf filter."""
+    started = time()
+    inputs = [args[i + 1] for i, arg in enumerate(args) if arg == "-i"]
+    videos = [read_video(file) for file in inputs]
+    # The reference video file is the last input
+    reference = videos[-1]
+    graph = args[args.index("-filter_complex") + 1]
+    filters = parse_filters(graph)
+
+    first = 0
+    if "-ss" in args:
+        first = int(round(float(args[args.index("-ss") + 1]) * reference["fps"] + 0.5))
+    frames = reference["frames"] - first
+    if "-frames:v" in args:
+        frames = min(frames, int(args[args.index("-frames:v") + 1]))
+    frames = max(0, frames)
+
+    # libvmaf works at the resolution of the largest input, and every input
+    # gets decoded at its own resolution
+    megapixels = max([video["width"] * video["height"] for video in videos]) / 1000000
+    decode = sum([frames * video["width"] * video["height"] / 1000000 for video in videos])
+    cost = get_setting("VMAF_FAKE_DECODE_COST", 0.00002) * decode
+    for options in filters:
+        threads = max(1, int(options.get("n_threads", 1)))
+        subsample = max(1, int(options.get("n_subsample", 1)))
+        speedup = threads ** get_setting("VMAF_FAKE_THREAD_SCALING", 0.7)
+        cost += get_setting("VMAF_FAKE_VMAF_COST", 0.0001) * megapixels * frames / subsample / speedup
+    cost *= max([video["jitter"] for video in videos])
+    cost += get_setting("VMAF_FAKE_STARTUP", 0.02)
+
+    cpu_share = min(1.0, max(0.0, get_setting("VMAF_FAKE_CPU_SHARE", 0.5)))
+    step_start = perf_counter()
+    for step in range(1, PROGRESS_STEPS + 1):
+        spend(cost / PROGRESS_STEPS, cpu_share)
+        print("frame={}".format(frames * step // PROGRESS_STEPS), flush=True)
+        print("fps={:.2f}".format(frames * step / PROGRESS_STEPS / max(perf_counter() - step_start, 0.001)))
+        print("progress={}".format("end" if step == PROGRESS_STEPS else "continue"), flush=True)
+
+    template = read_log(os.environ.get("VMAF_FAKE_TEMPLATE", str(TEMPLATE_FILE)))["frames"]
+    for index, options in enumerate(filters):
+        dist = videos[options["input"]]
+        subsample = max(1, int(options.get("n_subsample", 1)))
+        log = {"version": "2.1.1", "fps": reference["fps"], "params": {}, "frames": []}
+        for frame_num in range(0, frames, subsample):
+            metrics = dict(template[(first + frame_num) % len(template)]["metrics"])
+            if "vmaf" in metrics:
+                metrics["vmaf"] = min(100.0, max(0.0, metrics["vmaf"] + dist["offset"]))
+            log["frames"].append({"frameNum": frame_num, "metrics": metrics})
+        if len(log["frames"]) == 0:
+            continue
+        pooled = write_log(options["log_path"], log, options.get("log_fmt", "xml"))
+        print(
+            "[Parsed_libvmaf_{} @ 0x0] VMAF score: {:.6f}".format(index, pooled["vmaf"]["mean"]),
+            file=sys.stderr,
+            flush=True,
+        )
+
+    record = os.environ.get("VMAF_FAKE_RECORD")
+    if record:
+        line = json.dumps(
+            {
+                "pid": os.getpid(),
+                "start": started,
+                "end": time(),
+                "frames": frames,
+                "filters": len(filters),
+                "cost": cost,
+            }
+        )
+        # A single short append is never interleaved with another process'
+        fd = os.open(record, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        os.write(fd, (line + "\n").encode("utf-8"))
+        os.close(fd)
+
+
+def encode(args):
+    """Spend the cost of an encode and write the placeholder of the encoded video to every output of the tee muxer."""
+    video = read_video(args[args.index("-i") + 1])
+    if "-vf" in args:
+        scale = re.match(r"scale=(\d+):(\d+)", args[args.index("-vf") + 1])
+        if scale is not None:
+            video["width"], video["height"] = int(scale.group(1)), int(scale.group(2))
+    if "-crf" in args:
+        video["offset"] -= float(args[args.index("-crf") + 1]) / 4
+
+    cost = get_setting("VMAF_FAKE_ENCODE_COST", 0.0002) * video["frames"] * video["width"] * video["height"] / 1000000
+    spend(cost + get_setting("VMAF_FAKE_STARTUP", 0.02), min(1.0, max(0.0, get_setting("VMAF_FAKE_CPU_SHARE", 0.5))))
+
+    # Outputs look like "out.mkv|[f=nut]pipe:1"
+    for output in re.split(r"(?<!\\)\|", args[-1]):
+        output = re.sub(r"^\[[^\]]*\]", "", output).replace("\\|", "|")
+        if output in ["pipe:1", "pipe:", "-"]:
+            sys.stdout.write(json.dumps(video))
+            sys.stdout.flush()
+        else:
+            with open(output, "w") as writer:
+                json.dump(video, writer)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "ffprobe" in Path(sys.argv[0]).name:
+        probe(args)
+    elif "-filter_complex" in args:
+        calculate(args)
+    elif "tee" in args:
+        encode(args)
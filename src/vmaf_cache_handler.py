@@ -0,0 +1,243 @@
+import argparse as argp
+import hashlib
+import shutil
+from json import dump, load
+from pathlib import Path
+from time import time
+
+from vmaf_common import bytes2human
+
+# Name of the index file inside the cache directory
+INDEX_FILE = "index.json"
+
+# Size of the blocks read while hashing a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class VMAF_Cache_Handler:
+    """Content addressed cache of finished VMAF logs.
+
+    Logs are stored under a key made from the contents of the reference, distorted and model files
+    plus the libvmaf options, so the same calculation is never run twice even when the video files
+    were copied or renamed. The least recently used logs are evicted once the cache grows past its
+    size limit.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_size=0,
+    ):
+        self._cache_dir = Path(cache_dir)
+        self._objects_dir = self._cache_dir.joinpath("objects")
+        self._index_file = self._cache_dir.joinpath(INDEX_FILE)
+        # Maximum cache size in GiB, 0 meaning no limit
+        self._max_size = max_size
+        self._index = {
+            "entries": {},
+            "fingerprints": {},
+        }
+
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        if self._index_file.exists():
+            try:
+                with open(self._index_file, "r") as reader:
+                    self._index.update(load(reader))
+            except (OSError, ValueError) as e:
+                print(
+                    "Could not read the VMAF cache index {}, starting with an empty cache: {}".format(
+                        self._index_file, e
+                    )
+                )
+
+    def get_entries(self):
+        return self._index["entries"]
+
+    def get_size(self):
+        return sum([entry["size"] for entry in self._index["entries"].values()])
+
+    def fingerprint(
+        self,
+        file,
+    ):
+        """Hash the contents of a file, reusing the earlier hash while its size and modification time are unchanged."""
+        file = Path(file).resolve()
+        stat = file.stat()
+        cached = self._index["fingerprints"].get(str(file))
+        if cached is not None and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["hash"]
+
+        hasher = hashlib.blake2b(digest_size=20)
+        with open(file, "rb") as reader:
+            for block in iter(lambda: reader.read(HASH_BLOCK_SIZE), b""):
+                hasher.update(block)
+        self._index["fingerprints"][str(file)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": hasher.hexdigest(),
+        }
+
+        return hasher.hexdigest()
+
+    def get_key(
+        self,
+        reference,
+        distorted,
+        model,
+        options,
+    ):
+        """Get the cache key of a calculation from its input files and libvmaf options."""
+        parts = [
+            self.fingerprint(reference),
+            self.fingerprint(distorted),
+            self.fingerprint(model),
+            options,
+        ]
+        return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=20).hexdigest()
+
+    def _get_object(
+        self,
+        key,
+    ):
+        return self._objects_dir.joinpath(key[:2], key + self._index["entries"][key]["ext"])
+
+    def restore(
+        self,
+        key,
+        log_file,
+    ):
+        """Copy the cached log of a calculation to the given log file, returning its entry or None on a miss."""
+        entry = self._index["entries"].get(key)
+        if entry is None:
+            return None
+        cached = self._get_object(key)
+        if not cached.exists():
+            del self._index["entries"][key]
+            return None
+
+        # Copy instead of hard linking, so that a log overwritten later on can
+        # never change the cached log
+        shutil.copyfile(cached, log_file)
+        entry["last_used"] = time()
+
+        return entry
+
+    def store(
+        self,
+        key,
+        log_file,
+        score=None,
+        description="",
+        estimate=None,
+    ):
+        """Add the log of a finished calculation to the cache, evicting old logs if the cache grew too large.
+
+        estimate holds the estimated scores of a scene sampled calculation, if it was one.
+        """
+        log_file = Path(log_file)
+        self._index["entries"][key] = {
+            "ext": log_file.suffix,
+            "size": log_file.stat().st_size,
+            "score": score,
+            "description": description,
+            "last_used": time(),
+        }
+        if estimate is not None:
+            self._index["entries"][key]["estimate"] = estimate
+        cached = self._get_object(key)
+        cached.parent.mkdir(exist_ok=True)
+        shutil.copyfile(log_file, cached)
+
+        if self._max_size > 0:
+            self.evict(self._max_size * 1024**3)
+
+    def evict(
+        self,
+        max_bytes,
+    ):
+        """Delete the least recently used logs until the cache is no larger than max_bytes, returning the count deleted."""
+        evicted = 0
+        entries = sorted(self._index["entries"].items(), key=lambda item: item[1]["last_used"])
+        size = self.get_size()
+        for key, entry in entries:
+            if size <= max_bytes:
+                break
+            self._get_object(key).unlink(missing_ok=True)
+            del self._index["entries"][key]
+            size -= entry["size"]
+            evicted += 1
+
+        return evicted
+
+    def prune_fingerprints(self):
+        """Forget the hashes of files that no longer exist."""
+        for file in list(self._index["fingerprints"].keys()):
+            if not Path(file).exists():
+                del self._index["fingerprints"][file]
+
+    def save(self):
+        # Write to a temporary file first so an interrupted write never leaves
+        # a broken index behind
+        tmp_file = self._index_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as writer:
+            dump(self._index, writer, indent=4, sort_keys=True)
+        tmp_file.replace(self._index_file)
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for inspecting and pruning the VMAF cache."""
+    main_help = "Inspect or prune a VMAF Calculator result cache."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+    parser.add_argument(
+        "cache_dir",
+        type=str,
+        help="The cache directory given to the VMAF Calculator's --cache-dir argument.",
+    )
+    subparsers = parser.add_subparsers(help="commands", dest="command", required=True)
+
+    subparsers.add_parser("list", help="List every cached VMAF log, from the most to the least recently used.")
+
+    prune_help = "Delete the least recently used VMAF logs until the cache fits within the given size.\n"
+    prune_help += "Also forgets the hashes of video files that no longer exist."
+    prune_parser = subparsers.add_parser("prune", help=prune_help)
+    prune_parser.add_argument(
+        "-s",
+        "--max-size",
+        "--max_size",
+        dest="max_size",
+        type=float,
+        default=None,
+        help="Maximum cache size in GiB to prune down to (Default is to only forget the hashes of missing files).",
+    )
+
+    subparsers.add_parser("clear", help="Delete every cached VMAF log.")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    cache = VMAF_Cache_Handler(args.cache_dir)
+
+    if args.command == "list":
+        entries = sorted(cache.get_entries().items(), key=lambda item: item[1]["last_used"], reverse=True)
+        for key, entry in entries:
+            print(
+                "{}  {:>10}  score {}  {}".format(key, bytes2human(entry["size"]), entry["score"], entry["description"])
+            )
+        print("{} cached logs using {}".format(len(entries), bytes2human(cache.get_size())))
+    elif args.command == "prune":
+        cache.prune_fingerprints()
+        if args.max_size is not None:
+            evicted = cache.evict(int(args.max_size * 1024**3))
+            print(
+                "Evicted {} cached logs, {} left using {}".format(
+                    evicted, len(cache.get_entries()), bytes2human(cache.get_size())
+                )
+            )
+        cache.save()
+    elif args.command == "clear":
+        evicted = cache.evict(0)
+        cache.prune_fingerprints()
+        cache.save()
+        print("Deleted {} cached logs".format(evicted))
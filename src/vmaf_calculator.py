@@ -1,32 +1,91 @@
 import argparse as argp
 import concurrent.futures as cf
 import multiprocessing as mp
-import subprocess as sp
+import signal
+import sys
+from collections import deque
 from datetime import timedelta
-from json import dump, load
 from pathlib import Path
-from time import time
+from time import sleep, time
 from traceback import print_exc
 
 import ffmpy
-from gooey import Gooey, GooeyParser
-from tqdm import tqdm
 
-from vmaf_common import bytes2human, search_handler
+from vmaf_cache_handler import VMAF_Cache_Handler
+from vmaf_cli_handler import VMAF_Headless_Parser, is_headless, strip_headless
+from vmaf_common import bytes2human, handle_terminate, search_handler
+from vmaf_cost_handler import VMAF_Cost_Handler
+from vmaf_job_handler import (
+    build_job,
+    build_vmaf_filter,
+    build_vmaf_options,
+    escape_log_path,
+    get_job_logs,
+    get_job_size,
+    get_log_file,
+    get_log_location,
+    order_jobs,
+    plan_batches,
+    plan_normalize_filters,
+    plan_refinement,
+    plan_segments,
+    select_normalize_filters,
+)
+from vmaf_lease_handler import LEASE_TIME, VMAF_Lease_Handler
+from vmaf_log_handler import (
+    merge_refined,
+    read_log,
+    read_log_fps,
+    stitch_logs,
+    write_log,
+)
+from vmaf_memory_handler import VMAF_Memory_Handler
+from vmaf_packet_handler import VMAF_Packet_Handler
+from vmaf_probe_handler import (
+    PROBE_CACHE_FILE,
+    VMAF_Probe_Handler,
+    detect_scenes,
+    estimate_frame_bytes,
+    find_frame_mismatches,
+    get_ffprobe,
+)
+from vmaf_profile_handler import PROFILE_FILE, VMAF_Profile_Handler
+from vmaf_sample_handler import estimate_scores, plan_scene_samples
+from vmaf_scheduler import VMAF_Thread_Scheduler
+from vmaf_settings_handler import load_settings
+from vmaf_spool_handler import VMAF_Spool_Handler
+from vmaf_state_handler import VMAF_State_Handler
+from vmaf_stream_handler import (
+    VMAF_Stream_Runner,
+    VMAF_Timeout_Error,
+    create_engine,
+    get_run,
+)
+from vmaf_telemetry_handler import VMAF_Telemetry_Handler, add_usage
+from vmaf_watch_handler import WATCH_INTERVAL, VMAF_Watch_Handler
 
+# Estimated number of decoded frames held in memory for every distorted video
+# file of a batch, between the decoder's reference frames and libvmaf's queue
+BATCH_FRAME_BUFFERS = 8
 
-@Gooey(
-    program_name="VMAF Calculator",
-    default_size=(1280, 720),
-    advanced=True,
-    use_cmd_args=True,
-    navigation="SIDEBAR",
-    show_sidebar=True,
-)
-def parse_arguments() -> argp.Namespace:
-    """Parse user given arguments for calculating VMAF."""
+# Number of pending jobs searched for one that fits into the memory left over,
+# when memory admission holds back the next job
+BACKFILL_WINDOW = 32
+
+# Seconds between updates of the live progress of the running jobs
+PROGRESS_INTERVAL = 1
+
+# History of how fast every VMAF model ran, used for predicting the cost of jobs
+HISTORY_FILE = "vmaf_history.json"
+
+
+def build_parser(parser_class):
+    """Build the parser of the user given arguments for calculating VMAF, either a GooeyParser or a VMAF_Headless_Parser."""
+    # Defaults come from the [vmaf.general] and [vmaf.calculator] sections of
+    # the project's pyproject.toml
+    settings = load_settings()
     main_help = "Multithreaded VMAF log file generator through FFmpeg."
-    parser = GooeyParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+    parser = parser_class(description=main_help, formatter_class=argp.RawTextHelpFormatter)
     subparsers = parser.add_subparsers(help="commands", dest="command")
 
     main_parser = subparsers.add_parser("Files", help="Reference and Distorted file selection")
@@ -101,6 +160,51 @@ def parse_arguments() -> argp.Namespace:
         },
     )
 
+    watch_help = "Keep watching the distorted directories for new video files after the found ones have finished (Default is off).\n"
+    watch_help += "New video files are calculated with every VMAF model as soon as their size and modification time stop changing,\n"
+    watch_help += "so that files still being written by an encoder are left alone until they are complete.\n"
+    watch_help += "New video files are not batched and can not be handed to workers. Stop watching with Ctrl+C, "
+    watch_help += "after which any interrupted calculations are picked up again by continuing."
+    file_args.add_argument(
+        "-w",
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help=watch_help,
+        widget="CheckBox",
+    )
+
+    watch_interval_help = "Specify the seconds between scans of the watched directories (Default is {}).\n".format(
+        WATCH_INTERVAL
+    )
+    watch_interval_help += "A new video file has to stay unchanged for this long before its calculations are queued."
+    file_args.add_argument(
+        "--watch-interval",
+        "--watch_interval",
+        dest="watch_interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help=watch_interval_help,
+        widget="DecimalField",
+        gooey_options={"min": 0.1, "max": 3600},
+    )
+
+    ignore_frame_mismatch_help = (
+        "Calculate distorted video files whose frame count differs from the reference video file's (Default is off).\n"
+    )
+    ignore_frame_mismatch_help += "Every video file is probed before any calculation starts, and distorted video files with dropped or added frames\n"
+    ignore_frame_mismatch_help += (
+        "are skipped by default, since libvmaf would compare their frames against the wrong reference frames."
+    )
+    file_args.add_argument(
+        "--ignore-frame-mismatch",
+        "--ignore_frame_mismatch",
+        dest="ignore_frame_mismatch",
+        action="store_true",
+        help=ignore_frame_mismatch_help,
+        widget="CheckBox",
+    )
+
     ffmpeg_help = "Specify the path to the FFmpeg executable.\n"
     ffmpeg_help = 'Default is "ffmpeg" which assumes that FFmpeg is part of your "Path" environment variable.\n'
     ffmpeg_help += 'The path must either point to the executable itself, or to the directory that contains the executable named "ffmpeg".'
@@ -109,7 +213,7 @@ def parse_arguments() -> argp.Namespace:
         "--ffmpeg",
         dest="ffmpeg",
         type=str,
-        default="ffmpeg",
+        default=settings["general"]["ffmpeg"],
         help=ffmpeg_help,
         widget="FileChooser",
         gooey_options={
@@ -128,9 +232,68 @@ def parse_arguments() -> argp.Namespace:
         "--hwaccel",
         dest="hwaccel",
         action="store_true",
+        default=settings["calculator"]["hwaccel"],
         help=hwaccel_help,
     )
 
+    spool_dir_help = (
+        "Specify a scratch directory to decode the reference video file into before any VMAF calculations start.\n"
+    )
+    spool_dir_help += "Every calculation then reads the raw decoded frames from this spool instead of decoding the reference video file again.\n"
+    spool_dir_help += "Use a fast location such as a RAM disk or a local NVMe drive. A finished spool is reused when continuing a run.\n"
+    spool_dir_help += "A reference video file in a pixel format libvmaf does not read is converted once while spooling."
+    ffmpeg_args.add_argument(
+        "--spool-dir",
+        "--spool_dir",
+        dest="spool_dir",
+        type=str,
+        help=spool_dir_help,
+        widget="DirChooser",
+    )
+
+    spool_max_size_help = "Specify the maximum size in GiB of the reference spool (Default is 0 for no limit).\n"
+    spool_max_size_help += "The reference video file is read directly when its spool would be larger than this, or than the free space of the spool directory."
+    ffmpeg_args.add_argument(
+        "--spool-max-size",
+        "--spool_max_size",
+        dest="spool_max_size",
+        type=int,
+        default=0,
+        help=spool_max_size_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 65536},
+    )
+
+    cache_dir_help = "Specify a directory to cache finished VMAF logs in.\n"
+    cache_dir_help += (
+        "Logs are cached by the contents of the reference, distorted and model files and the VMAF options, "
+    )
+    cache_dir_help += "so a calculation that was already done is copied from the cache instead, even if the video files were moved or renamed.\n"
+    cache_dir_help += (
+        'The cache can be inspected and pruned with "python vmaf_cache_handler.py CACHE_DIR {list,prune,clear}".'
+    )
+    ffmpeg_args.add_argument(
+        "--cache-dir",
+        "--cache_dir",
+        dest="cache_dir",
+        type=str,
+        help=cache_dir_help,
+        widget="DirChooser",
+    )
+
+    cache_max_size_help = "Specify the maximum size in GiB of the VMAF log cache (Default is 0 for no limit).\n"
+    cache_max_size_help += "The least recently used logs are deleted from the cache once it grows past this size."
+    ffmpeg_args.add_argument(
+        "--cache-max-size",
+        "--cache_max_size",
+        dest="cache_max_size",
+        type=int,
+        default=0,
+        help=cache_max_size_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 65536},
+    )
+
     threads_help = 'Specify number of threads to be used for each process (Default is 0 for "autodetect").\n'
     threads_help += "A single VMAF process will effectively max out at 12 threads - any more will provide little to no performance increase.\n"
     threads_help += "The recommended value of threads to use per process is 4-6."
@@ -139,7 +302,7 @@ def parse_arguments() -> argp.Namespace:
         "--threads",
         dest="threads",
         type=int,
-        default=0,
+        default=settings["calculator"]["threads"],
         help=threads_help,
         widget="Slider",
         gooey_options={
@@ -155,7 +318,7 @@ def parse_arguments() -> argp.Namespace:
         "--processes",
         dest="processes",
         type=int,
-        default=1,
+        default=settings["calculator"]["processes"],
         help=proc_help,
         widget="Slider",
         gooey_options={
@@ -164,40 +327,293 @@ def parse_arguments() -> argp.Namespace:
         },
     )
 
-    # rem_threads_help = "Specify whether or not to use remaining threads that don't make a complete process to use for an process.\n"
+    batch_size_help = (
+        "Specify the maximum number of distorted video files to compare in a single FFmpeg process (Default is 1).\n"
+    )
+    batch_size_help += "Values above 1 decode the reference video file once and split it between every distorted video file in the batch,\n"
+    batch_size_help += "instead of decoding the reference video file again for every distorted video file."
+    threading_args.add_argument(
+        "--batch-size",
+        "--batch_size",
+        dest="batch_size",
+        type=int,
+        default=1,
+        help=batch_size_help,
+        widget="IntegerField",
+        gooey_options={"min": 1, "max": 64},
+    )
+
+    batch_memory_help = (
+        "Specify the memory budget in MiB for a single batched FFmpeg process (Default is 0 for no limit).\n"
+    )
+    batch_memory_help += (
+        "Batches are made smaller when the estimated memory of their decoded frames would exceed this budget."
+    )
+    threading_args.add_argument(
+        "--batch-memory",
+        "--batch_memory",
+        dest="batch_memory",
+        type=int,
+        default=0,
+        help=batch_memory_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 1048576},
+    )
+
+    memory_admission_help = "Only start a VMAF calculation process once its estimated peak memory fits into the memory budget (Default is off).\n"
+    memory_admission_help += "The peak memory of every process is estimated from the resolution and pixel format of its video files, its models and threads,\n"
+    memory_admission_help += "and corrected by the peak memory of the processes that already finished.\n"
+    memory_admission_help += "Smaller processes start ahead of a larger one that is waiting for memory, and a process larger than the whole budget runs on its own.\n"
+    memory_admission_help += "Raise the number of processes along with this option to let the memory budget decide how many processes run at once."
+    threading_args.add_argument(
+        "--memory-admission",
+        "--memory_admission",
+        dest="memory_admission",
+        action="store_true",
+        help=memory_admission_help,
+    )
+
+    memory_budget_help = "Specify the memory budget in MiB of all VMAF calculation processes running at once (Default is 0 for the available memory).\n"
+    memory_budget_help += "The available memory is read from /proc/meminfo as the calculations start. Giving a budget also turns on memory admission."
+    threading_args.add_argument(
+        "--memory-budget",
+        "--memory_budget",
+        dest="memory_budget",
+        type=int,
+        default=0,
+        help=memory_budget_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 16777216},
+    )
+
+    segments_help = "Specify the number of time segments to split every VMAF calculation into (Default is 1).\n"
+    segments_help += (
+        "Every segment runs as its own process, so a single long video file can use all of the available processes.\n"
+    )
+    segments_help += (
+        "The logs of all the segments are stitched back together into a single log once they have finished."
+    )
+    threading_args.add_argument(
+        "--segments",
+        dest="segments",
+        type=int,
+        default=1,
+        help=segments_help,
+        widget="IntegerField",
+        gooey_options={"min": 1, "max": 1024},
+    )
+
+    checkpoint_help = (
+        "Specify the seconds of video between the checkpoints of every VMAF calculation (Default is 0 for off).\n"
+    )
+    checkpoint_help += "Every calculation is split into time segments of this length, and the log of every finished segment is kept in the save state.\n"
+    checkpoint_help += "Continuing an interrupted run resumes every calculation after its last finished segment instead of from its first frame,\n"
+    checkpoint_help += "since libvmaf only writes its log once it finishes. The segment logs are stitched into a single log at the end."
+    threading_args.add_argument(
+        "--checkpoint-interval",
+        "--checkpoint_interval",
+        dest="checkpoint_interval",
+        type=float,
+        default=0,
+        help=checkpoint_help,
+        widget="DecimalField",
+        gooey_options={"min": 0, "max": 86400},
+    )
+
+    dynamic_threads_help = "Hand out threads to every VMAF calculation process as it starts (Default is off).\n"
+    dynamic_threads_help += (
+        "Processes get an equal share of the cores left over by the processes that are still running, "
+    )
+    dynamic_threads_help += (
+        "so the last processes use the cores freed up by the finished ones instead of leaving them idle.\n"
+    )
+    dynamic_threads_help += (
+        "Once there are fewer calculations left than free processes, the next calculation is also split "
+    )
+    dynamic_threads_help += "into time segments that run in the idle processes."
+    threading_args.add_argument(
+        "--dynamic-threads",
+        "--dynamic_threads",
+        dest="dynamic_threads",
+        action="store_true",
+        help=dynamic_threads_help,
+    )
+
+    profile_help = "Specify the machine profile made by vmaf_tuner.py (Default is {} next to this program).\n".format(
+        PROFILE_FILE
+    )
+    profile_help += "While the threads are left at 0 and the processes at their default, the threads, decoder threads and processes\n"
+    profile_help += "tuned for the resolution of the reference video file are used instead."
+    threading_args.add_argument(
+        "--profile",
+        dest="profile",
+        type=str,
+        default=str(Path(__file__).parent.joinpath(PROFILE_FILE)),
+        help=profile_help,
+        widget="FileChooser",
+    )
+
+    ignore_profile_help = "Ignore the machine profile, using the given threads and processes as they are."
+    threading_args.add_argument(
+        "--ignore-profile",
+        "--ignore_profile",
+        dest="ignore_profile",
+        action="store_true",
+        help=ignore_profile_help,
+        widget="CheckBox",
+    )
+
+    order_help = 'Specify the order to run the VMAF calculations in (Default is "submission").\n'
+    order_help += '- "submission" runs them in the order the distorted video files and models were found.\n'
+    order_help += '- "distorted" finishes every model for a distorted video file before starting the next one, so its results are moved and its aggregate file written early.\n'
+    order_help += '- "lpt" runs the calculations with the longest predicted time first, which finishes mixed resolution batches sooner.\n'
+    order_help += '- "spt" runs the calculations with the shortest predicted time first, for quicker feedback.\n'
+    order_help += "Predicted times come from the frame count, resolution and models of every calculation, and how fast every model ran before."
+    threading_args.add_argument(
+        "--order",
+        dest="order",
+        choices=["submission", "distorted", "lpt", "spt"],
+        default="submission",
+        help=order_help,
+    )
+
+    lease_dir_help = "Specify a shared directory to publish the VMAF calculations to, for other workers to help with.\n"
+    lease_dir_help += 'Start any number of workers on this or other machines with "python vmaf_worker.py LEASE_DIR", '
+    lease_dir_help += "and they will claim and run the calculations alongside this program.\n"
+    lease_dir_help += "Every worker must see the video files, models and results under the same paths, such as on a shared network drive."
+    threading_args.add_argument(
+        "--lease-dir",
+        "--lease_dir",
+        dest="lease_dir",
+        type=str,
+        help=lease_dir_help,
+        widget="DirChooser",
+    )
+
+    lease_time_help = "Specify the number of seconds a worker can go without renewing its claim on a calculation (Default is {}).\n".format(
+        LEASE_TIME
+    )
+    lease_time_help += "Calculations claimed by a worker that stopped renewing its claims, such as after a crash, are put back into the queue."
+    threading_args.add_argument(
+        "--lease-time",
+        "--lease_time",
+        dest="lease_time",
+        type=int,
+        default=LEASE_TIME,
+        help=lease_time_help,
+        widget="IntegerField",
+        gooey_options={"min": 5, "max": 86400},
+    )
+
+    engine_help = 'Specify how the FFmpeg processes are run (Default is "threads").\n'
+    engine_help += '- "threads" waits on every FFmpeg process from its own thread.\n'
+    engine_help += '- "async" drives every FFmpeg process from a single asyncio event loop, which scales to many more simultaneous processes.'
+    threading_args.add_argument(
+        "--engine",
+        dest="engine",
+        choices=["threads", "async"],
+        default="threads",
+        help=engine_help,
+    )
+
+    timeout_help = (
+        "Specify the number of seconds a single VMAF calculation process may run for (Default is 0 for no limit).\n"
+    )
+    timeout_help += (
+        "Processes that run longer are killed and their logs deleted, while the other calculations carry on."
+    )
+    threading_args.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=int,
+        default=0,
+        help=timeout_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 604800},
+    )
+
+    # rem_threads_help ="Specify whether or not to use remaining threads that don't make a complete process to use for an process.\n"
     # rem_threads_help += "For example, if your system has 16 threads, and you are running 5 processes with 3 threads each, then you will be using 4 * 3 threads, which is 12.\n"
     # rem_threads_help += "This means you will have 1 thread that will remain unused.\n"
     # rem_threads_help += "Using this option would run one more VMAF calculation process with only the single remaining thread.\n"
     # rem_threads_help += "This option is not recommended, as the unused threads will be used to keep the system responsive during the VMAF calculations."
     # threading_args.add_argument("-u", "--use-rem-threads", dest="use_remaining_threads", action="store_true", default=False, help=rem_threads_help, widget="CheckBox",)
 
-    psnr_help = "Enable calculating PSNR values."
+    packets_help = "Write the timestamp, size and key frame flag of every packet of the distorted video files next to their VMAF logs (Default is off).\n"
+    packets_help += "The packets are read by a demux-only pass that runs alongside the VMAF calculations without decoding anything,\n"
+    packets_help += (
+        "and are used by the VMAF Plotter for its bits per frame, bitrate and quality per bit statistics and graphs."
+    )
+    vmaf_args.add_argument(
+        "--packets",
+        dest="packets",
+        action="store_true",
+        help=packets_help,
+        widget="CheckBox",
+    )
+
+    # Every metric has a pair of flags, so that either one overrides the
+    # default taken from the settings
+    psnr_help = "Enable calculating PSNR values (Default is {}).".format(
+        "on" if settings["calculator"]["psnr"] else "off"
+    )
     vmaf_args.add_argument(
         "--psnr",
         dest="psnr",
-        action="store_false",
+        action="store_true",
+        default=settings["calculator"]["psnr"],
         help=psnr_help,
         widget="CheckBox",
     )
+    vmaf_args.add_argument(
+        "--no-psnr",
+        "--no_psnr",
+        dest="psnr",
+        action="store_false",
+        help="Disable calculating PSNR values.",
+        widget="CheckBox",
+    )
 
-    ssim_help = "Enable calculating SSIM values."
+    ssim_help = "Enable calculating SSIM values (Default is {}).".format(
+        "on" if settings["calculator"]["ssim"] else "off"
+    )
     vmaf_args.add_argument(
         "--ssim",
         dest="ssim",
-        action="store_false",
+        action="store_true",
+        default=settings["calculator"]["ssim"],
         help=ssim_help,
         widget="CheckBox",
     )
+    vmaf_args.add_argument(
+        "--no-ssim",
+        "--no_ssim",
+        dest="ssim",
+        action="store_false",
+        help="Disable calculating SSIM values.",
+        widget="CheckBox",
+    )
 
-    ms_ssim_help = "Enable calculating MS-SSIM values."
+    ms_ssim_help = "Enable calculating MS-SSIM values (Default is {}).".format(
+        "on" if settings["calculator"]["ms_ssim"] else "off"
+    )
     vmaf_args.add_argument(
         "--ms-ssim",
         "--ms_ssim",
         dest="ms_ssim",
-        action="store_false",
+        action="store_true",
+        default=settings["calculator"]["ms_ssim"],
         help=ms_ssim_help,
         widget="CheckBox",
     )
+    vmaf_args.add_argument(
+        "--no-ms-ssim",
+        "--no_ms_ssim",
+        dest="ms_ssim",
+        action="store_false",
+        help="Disable calculating MS-SSIM values.",
+        widget="CheckBox",
+    )
 
     subsamples_help = "Specify the number of subsamples to use.\n"
     subsamples_help += "This value only samples the VMAF and related metrics' values once every N frames.\n"
@@ -206,11 +622,94 @@ def parse_arguments() -> argp.Namespace:
     vmaf_args.add_argument(
         "--subsamples",
         dest="subsamples",
+        # A single subsample calculates every frame, which needs no option
+        default=settings["calculator"]["subsamples"] if settings["calculator"]["subsamples"] > 1 else None,
         help=subsamples_help,
         widget="IntegerField",
         gooey_options={"min": 1, "max": 60},
     )
 
+    adaptive_subsamples_help = "Specify the number of subsamples to use for a coarse first pass of every VMAF calculation (Default is 0 for off).\n"
+    adaptive_subsamples_help += "The time ranges of the coarse pass with low or volatile VMAF scores are then calculated again at full density,\n"
+    adaptive_subsamples_help += (
+        "and merged into a single log that records which frames are exact and which were sampled.\n"
+    )
+    adaptive_subsamples_help += (
+        "This gives close to exact worst case scores at a fraction of the time for mostly easy content.\n"
+    )
+    adaptive_subsamples_help += (
+        'Replaces the "--subsamples" argument, can not be combined with segments, and needs the XML or JSON log format.'
+    )
+    vmaf_args.add_argument(
+        "--adaptive-subsamples",
+        "--adaptive_subsamples",
+        dest="adaptive_subsamples",
+        type=int,
+        default=0,
+        help=adaptive_subsamples_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 240},
+    )
+
+    refine_threshold_help = (
+        "Specify the VMAF score that coarse pass samples below are calculated again at full density (Default is 90)."
+    )
+    vmaf_args.add_argument(
+        "--refine-threshold",
+        "--refine_threshold",
+        dest="refine_threshold",
+        type=float,
+        default=90.0,
+        help=refine_threshold_help,
+        widget="DecimalField",
+        gooey_options={"min": 0, "max": 100},
+    )
+
+    refine_delta_help = "Specify how much a coarse pass sample's VMAF score may differ from its neighbours before it is calculated again at full density (Default is 5)."
+    vmaf_args.add_argument(
+        "--refine-delta",
+        "--refine_delta",
+        dest="refine_delta",
+        type=float,
+        default=5.0,
+        help=refine_delta_help,
+        widget="DecimalField",
+        gooey_options={"min": 0, "max": 100},
+    )
+
+    scene_samples_help = "Specify the number of short clips to sample from the reference video file's scenes for estimating its VMAF scores (Default is 0 for off).\n"
+    scene_samples_help += (
+        "The scene cuts of the reference video file are detected with a single low resolution pass first,\n"
+    )
+    scene_samples_help += "after which the clips are spread over the scenes and only the clips are calculated.\n"
+    scene_samples_help += (
+        "The estimated mean and low percentile VMAF scores are written to the aggregate statistics file,\n"
+    )
+    scene_samples_help += "along with their bootstrap confidence intervals and the sampling plan.\n"
+    scene_samples_help += "Replaces adaptive subsampling and segments when given."
+    vmaf_args.add_argument(
+        "--scene-samples",
+        "--scene_samples",
+        dest="scene_samples",
+        type=int,
+        default=0,
+        help=scene_samples_help,
+        widget="IntegerField",
+        gooey_options={"min": 0, "max": 1000},
+    )
+
+    sample_length_help = "Specify the length in seconds of every clip sampled by scene sampling (Default is 2)."
+    vmaf_args.add_argument(
+        "--sample-length",
+        "--sample_length",
+        dest="sample_length",
+        type=float,
+        default=2.0,
+        help=sample_length_help,
+        widget="DecimalField",
+        gooey_options={"min": 0.1, "max": 60},
+    )
+
     model_help = "Specify the VMAF model files to use. This argument expects a list of model files to use.\n"
     model_help += "The program will calculate the VMAF scores for every distorted file, for every model given.\n"
     model_help += "Note that VMAF models come in JSON format, and the program will only accept those models."
@@ -230,10 +729,51 @@ def parse_arguments() -> argp.Namespace:
         "--log-format",
         dest="log_format",
         choices=["xml", "csv", "json"],
-        default="xml",
+        default=settings["calculator"]["log_format"],
         help=log_format_help,
     )
 
+    single_decode_help = "Calculate every given VMAF model for a distorted file in a single FFmpeg process.\n"
+    single_decode_help += (
+        "The reference and distorted video files are decoded once and split between one libvmaf instance per model,\n"
+    )
+    single_decode_help += "instead of being decoded again for every model."
+    vmaf_args.add_argument(
+        "--single-decode",
+        "--single_decode",
+        dest="single_decode",
+        action="store_true",
+        help=single_decode_help,
+        widget="CheckBox",
+    )
+
+    scaler_help = "Specify the scaler used for distorted video files whose resolution differs from the reference video file (Default is accurate).\n"
+    scaler_help += "Such distorted video files, like the lower rungs of an encoding ladder, are scaled up to the reference resolution\n"
+    scaler_help += "inside the filter graph, along with converting any pixel format libvmaf does not read.\n"
+    scaler_help += '- "accurate" uses bicubic scaling, which is what VMAF\'s models were trained on.\n'
+    scaler_help += '- "fast" uses fast bilinear scaling, which is quicker but gives slightly different scores.'
+    vmaf_args.add_argument(
+        "--scaler",
+        dest="scaler",
+        choices=["accurate", "fast"],
+        default="accurate",
+        help=scaler_help,
+    )
+
+    telemetry_help = "Specify a file to save the resource usage of every VMAF calculation process to.\n"
+    telemetry_help += "Every process gets a row with its wall time, user and system CPU time, peak memory, "
+    telemetry_help += "libvmaf's frames per second and the size of its inputs,\n"
+    telemetry_help += 'written as CSV for a ".csv" file and as JSON otherwise. '
+    telemetry_help += "The totals of every dist-model pair are also kept in the save state file,\n"
+    telemetry_help += "and the throughput of every model and resolution is shown once every calculation has finished."
+    misc_args.add_argument(
+        "--telemetry",
+        dest="telemetry",
+        type=str,
+        help=telemetry_help,
+        widget="FileSaver",
+    )
+
     misc_args.add_argument(
         "-v",
         "--version",
@@ -241,44 +781,420 @@ def parse_arguments() -> argp.Namespace:
         version="2021-12-06",
     )
 
-    args = parser.parse_args()
+    return parser
+
 
+def check_arguments(
+    parser,
+    args,
+) -> argp.Namespace:
+    """Check the parsed arguments for calculating VMAF."""
+    # A single distorted location is given as a plain string
+    if isinstance(args.distorted, str):
+        args.distorted = [args.distorted]
     if (not args.model or not args.distorted) and not args.should_continue:
         raise argp.ArgumentParser.error(
             "User specified not to use an existing completions file and did not provide distorted video files and/or VMAF models."
         )
+    if args.watch and (not args.model or not args.distorted):
+        parser.error(
+            "Watching needs the distorted directories to watch and the VMAF models to calculate new video files with."
+        )
+    if args.watch and args.lease_dir:
+        parser.error(
+            "Watching can not be combined with a lease directory, since only the jobs found at the start are published."
+        )
+    if args.scene_samples > 0 and args.sample_length <= 0:
+        parser.error("The sample length of scene sampling has to be above 0 seconds.")
+    if args.adaptive_subsamples > 1 and args.log_format == "csv":
+        parser.error("Adaptive subsampling needs the XML or JSON log format to record which frames are exact.")
 
     return args
 
 
-def read_completions(ref):
-    ref_path = Path(args.reference)
-    completions_file = Path(ref_path.parent.joinpath("{}_completions.json".format(ref_path.stem)))
-    if completions_file.exists():
-        with open(str(completions_file), "r") as reader:
-            return load(reader)
-    else:
-        return {}
+def parse_arguments(argv=None) -> argp.Namespace:
+    """Parse user given arguments for calculating VMAF.
+
+    The arguments are taken from Gooey's window, unless running headless or without Gooey installed,
+    in which case Gooey and wxPython are never imported at all.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not is_headless(argv):
+        try:
+            from gooey import Gooey, GooeyParser
+        except ImportError:
+            print("Could not import Gooey, running headless instead.")
+        else:
+
+            @Gooey(
+                program_name="VMAF Calculator",
+                default_size=(1280, 720),
+                advanced=True,
+                use_cmd_args=True,
+                navigation="SIDEBAR",
+                show_sidebar=True,
+            )
+            def parse_window():
+                parser = build_parser(GooeyParser)
+                return check_arguments(parser, parser.parse_args())
+
+            return parse_window()
+
+    parser = build_parser(VMAF_Headless_Parser)
+    return check_arguments(parser, parser.parse_args(strip_headless(argv)))
+
+
+def stitch_segments(
+    log_path,
+    done,
+):
+    """Stitch the logs of every finished segment into the final log, returning its pooled metrics."""
+    parts = []
+    for segment_log, segment in done:
+        parts.append((read_log(segment_log), segment["first"], segment["start"], segment["end"]))
+    pooled = write_log(log_path, stitch_logs(parts))
+    for segment_log, _ in done:
+        Path(segment_log).unlink(missing_ok=True)
+
+    return pooled
+
+
+def resume_checkpoints(
+    jobs,
+    segments,
+    segment_plan,
+    io,
+    frames,
+):
+    """Drop the segments that an earlier run checkpointed from every job, returning the jobs left to run.
+
+    The checkpointed segment logs of every pair are added to its finished segments. Checkpoints are only
+    used when they come from the same libvmaf options, frame count and segments, and are deleted otherwise.
+    """
+    planned = [(segment["start"], segment["end"]) for segment in segment_plan]
+    for (dist, model), segmenting in segments.items():
+        checkpoint = io[dist][model].pop("checkpoint", None)
+        if checkpoint is None:
+            continue
+        for log_path, segment in checkpoint["done"]:
+            if (
+                checkpoint["commands"] == io[dist][model]["commands"]
+                and checkpoint["frames"] == frames
+                and (segment["start"], segment["end"]) in planned
+                and Path(get_log_file(log_path)).exists()
+            ):
+                segmenting["done"].append((log_path, segment))
+            else:
+                Path(get_log_file(log_path)).unlink(missing_ok=True)
+        # The segment logs only get stitched once a segment finishes, so the
+        # last segment of a pair whose every segment was checkpointed runs again
+        if len(segmenting["done"]) >= segmenting["total"]:
+            segmenting["done"].pop()
+        if len(segmenting["done"]) > 0:
+            io[dist][model]["checkpoint"] = dict(checkpoint, done=segmenting["done"])
+
+    resumed = []
+    for job in jobs:
+        pairs = [
+            pair
+            for pair in job["pairs"]
+            if (job["segment"]["start"], job["segment"]["end"])
+            not in [(segment["start"], segment["end"]) for _, segment in segments[pair]["done"]]
+        ]
+        if len(pairs) > 0:
+            resumed.append(dict(job, pairs=pairs))
+
+    return resumed
+
+
+def plan_jobs(
+    groups,
+    fps,
+    samples,
+    segments,
+    sample_plan=None,
+    segment_plan=None,
+    subsamples=0,
+):
+    """Plan the jobs of every group of dist-model pairs that share a decode.
+
+    With scene sampling every group gets a job for every clip of sample_plan, and with segmenting one
+    for every segment of segment_plan, recording how many of them every pair has in samples or segments.
+    With adaptive subsampling every job is a coarse pass over every Nth frame, N being subsamples.
+    """
+    jobs = []
+    for pairs in groups:
+        if sample_plan:
+            jobs += [{"pairs": pairs, "segment": dict(segment, fps=fps), "sample": True} for segment in sample_plan]
+            for pair in pairs:
+                samples[pair] = {"total": len(sample_plan), "done": []}
+        elif segment_plan:
+            jobs += [{"pairs": pairs, "segment": dict(segment, fps=fps)} for segment in segment_plan]
+            for pair in pairs:
+                segments[pair] = {"total": len(segment_plan), "done": []}
+        elif subsamples > 1:
+            jobs.append({"pairs": pairs, "segment": None, "subsamples": subsamples})
+        else:
+            jobs.append({"pairs": pairs, "segment": None})
+
+    return jobs
 
 
-def write_state(
-    ref,
-    completions,
+def predict_costs(
+    jobs,
+    infos,
+    reference,
+    costs,
+    samples,
+    segments,
+    cost_unit=None,
 ):
-    ref_path = Path(args.reference)
-    completions_file = Path(ref_path.parent.joinpath("{}_completions.json".format(ref_path.stem)))
-    with open(str(completions_file), "w") as reader:
-        dump(
-            completions,
-            reader,
-            indent=4,
-            sort_keys=True,
+    """Predict the cost of every job in seconds, returning the unit of the costs.
+
+    Without a cost_unit, the costs fall back to counting the reports of every job when any of the video
+    files could not be probed. Jobs added to a running batch keep the cost_unit of the batch.
+    """
+    for job in jobs:
+        job["size"] = get_job_size(job, infos, reference)
+        job["cost"] = costs.predict(*job["size"], [model for _, model in job["pairs"]])
+        # libvmaf only runs on every Nth frame of a coarse pass
+        if job.get("subsamples"):
+            job["cost"] /= job["subsamples"]
+    if cost_unit is None:
+        cost_unit = "reports" if any([job["cost"] == 0 for job in jobs]) else "predicted seconds"
+    if cost_unit == "reports":
+        for job in jobs:
+            job["cost"] = (
+                len(job["pairs"]) / segments.get(job["pairs"][0], samples.get(job["pairs"][0], {"total": 1}))["total"]
+            )
+
+    return cost_unit
+
+
+def finish_refinement(
+    log_path,
+    refine,
+    subsamples,
+):
+    """Merge the logs of every refined time range into the coarse log of a calculation, returning its pooled metrics."""
+    parts = []
+    for part_log, segment in refine["done"]:
+        parts.append((read_log(get_log_file(part_log)), segment["first"], segment["start"], segment["end"]))
+    pooled = write_log(get_log_file(log_path), merge_refined(refine["coarse"], parts, subsamples))
+    for part_log, _ in refine["done"]:
+        Path(get_log_file(part_log)).unlink(missing_ok=True)
+
+    return pooled
+
+
+def finish_sampling(
+    log_path,
+    sampling,
+):
+    """Stitch the logs of every sampled clip into the final log, returning the estimated VMAF scores of the whole video.
+
+    The estimate also gets the sampling plan, as a list of the "clips" in (start, end, scene, weight)
+    tuples, or is None if none of the clips have any VMAF scores.
+    """
+    parts = []
+    clips = []
+    for clip_log, segment in sampling["done"]:
+        log = read_log(get_log_file(clip_log))
+        parts.append((log, segment["first"], segment["start"], segment["end"]))
+        scores = []
+        for frame in log["frames"]:
+            if segment["start"] <= frame["frameNum"] + segment["first"] < segment["end"] and "vmaf" in frame["metrics"]:
+                scores.append(frame["metrics"]["vmaf"])
+        clips.append({"scene": segment["scene"], "weight": segment["weight"], "scores": scores})
+    write_log(get_log_file(log_path), stitch_logs(parts))
+    for clip_log, _ in sampling["done"]:
+        Path(get_log_file(clip_log)).unlink(missing_ok=True)
+
+    estimate = estimate_scores(clips)
+    if estimate is not None:
+        estimate["clips"] = sorted(
+            [(segment["start"], segment["end"], segment["scene"], segment["weight"]) for _, segment in sampling["done"]]
         )
 
+    return estimate
 
-if __name__ == "__main__":
-    # Parse command line arguments
-    args = parse_arguments()
+
+def finish_pair(
+    dist,
+    model,
+    score,
+    io,
+    aggregate,
+    state=None,
+):
+    """Mark a dist-model pair as done, saving its score and output message."""
+    io[dist][model]["status"] = "DONE"
+
+    # Prepare the output message for this dist-model combination
+    msg = "\tVMAF Model: {}\n".format(model)
+    log_path = str(Path(io[dist][model]["log_path"]))
+    msg += "\tLog Location: {}\n".format(log_path.replace("\\:", ":").replace('"', "/"))
+
+    if score is not None:
+        # Set the score for this dist-model combination
+        io[dist][model]["score"] = score
+        # Add this score to the overall score of the dist video file between
+        # all models
+        aggregate[dist]["score"] += score
+        msg += "\tVMAF Score: {}\n\n".format(score)
+
+    # Save the dist-model output message for later
+    io[dist][model]["msg"] = msg
+
+    if state is not None:
+        state.record(dist, model, io[dist][model])
+
+
+def skip_mismatch(
+    dist,
+    frames,
+    ref_frames,
+    io,
+    state=None,
+):
+    """Cancel the calculations of a distorted video file whose frame count differs from the reference video file's."""
+    print("Skipping {}, which has {} frames while the reference video file has {}.".format(dist, frames, ref_frames))
+    for model in io[dist].keys():
+        if io[dist][model]["status"] in ["DONE", "MOVED"]:
+            continue
+        io[dist][model]["status"] = "CANCELLED"
+        msg = "\tVMAF Model: {}\n".format(model)
+        msg += "\tStatus: Skipped, the distorted video file has {} frames and the reference video file {}\n".format(
+            frames, ref_frames
+        )
+        io[dist][model]["msg"] = msg
+        if state is not None:
+            state.record(dist, model, io[dist][model])
+
+
+def write_aggregate(
+    dist,
+    io,
+    aggregate,
+    state=None,
+    packets=None,
+    probes=None,
+):
+    """Save the aggregate statistics of a finished distorted video file and move it to its log location."""
+    # The packets are read from the dist video file where it was found
+    if packets is not None:
+        packets.wait(dist)
+
+    # Move the dist video file to the log location
+    dist_path = Path(dist)
+    dist_path_new = aggregate[dist]["log"].parent.joinpath(dist_path.name)
+    dist_path.replace(dist_path_new)
+    if probes is not None:
+        probes.move(dist, dist_path_new)
+
+    # Get the average VMAF score between all model files
+    aggregate[dist]["score"] /= len(io[dist].keys())
+
+    # Save score to aggregate dist's output message
+    tmp_msg = "Average VMAF Score between all tested VMAF models is {}\n"
+    aggregate[dist]["msg"] = tmp_msg.format(aggregate[dist]["score"])
+
+    # Open the aggregate statistics file for writing to
+    with open(aggregate[dist]["log"], "w") as aggregate_file:
+        for model in io[dist].keys():
+            # Write the average score for each model to the
+            # aggregate log file
+            tmp_msg = "{} Score: {}\n"
+            aggregate_file.write(tmp_msg.format(model, io[dist][model]["score"]))
+
+        # Write average VMAF score to aggregate log file
+        tmp_msg = "\nAverage Score: {}\n"
+        aggregate_file.write(tmp_msg.format(aggregate[dist]["score"]))
+
+        # Convert file size to a more human-readable format
+        size_converted = bytes2human(aggregate[dist]["file_size"])
+
+        # Write the size in bytes & the size in human-readable
+        # format to the aggregate log file
+        tmp_msg = "File Size: {}B = {}\n"
+        aggregate_file.write(tmp_msg.format(aggregate[dist]["file_size"], size_converted))
+
+        # Write the estimated scores and the sampling plan of every scene
+        # sampled model, where the scores above are the estimated means
+        for model in io[dist].keys():
+            estimate = io[dist][model].get("estimate")
+            if estimate is None:
+                continue
+            clips = estimate["clips"]
+            aggregate_file.write("\n{} Scene Sampled Estimate:\n".format(model))
+            tmp_msg = "\tMean VMAF: {:.4f} ({:.0%} CI {:.4f} - {:.4f})\n"
+            aggregate_file.write(tmp_msg.format(estimate["mean"], estimate["confidence"], *estimate["mean_ci"]))
+            tmp_msg = "\t{}th Percentile VMAF: {:.4f} ({:.0%} CI {:.4f} - {:.4f})\n"
+            aggregate_file.write(
+                tmp_msg.format(estimate["percentile"], estimate["low"], estimate["confidence"], *estimate["low_ci"])
+            )
+            tmp_msg = "\tSampling Plan: {} clips from {} scene strata, {} of {} frames calculated\n"
+            aggregate_file.write(
+                tmp_msg.format(
+                    len(clips),
+                    len(set([scene for _, _, scene, _ in clips])),
+                    sum([end - start for start, end, _, _ in clips]),
+                    sum([weight for _, _, _, weight in clips]),
+                )
+            )
+            for start, end, scene, weight in clips:
+                tmp_msg = "\t\tFrames {}-{} of scene stratum {}, weighted for {} frames\n"
+                aggregate_file.write(tmp_msg.format(start, end - 1, scene + 1, weight))
+
+    for model in io[dist].keys():
+        io[dist][model]["status"] = "MOVED"
+        if state is not None:
+            state.record(dist, model, io[dist][model])
+
+
+def restore_cached(
+    dist,
+    reference,
+    options,
+    io,
+    aggregate,
+    num_models,
+    cache,
+    cache_keys,
+    state=None,
+):
+    """Copy the logs of the calculations of a distorted video file that were not started yet from the VMAF log cache.
+
+    The cache key of every calculation missing from the cache is kept in cache_keys, for storing its log
+    once it finishes. Returns whether every calculation of the distorted video file is done.
+    """
+    for model in io[dist].keys():
+        if io[dist][model]["status"] != "NOT STARTED":
+            continue
+        try:
+            cache_keys[(dist, model)] = cache.get_key(reference, dist, model, options)
+            entry = cache.restore(cache_keys[(dist, model)], get_log_file(io[dist][model]["log_path"]))
+        except OSError as ose:
+            print("Could not look up {} with {} in the VMAF log cache: {}".format(dist, model, ose))
+            continue
+        if entry is None:
+            continue
+        print("Restored cached VMAF log:\n\tDistorted: {}\n\tModel: {}\n".format(dist, model))
+        del cache_keys[(dist, model)]
+        if entry.get("estimate") is not None:
+            io[dist][model]["estimate"] = entry["estimate"]
+        finish_pair(dist, model, entry["score"], io, aggregate, state)
+        num_models[dist] += 1
+
+    return num_models[dist] == len(io[dist].keys())
+
+
+def main(args):
+    """Run every VMAF calculation of the parsed arguments."""
+    # Only imported once there are calculations to run, which keeps parsing
+    # the arguments fast
+    from tqdm import tqdm
 
     # Create main input/output dictionary
     io = {}
@@ -290,10 +1206,17 @@ if __name__ == "__main__":
         print(ose)
         exit(1)
 
-    # Load the completions file for the given reference video file, if it exists
+    # Load the save state for the given reference video file, if it exists
+    state = VMAF_State_Handler(args.reference)
     completions = {}
     if args.should_continue:
-        completions = read_completions(args.reference)
+        completions = state.load()
+
+    # Reads the packets of every distorted video file in the background
+    packets = VMAF_Packet_Handler(get_ffprobe(args.ffmpeg)) if args.packets else None
+    # Files that did not change since an earlier run are taken from the probe
+    # cache, which follows the distorted video files into their results folders
+    probes = VMAF_Probe_Handler(Path(__file__).parent.joinpath(PROBE_CACHE_FILE), get_ffprobe(args.ffmpeg))
 
     # Exit if we can't get any dis
     if len(completions) == 0 and args.distorted is None:
@@ -318,7 +1241,7 @@ if __name__ == "__main__":
 
         # If no distorted files are found and no completions file exists, then
         # we exit
-        if len(dist_files) == 0 and len(completions) == 0 and not args.should_continue:
+        if len(dist_files) == 0 and len(completions) == 0 and not args.should_continue and not args.watch:
             msg = "Could not find any distorted files in the provided location {} and no completions save state file was provided."
             msg += "The program will now exit."
             raise OSError(msg.format(args.distorted))
@@ -332,6 +1255,8 @@ if __name__ == "__main__":
 
             if len(models) == 0:
                 raise OSError("Could not find any VMAF model files. The program will now exit.")
+            # Every new video file found while watching gets all of the models
+            model_files = list(models)
 
             for dist in dist_files:
                 io[dist] = {}
@@ -352,10 +1277,12 @@ if __name__ == "__main__":
                 # distorted video files are some combination of DONE or MOVED
                 check = [completions[dist][model]["status"] in ["DONE", "MOVED"] for model in completions[dist].keys()]
                 if all(check):
+                    if packets is not None:
+                        packets.wait(dist)
                     # Move the distorted video file and change its' status to MOVED
-                    Path(dist).replace(
-                        Path(dist).parent.joinpath("{}_results".format(Path(dist).stem), Path(dist).name),
-                    )
+                    dist_path_new = Path(dist).parent.joinpath("{}_results".format(Path(dist).stem), Path(dist).name)
+                    Path(dist).replace(dist_path_new)
+                    probes.move(dist, dist_path_new)
                     for model in completions[dist].keys():
                         completions[dist][model]["status"] = "MOVED"
 
@@ -366,6 +1293,16 @@ if __name__ == "__main__":
             for model in models.keys():
                 if model in io[dist]:
                     io[dist][model]["status"] = completions[dist][model]["status"]
+                    # Keep the scores of finished calculations for the aggregate
+                    # statistics of their distorted video file
+                    if "score" in completions[dist][model]:
+                        io[dist][model]["score"] = completions[dist][model]["score"]
+                    if "estimate" in completions[dist][model]:
+                        io[dist][model]["estimate"] = completions[dist][model]["estimate"]
+                    if "telemetry" in completions[dist][model]:
+                        io[dist][model]["telemetry"] = completions[dist][model]["telemetry"]
+                    if "checkpoint" in completions[dist][model]:
+                        io[dist][model]["checkpoint"] = completions[dist][model]["checkpoint"]
                 else:
                     io[dist][model] = {}
                     io[dist][model]["status"] = "NOT STARTED"
@@ -377,7 +1314,7 @@ if __name__ == "__main__":
             if "status" not in io[dist][model]:
                 io[dist][model]["status"] = "NOT STARTED"
 
-    write_state(args.reference, io)
+    state.compact(io)
     aggregate = {}
 
     # Beginning of libvmaf filter
@@ -385,31 +1322,20 @@ if __name__ == "__main__":
         for model in models.keys():
             if io[dist][model]["status"] not in ["DONE", "MOVED"]:
                 io[dist][model]["status"] = "NOT STARTED"
-            # Start libvmaf filter and plug in vmaf model
-            tmp_filter = "libvmaf=model_path={}".format(model).replace("\\", "/").replace(":", "\\:")
-            # Add specified log format argument to libvmaf filter
-            tmp_filter += ":log_fmt={}".format(args.log_format)
-
-            # Get dist path for creating results folder next to it
-            dist_path = Path(dist)
-            dist_parent = dist_path.parent
+            # Start libvmaf filter with the vmaf model and log format
+            tmp_filter = build_vmaf_filter(model, args.log_format)
+
             # Used for the final log location for each distorted file
-            log_loc = None
+            log_loc = get_log_location(dist, model, args.log_format)
 
             # Attempt to create a new directory for storing the log results
             try:
-                log_dir = dist_parent.joinpath("{}_results".format(dist_path.stem))
+                log_dir = log_loc.parent
                 log_dir.mkdir(exist_ok=True)
-                log_loc = "{}_{}.{}".format(
-                    dist_path.stem,
-                    Path(model).stem,
-                    args.log_format,
-                )
-                log_loc = log_dir.joinpath(log_loc)
 
                 if dist not in aggregate.keys():
                     aggregate[dist] = {}
-                    aggregate_log = "{}_aggregate.txt".format(dist_path.stem)
+                    aggregate_log = "{}_aggregate.txt".format(Path(dist).stem)
                     aggregate[dist]["log"] = log_dir.joinpath(aggregate_log)
                     aggregate[dist]["file_size"] = Path(dist).stat().st_size
                     aggregate[dist]["score"] = 0
@@ -419,39 +1345,237 @@ if __name__ == "__main__":
                 exit(1)
 
             # Clean up the log path for windows systems
-            io[dist][model]["log_path"] = str(log_loc).replace("\\", "/").replace(":", "\\:")
+            io[dist][model]["log_path"] = escape_log_path(log_loc)
             if io[dist][model]["status"] == "NOT STARTED":
                 Path(io[dist][model]["log_path"]).unlink(missing_ok=True)
-            # Save the libmvaf filter arguments and log path into the commands key
-            io[dist][model]["commands"] = "{}:log_path={}".format(tmp_filter, io[dist][model]["log_path"])
+            # Save the libmvaf filter arguments into the commands key, the log
+            # path is added when building each job
+            io[dist][model]["commands"] = tmp_filter
 
     # 2nd part of the libvmaf filter
-    tmp_filter = ""
-    if args.psnr:
-        tmp_filter += ":psnr=1"
-    if args.ssim:
-        tmp_filter += ":ssim=1"
-    if args.ms_ssim:
-        tmp_filter += ":ms_ssim=1"
-    if args.subsamples:
-        tmp_filter += ":n_subsample={}".format(args.subsamples)
-    if args.threads != 0:
-        tmp_filter += ":n_threads={}".format(args.threads)
+    # Adaptive subsampling sets the subsamples of every pass itself
+    subsamples = None if args.adaptive_subsamples > 1 else args.subsamples
+    tmp_filter = build_vmaf_options(args.psnr, args.ssim, args.ms_ssim, subsamples)
 
     # Combine all the filter arguments and save them for each dist-model dict
     for dist, models in io.items():
         for model in models.keys():
             if io[dist][model]["status"] == "NOT STARTED":
                 io[dist][model]["commands"] += tmp_filter
-                io[dist][model]["commands"] = repr(io[dist][model]["commands"])
-                io[dist][model]["commands"] = "-filter_complex " + io[dist][model]["commands"] + " -f null"
+
+    # Used to count how many models have been processed for a given distorted
+    # video file
+    num_models = {}
+    for dist in io.keys():
+        num_models[dist] = 0
+        # Models that finished in an earlier run count towards the aggregate
+        # statistics as well
+        for model in io[dist].keys():
+            if io[dist][model]["status"] == "DONE":
+                num_models[dist] += 1
+                aggregate[dist]["score"] += io[dist][model].get("score", 0)
+    dist_finished = 0
+    dists_total = len(io.keys()) * len(list(io.values())[0]) if len(io) > 0 else 0
+
+    # Copy the logs of calculations that were already done from the cache,
+    # keeping the cache key of every other calculation for storing its log
+    cache = None
+    cache_keys = {}
+    if args.cache_dir:
+        try:
+            cache = VMAF_Cache_Handler(args.cache_dir, max_size=args.cache_max_size)
+        except OSError as ose:
+            print(ose)
+            print("Could not open the VMAF log cache, running without it.")
+    if cache is not None:
+        options = "{}:log_fmt={}".format(tmp_filter, args.log_format)
+        # Only distorted video files that get scaled depend on the scaler,
+        # which were never cached before it could be chosen
+        if args.scaler != "accurate":
+            options += ":scaler={}".format(args.scaler)
+        if args.scene_samples > 0:
+            options += ":samples={}:{}".format(args.scene_samples, args.sample_length)
+        elif args.adaptive_subsamples > 1:
+            options += ":adaptive={}:{}:{}".format(args.adaptive_subsamples, args.refine_threshold, args.refine_delta)
+        for dist in io.keys():
+            if restore_cached(dist, args.reference, options, io, aggregate, num_models, cache, cache_keys, state):
+                dist_finished += 1
+                write_aggregate(dist, io, aggregate, state, packets, probes)
+
+    # Group the dist-model pairs into FFmpeg jobs. Each job decodes its inputs
+    # once, so with single decode mode all models of a distorted video file
+    # share a single job.
+    jobs = []
+    for dist, models in io.items():
+        pairs = [(dist, model) for model in models.keys() if io[dist][model]["status"] not in ["DONE", "MOVED"]]
+        if args.single_decode and len(pairs) > 0:
+            jobs.append(pairs)
+        else:
+            jobs += [[pair] for pair in pairs]
+
+    # Probe the reference and every distorted video file that still has
+    # calculations left, for planning and ordering the jobs
+    infos = {}
+    if len(jobs) > 0 or args.watch:
+        dists = list(dict.fromkeys([dist for pairs in jobs for dist, _ in pairs]))
+        infos = probes.probe_files([args.reference] + dists)
+        probes.save()
+    ref_info = infos.get(args.reference)
+
+    # A distorted video file with a different frame count gets compared
+    # against the wrong reference frames, which is caught before any
+    # calculation runs instead of after all of them
+    if not args.ignore_frame_mismatch:
+        mismatches = find_frame_mismatches(infos, args.reference, list(infos.keys()))
+        for dist, frames in mismatches.items():
+            skip_mismatch(dist, frames, ref_info["frames"], io, state)
+        jobs = [pairs for pairs in jobs if pairs[0][0] not in mismatches]
+
+    # Start reading the packets of every distorted video file that has
+    # calculations left, which finishes long before libvmaf does
+    if packets is not None:
+        for dist in dict.fromkeys([dist for pairs in jobs for dist, _ in pairs]):
+            packets.submit(dist)
+
+    # Scale every distorted video file to the resolution of the reference
+    # video file, and convert both to a pixel format libvmaf reads, inside the
+    # filter graph instead of in a separate pass
+    normalize = plan_normalize_filters(infos, args.reference, list(io.keys()), args.scaler)
+    scaled = [dist for dist, chain in normalize["distorted"].items() if "scale=" in chain]
+    if len(scaled) > 0:
+        print(
+            "Scaling {} distorted video files to the reference resolution of {}x{}.\n".format(
+                len(scaled), ref_info["width"], ref_info["height"]
+            )
+        )
+    # The filters used for this reference video file, whose conversion is left
+    # out once the reference spool holds the converted frames
+    ref_normalize = normalize
+
+    # Use the layout tuned for the reference video file's resolution on this
+    # machine, unless the user picked the threads or processes themselves
+    decode_threads = 1
+    use_profile = args.threads == 0 and args.processes == load_settings()["calculator"]["processes"]
+    if ref_info is not None and use_profile and not args.ignore_profile and not args.dynamic_threads:
+        layout = None
+        if Path(args.profile).is_file():
+            layout = VMAF_Profile_Handler(args.profile).get_layout(ref_info["width"], ref_info["height"])
+        if layout is not None:
+            args.threads = layout["threads"]
+            args.processes = layout["processes"]
+            decode_threads = layout["decode_threads"]
+            print(
+                "Using the machine profile tuned for {}: {} processes x {} threads with {} decoder threads.\n".format(
+                    layout["class"], args.processes, args.threads, decode_threads
+                )
+            )
+
+    # With batching, jobs for different distorted video files are merged so
+    # that the reference video file is only decoded once per batch
+    if args.batch_size > 1:
+        dist_memory = {}
+        if args.batch_memory > 0:
+            for dist in io.keys():
+                if dist in infos:
+                    dist_memory[dist] = estimate_frame_bytes(infos[dist]) * BATCH_FRAME_BUFFERS
+
+        # Jobs are batched separately for every model, or for every full set of
+        # models when using single decode mode
+        batched_jobs = {}
+        for pairs in jobs:
+            key = tuple([model for _, model in pairs])
+            if key not in batched_jobs:
+                batched_jobs[key] = {}
+            batched_jobs[key][pairs[0][0]] = pairs
+        jobs = []
+        for key, dist_jobs in batched_jobs.items():
+            for batch in plan_batches(dist_jobs.keys(), args.batch_size, args.batch_memory, dist_memory):
+                jobs.append([pair for dist in batch for pair in dist_jobs[dist]])
+
+    # With scene sampling, only short clips spread over the scenes of the
+    # reference video file are calculated, from which the scores of every job
+    # are estimated once all of its clips have finished
+    samples = {}
+    sampled = False
+    can_segment = ref_info is not None and ref_info["frames"] > 0 and ref_info["fps"] > 0
+    sample_plan = []
+    if args.scene_samples > 0 and (len(jobs) > 0 or args.watch):
+        if can_segment:
+            sampled = True
+            cuts = detect_scenes(args.reference, ref_info["fps"], ffmpeg=args.ffmpeg)
+            clip_frames = max(1, int(round(args.sample_length * ref_info["fps"])))
+            sample_plan = plan_scene_samples(ref_info["frames"], cuts, args.scene_samples, clip_frames)
+            print(
+                "Sampling {} clips of up to {} frames from {} scenes of the reference video file.".format(
+                    len(sample_plan), clip_frames, len(cuts) + 1
+                )
+            )
+        else:
+            print("Could not get the frame count of the reference video file, running without scene sampling.")
+
+    # With adaptive subsampling, every job first runs a coarse pass over every
+    # Nth frame, after which the time ranges with low or volatile scores are
+    # calculated again at full density and merged into its log
+    refines = {}
+    adaptive = False
+    if sampled and args.adaptive_subsamples > 1:
+        print("Scene sampling replaces adaptive subsampling, running without adaptive subsampling.")
+    elif args.adaptive_subsamples > 1 and (len(jobs) > 0 or args.watch):
+        if can_segment:
+            adaptive = True
+        else:
+            print("Could not get the frame count of the reference video file, running without adaptive subsampling.")
+
+    # With segmenting, every job is split into time segments that run
+    # concurrently and are stitched back together once they have all finished
+    segments = {}
+    segment_plan = []
+    segmenting = args.segments > 1 or args.checkpoint_interval > 0
+    if sampled and segmenting:
+        print("Scene sampling replaces segments and checkpoints, running without them.")
+    elif adaptive and segmenting:
+        print("Adaptive subsampling can not be combined with segments or checkpoints, running without them.")
+    elif segmenting and (len(jobs) > 0 or args.watch):
+        if can_segment:
+            # Checkpoints are the ends of segments, so there is at least one
+            # segment for every checkpoint interval
+            segment_count = args.segments
+            if args.checkpoint_interval > 0:
+                checkpoint_frames = max(1, int(round(args.checkpoint_interval * ref_info["fps"])))
+                segment_count = max(segment_count, -(-ref_info["frames"] // checkpoint_frames))
+            segment_plan = plan_segments(ref_info["frames"], segment_count)
+        else:
+            print("Could not get the frame count of the reference video file, running without segments.")
+
+    # Files found while watching get their jobs planned the same way, so the
+    # plans are kept for them
+    coarse_subsamples = args.adaptive_subsamples if adaptive else 0
+    ref_fps = ref_info["fps"] if can_segment else 0
+    jobs = plan_jobs(jobs, ref_fps, samples, segments, sample_plan, segment_plan, coarse_subsamples)
+    if len(segment_plan) > 0 and args.checkpoint_interval > 0:
+        planned = len(jobs)
+        jobs = resume_checkpoints(jobs, segments, segment_plan, io, ref_info["frames"])
+        if len(jobs) < planned:
+            print(
+                "Resuming from the checkpoints of an earlier run, skipping {} finished segments.".format(
+                    sum([len(pair_segments["done"]) for pair_segments in segments.values()])
+                )
+            )
+
+    # Predict the cost of every job in seconds, falling back to counting the
+    # reports of every job when any of the video files could not be probed
+    costs = VMAF_Cost_Handler(Path(__file__).parent.joinpath(HISTORY_FILE))
+    cost_unit = predict_costs(jobs, infos, args.reference, costs, samples, segments)
+
+    # Order the jobs by the chosen policy
+    jobs = order_jobs(jobs, list(io.keys()), args.order)
 
     # Create input arguments, are just related to decoding the reference and
     # distorted video files
-    decode = "-threads 1"
+    decode = ""
     if args.hwaccel:
         # decode += " -c:v h264_cuvid -hwaccel auto"
-        decode += " -hwaccel auto"
+        decode += "-hwaccel auto"
         # decode += " -c:v h264_cuvid "
 
     # Holds the concurrent.futures.Future objects from the ThreadPoolExecutor's
@@ -459,151 +1583,572 @@ if __name__ == "__main__":
     # name as values
     my_ffs = {}
 
-    # Used to count how many models have been processed for a given distorted
-    # video file
-    num_models = {}
-    for dist in io.keys():
-        num_models[dist] = 0
-    dist_finished = 0
-    dists_total = len(io.keys()) * len(list(io.values())[0])
-
     # Semi-global check if the Futures were cancelled
     # If this is set to True at any point, then we stop writing any aggregate
     # score files and do not move the video files
     was_cancelled = False
 
-    cf_handler = cf.ThreadPoolExecutor(max_workers=args.processes)
+    # Input arguments for the reference video file, which are swapped out for
+    # the reference spool when one is used
+    ref_input = str(args.reference)
+    ref_decode = decode
+    spool = None
+    leases = None
+
+    # Estimates the peak memory of every job, for only admitting the jobs that
+    # fit into the memory budget
+    memory = None
+    if args.memory_admission or args.memory_budget > 0:
+        memory = VMAF_Memory_Handler(args.memory_budget * 1024 * 1024)
+        if memory.get_budget() is None:
+            print("Could not read the available memory of this system, running without memory admission.")
+            memory = None
+        else:
+            print("Admitting VMAF calculation processes within {} of memory.".format(bytes2human(memory.get_budget())))
+
+    # Hands out the threads of every job and tracks the free process slots
+    scheduler = VMAF_Thread_Scheduler(
+        processes=args.processes,
+        threads=args.threads,
+        dynamic=args.dynamic_threads,
+        memory_budget=memory.get_budget() if memory is not None else 0,
+    )
+
+    # Resource usage of every finished job
+    telemetry = VMAF_Telemetry_Handler(args.telemetry)
+
+    # Stop the same way as on a KeyboardInterrupt when terminated
+    signal.signal(signal.SIGTERM, handle_terminate)
+
+    cf_handler = create_engine(args.engine, args.processes)
     start = time()
     try:
-        # For every distorted video file
-        for dist, models in io.items():
-            # For every model to test the distorted video with
-            for model, data in models.items():
-                if io[dist][model]["status"] in ["DONE", "MOVED"]:
-                    continue
-                # Submit an ffmpy task to the pool
-                msg = "Submitting VMAF calculation:\n\tReference: {}\n\tDistorted: {}\n\tModel: {}\n\tLog File: {}\n"
-                print(
-                    msg.format(
-                        args.reference,
-                        dist,
-                        model,
-                        io[dist][model]["log_path"],
-                    )
-                )
-
-                # Create the ffmpy.FFmpeg class containing the inputs and output
-                # commands
-                ff_tmp = ffmpy.FFmpeg(
-                    executable=args.ffmpeg,
-                    global_options=[
-                        "-hide_banner",
-                    ],
-                    inputs={dist: decode, str(args.reference): decode},
-                    outputs={"-": str(data["commands"])},
+        # Decode the reference video file once into a raw spool for every job
+        if args.spool_dir and (len(jobs) > 0 or args.watch):
+            spool = VMAF_Spool_Handler(
+                args.reference,
+                args.spool_dir,
+                ffmpeg=args.ffmpeg,
+                max_size=args.spool_max_size,
+                pix_fmt=normalize["pix_fmt"] if normalize["reference"] else None,
+            )
+            try:
+                ref_input = spool.create()
+                ref_decode = ""
+                ref_normalize = dict(normalize, reference="")
+            except (OSError, ffmpy.FFRuntimeError) as e:
+                print(e)
+                print("Could not create the reference spool, reading the reference video file directly instead.")
+                spool.cancel()
+                spool = None
+
+        # Jobs are only submitted to the pool once a process slot frees up, so
+        # that every job gets its threads from the cores that are free by then
+        pending = deque(jobs)
+        running = set()
+        finished_cost = 0
+
+        # With a lease directory the jobs are published for any worker to
+        # claim, and this process claims them the same way the workers do
+        lease_jobs = {}
+        if args.lease_dir and len(jobs) > 0:
+            leases = VMAF_Lease_Handler(args.lease_dir, lease_time=args.lease_time)
+            # Workers normalise the inputs of every job the same way
+            for job in jobs:
+                job["normalize"] = select_normalize_filters(normalize, [dist for dist, _ in job["pairs"]])
+            lease_jobs = dict(zip(leases.publish(jobs, io, args.reference), jobs))
+            pending.clear()
+            print("Published {} VMAF calculation jobs to {}".format(len(lease_jobs), args.lease_dir))
+            for job in jobs:
+                for dist, model in job["pairs"]:
+                    io[dist][model]["status"] = "STARTED"
+                    state.record(dist, model, io[dist][model])
+
+        # Scan the distorted directories for new video files for as long as
+        # the program keeps running
+        watcher = None
+        if args.watch:
+            watcher = VMAF_Watch_Handler(args.distorted, interval=args.watch_interval)
+            print(
+                "Watching {} for new distorted video files every {} seconds.".format(
+                    ", ".join([str(dist) for dist in args.distorted]), watcher.get_interval()
                 )
+            )
 
-                # Submit the actual run Future as a key
-                my_ffs[cf_handler.submit(ff_tmp.run, stdout=sp.PIPE, stderr=sp.PIPE,)] = {
-                    "ff": ff_tmp,
-                    "dist": dist,
-                    "model": model,
-                }
-                io[dist][model]["status"] = "STARTED"
-
-        # After submitting all tasks, have a tqdm progress bar measure the progress
+        # The progress bar moves by the predicted cost of every finished job,
+        # so that its ETA accounts for jobs of different lengths
         with tqdm(
             desc="Processing VMAF calculations",
-            total=len(my_ffs),
-            unit="reports",
+            total=sum([job["cost"] for job in jobs]),
+            unit=cost_unit,
+            bar_format="{l_bar}{bar}| {n:.0f}/{total:.0f} {unit} [{elapsed}<{remaining}{postfix}]",
             position=0,
             leave=True,
         ) as pbar:
             pbar.set_postfix({"Distorted videos finished": "0 : 0%"})
-            # Wait and iterate over completed Futures
-            for task in cf.as_completed(my_ffs):
-                # Dict containing the "dist" and "model" keys
-                out = my_ffs[task]
-                dist = out["dist"]
-                model = out["model"]
-
-                io[dist][model]["status"] = "DONE"
-
-                # Contains the actual stdout and stderr of the ffmpy call
-                # In our case we only need the stderr
-                err = task.result()[1]
-
-                # Prepare the output message for this dist-model combination
-                msg = "\tVMAF Model: {}\n".format(model)
-                log_path = str(Path(io[dist][model]["log_path"]))
-                msg += "\tLog Location: {}\n".format(log_path.replace("\\:", ":").replace('"', "/"))
-
-                # Look for the average VMAF score given in the stderr
-                for line in err.decode("utf-8").split("\n"):
-                    if "VMAF score" in line:
-                        vmaf_score = float(line.split("]")[1].split(": ")[1].strip())
-                        # Set the score for this dist-model combination
-                        io[dist][model]["score"] = vmaf_score
-                        # Add this score to the overall score of the dist video
-                        # file between all models
-                        aggregate[dist]["score"] += vmaf_score
-                        msg += "\tVMAF Score: {}\n\n".format(vmaf_score)
+            while len(pending) > 0 or len(running) > 0 or len(lease_jobs) > 0 or watcher is not None:
+                # Queue the calculations of every new distorted video file in
+                # the watched directories, once it has stopped changing
+                watched = watcher.poll(io.keys()) if watcher is not None else []
+                mismatches = {}
+                if len(watched) > 0:
+                    infos.update(probes.probe_files(watched))
+                    probes.save()
+                    if not args.ignore_frame_mismatch:
+                        mismatches = find_frame_mismatches(infos, args.reference, watched)
+                    # The reference filters are shared with every view of the
+                    # plan, so only the distorted filters are added
+                    normalize["distorted"].update(
+                        plan_normalize_filters(infos, args.reference, watched, args.scaler)["distorted"]
+                    )
+                watched_jobs = []
+                for dist in watched:
+                    try:
+                        log_dir = get_log_location(dist, model_files[0], args.log_format).parent
+                        log_dir.mkdir(exist_ok=True)
+                        file_size = Path(dist).stat().st_size
+                    except OSError as ose:
+                        print(ose)
+                        continue
+                    print("Found new distorted video file {}".format(dist))
+                    io[dist] = {}
+                    num_models[dist] = 0
+                    aggregate[dist] = {
+                        "log": log_dir.joinpath("{}_aggregate.txt".format(Path(dist).stem)),
+                        "file_size": file_size,
+                        "score": 0,
+                    }
+                    for model in model_files:
+                        log_loc = get_log_location(dist, model, args.log_format)
+                        log_loc.unlink(missing_ok=True)
+                        io[dist][model] = {
+                            "status": "NOT STARTED",
+                            "log_path": escape_log_path(log_loc),
+                            "commands": build_vmaf_filter(model, args.log_format) + tmp_filter,
+                        }
+                        state.record(dist, model, io[dist][model])
+                    if cache is not None and restore_cached(
+                        dist, args.reference, options, io, aggregate, num_models, cache, cache_keys, state
+                    ):
+                        dist_finished += 1
+                        write_aggregate(dist, io, aggregate, state, packets, probes)
+                        continue
+                    if dist in mismatches:
+                        skip_mismatch(dist, mismatches[dist], ref_info["frames"], io, state)
+                        continue
+                    if packets is not None:
+                        packets.submit(dist)
+
+                    # New video files are planned the same way as the ones
+                    # found at the start, without batching them together
+                    dist_pairs = [(dist, model) for model in model_files if io[dist][model]["status"] == "NOT STARTED"]
+                    groups = [dist_pairs] if args.single_decode else [[pair] for pair in dist_pairs]
+                    watched_jobs += plan_jobs(
+                        groups, ref_fps, samples, segments, sample_plan, segment_plan, coarse_subsamples
+                    )
+                predict_costs(watched_jobs, infos, args.reference, costs, samples, segments, cost_unit)
+                pbar.total += sum([job["cost"] for job in watched_jobs])
+                pending.extend(watched_jobs)
+
+                # Fill every free process slot with the next job
+                while scheduler.get_free_slots() > 0:
+                    lease_id = None
+                    job_io = io
+                    job_ref = ref_input
+                    job_ref_decode = ref_decode
+                    job_normalize = ref_normalize
+                    if leases is not None:
+                        claimed = leases.claim()
+                        if claimed is None:
+                            break
+                        lease_id, lease = claimed
+                        job = lease["job"]
+                        job_io = lease["io"]
+                        # Only jobs of this reference video file can use its spool
+                        if lease["reference"] != args.reference:
+                            job_ref = lease["reference"]
+                            job_ref_decode = decode
+                            job_normalize = job.get("normalize")
+                    elif len(pending) > 0:
+                        # With memory admission, the first job that fits into the
+                        # memory left over starts next, so that smaller jobs
+                        # backfill around a larger one that is waiting for memory
+                        index = 0
+                        if memory is not None:
+                            admit_threads = scheduler.plan(len(pending)) or scheduler.get_cores()
+                            index = None
+                            for i in range(min(len(pending), BACKFILL_WINDOW)):
+                                if scheduler.fits(memory.estimate(pending[i], infos, args.reference, admit_threads)):
+                                    index = i
+                                    break
+                            if index is None:
+                                break
+                        job = pending[index]
+                        del pending[index]
+                    else:
                         break
+                    pairs = job["pairs"]
+
+                    # Once there are fewer jobs left than free slots, split the
+                    # next job into segments so that the idle slots get used
+                    split = scheduler.plan_split(len(pending) + 1)
+                    if split > 1 and job["segment"] is None and can_segment and not adaptive and leases is None:
+                        # The segments of the --segments option are planned
+                        # separately, which files found while watching still use
+                        split_plan = plan_segments(ref_info["frames"], split)
+                        if len(split_plan) > 1:
+                            split_jobs = [
+                                {"pairs": pairs, "segment": dict(segment, fps=ref_info["fps"])}
+                                for segment in split_plan
+                            ]
+                            # Split the predicted cost by the share of frames
+                            # of every segment
+                            for split_job in split_jobs:
+                                split_job["size"] = (split_job["segment"]["count"], job["size"][1])
+                                share = split_job["segment"]["count"] / ref_info["frames"]
+                                split_job["cost"] = job["cost"] * share
+                            for pair in pairs:
+                                segments[pair] = {"total": len(split_jobs), "done": []}
+                            job = split_jobs[0]
+                            pending.extendleft(reversed(split_jobs[1:]))
+
+                    # Hand out the threads for this job
+                    threads = scheduler.plan(len(pending) + 1)
+                    job_memory = 0
+                    raw_memory = 0
+                    if memory is not None:
+                        raw_memory = memory.estimate_raw(job, infos, args.reference, threads or scheduler.get_cores())
+                        job_memory = memory.estimate(job, infos, args.reference, threads or scheduler.get_cores())
+
+                    # Submit an ffmpy task to the pool
+                    msg = "Submitting VMAF calculation:\n\tReference: {}\n".format(job_ref)
+                    if job["segment"] is not None and pairs[0] in segments:
+                        msg += "\tSegment: {} of {}\n".format(job["segment"]["index"] + 1, segments[pairs[0]]["total"])
+                    elif job.get("sample") and pairs[0] in samples:
+                        msg += "\tClip: {} of {} (frames {}-{})\n".format(
+                            job["segment"]["index"] + 1,
+                            samples[pairs[0]]["total"],
+                            job["segment"]["start"],
+                            job["segment"]["end"] - 1,
+                        )
+                    elif job["segment"] is not None:
+                        msg += "\tSegment: {}\n".format(job["segment"]["index"] + 1)
+                    if scheduler.is_dynamic():
+                        msg += "\tThreads: {}\n".format(threads)
+                    if memory is not None:
+                        msg += "\tEstimated Memory: {}\n".format(bytes2human(job_memory))
+                    for dist, model, log_path in get_job_logs(job, job_io):
+                        msg += "\tDistorted: {}\n\tModel: {}\n\tLog File: {}\n".format(
+                            dist,
+                            model,
+                            log_path,
+                        )
+                    print(msg)
+
+                    # With dynamic threads the decoders of the job's inputs share
+                    # its threads as well
+                    job_decode_threads = decode_threads
+                    if scheduler.is_dynamic():
+                        inputs = len(set([dist for dist, _ in pairs])) + 1
+                        job_decode_threads = max(1, threads // inputs)
+
+                    # Create the ffmpy.FFmpeg class containing the inputs and output
+                    # commands
+                    ff_tmp = build_job(
+                        job,
+                        job_io,
+                        job_ref,
+                        decode,
+                        job_ref_decode,
+                        args.ffmpeg,
+                        threads=threads,
+                        decode_threads=job_decode_threads,
+                        normalize=job_normalize,
+                    )
 
-                # Save the dist-model output message for later
-                io[dist][model]["msg"] = msg
+                    # Submit the actual run Future as a key, streaming the
+                    # command's progress and stderr while it runs
+                    runner = VMAF_Stream_Runner(
+                        ff_tmp,
+                        frames=job["size"][0],
+                        timeout=args.timeout,
+                        logs=[get_log_file(log_path) for _, _, log_path in get_job_logs(job, job_io)],
+                    )
+                    task = cf_handler.submit(get_run(runner, args.engine))
+                    my_ffs[task] = {
+                        "ff": ff_tmp,
+                        "runner": runner,
+                        "pairs": pairs,
+                        "job": job,
+                        "io": job_io,
+                        "lease": lease_id,
+                        "threads": threads,
+                        "memory": raw_memory,
+                        "start": time(),
+                    }
+                    running.add(task)
+                    scheduler.start(task, threads, memory=job_memory)
+                    if leases is None:
+                        for dist, model in pairs:
+                            io[dist][model]["status"] = "STARTED"
+                            state.record(dist, model, io[dist][model])
+
+                # Wait for any of the running Futures to complete, showing the
+                # live progress of the running ones in the meantime
+                done = set()
+                if len(running) > 0:
+                    done, _ = cf.wait(running, timeout=PROGRESS_INTERVAL, return_when=cf.FIRST_COMPLETED)
+                else:
+                    sleep(PROGRESS_INTERVAL)
+
+                # Jobs finished since the last check, as (job, VMAF scores,
+                # seconds taken, error, resource usage) tuples
+                finished_jobs = []
+                for task in done:
+                    running.discard(task)
+                    scheduler.finish(task)
+                    seconds = time() - my_ffs[task]["start"]
+                    usage = dict(my_ffs[task]["runner"].get_usage(), threads=my_ffs[task]["threads"])
+                    # Correct the memory estimates of the jobs still to start
+                    if memory is not None:
+                        memory.record(my_ffs[task]["job"], my_ffs[task]["memory"], usage["max_rss"])
+
+                    # The average VMAF score of every libvmaf instance, read from
+                    # the stderr of the ffmpy call as it ran
+                    if my_ffs[task]["lease"] is not None:
+                        # Failed jobs are handed back to whoever published them
+                        # instead of stopping this worker
+                        try:
+                            leases.complete(my_ffs[task]["lease"], task.result(), seconds, usage=usage)
+                        except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+                            leases.complete(my_ffs[task]["lease"], [], seconds, error=str(e), usage=usage)
+                    else:
+                        # Jobs that ran past their timeout fail on their own,
+                        # while any other error stops every calculation
+                        try:
+                            finished_jobs.append((my_ffs[task]["job"], task.result(), seconds, None, usage))
+                        except VMAF_Timeout_Error as e:
+                            finished_jobs.append((my_ffs[task]["job"], [], seconds, str(e), usage))
+
+                # Pick up the jobs of this reference video file that were
+                # finished by any worker, including this one
+                collected = {}
+                if leases is not None:
+                    leases.renew()
+                    collected = leases.collect(lease_jobs.keys())
+                    for lease_id, lease in collected.items():
+                        job = lease_jobs.pop(lease_id)
+                        finished_jobs.append(
+                            (job, lease["scores"], lease["seconds"], lease["error"], lease.get("usage"))
+                        )
+
+                for job, scores, seconds, error, usage in finished_jobs:
+                    finished_cost += job["cost"]
+
+                    # Record the resource usage of the job before its logs get
+                    # stitched or merged into the final log of every pair
+                    usage = usage if usage else {"wall": seconds}
+                    log_fps = []
+                    if error is None:
+                        log_fps = [read_log_fps(get_log_file(log_path)) for _, _, log_path in get_job_logs(job, io)]
+                        log_fps = [fps for fps in log_fps if fps is not None]
+                    row = telemetry.record(
+                        job,
+                        usage,
+                        infos,
+                        args.reference,
+                        threads=usage.get("threads", 0),
+                        fps=sum(log_fps) / len(log_fps) if len(log_fps) > 0 else None,
+                        error=error,
+                    )
 
-                # Since we just finished using a model on this specific dist
-                # video file, we increment the counter for the number of models
-                # completed for this dist file
-                num_models[dist] += 1
-                # If we've finished testing all models against this dist, then
-                # we can save the aggregate statistics and move the video file
-                # to the log location
-                if num_models[dist] == len(io[dist].keys()):
-                    dist_finished += 1
-                    pbar.set_postfix(
-                        {
-                            "Distorted videos finished": str(
-                                "{} : {}%".format(dist_finished, dist_finished / io.keys() * 100)
+                    if error is not None:
+                        print("VMAF calculation failed:\n{}".format(error))
+                        for dist, model in job["pairs"]:
+                            io[dist][model]["status"] = "CANCELLED"
+                            state.record(dist, model, io[dist][model])
+                        continue
+
+                    # Keep the resource usage of every pair in its save state,
+                    # which is saved along with it once the pair is finished
+                    for dist, model in job["pairs"]:
+                        add_usage(io[dist][model], row, len(job["pairs"]))
+
+                    # Learn how fast the models of this job ran for later runs,
+                    # which coarse passes would skew by skipping most frames
+                    frames, pixels = job["size"]
+                    if not job.get("subsamples"):
+                        costs.record(frames, pixels, [model for _, model in job["pairs"]], seconds)
+
+                    # List containing the "dist" and "model" pairs of this job
+                    finished = job["pairs"]
+
+                    # A finished coarse pass is followed by jobs for the time
+                    # ranges that need refining, which share its pairs
+                    if job.get("subsamples"):
+                        coarse_logs = {}
+                        for dist, model in job["pairs"]:
+                            coarse_logs[(dist, model)] = read_log(get_log_file(io[dist][model]["log_path"]))
+                        refine_plan = plan_refinement(
+                            coarse_logs.values(),
+                            ref_info["frames"],
+                            job["subsamples"],
+                            args.refine_threshold,
+                            args.refine_delta,
+                        )
+                        refine_jobs = [
+                            {"pairs": job["pairs"], "segment": dict(segment, fps=ref_info["fps"]), "refine": True}
+                            for segment in refine_plan
+                        ]
+                        for pair in job["pairs"]:
+                            refines[pair] = {"coarse": coarse_logs[pair], "total": len(refine_jobs), "done": []}
+
+                        if len(refine_jobs) > 0:
+                            print(
+                                "Refining {} frames in {} time ranges of:\n\t{}\n".format(
+                                    sum([segment["end"] - segment["start"] for segment in refine_plan]),
+                                    len(refine_jobs),
+                                    "\n\t".join(["{} | {}".format(dist, model) for dist, model in job["pairs"]]),
+                                )
                             )
-                        }
+                            for refine_job in refine_jobs:
+                                refine_job["size"] = (refine_job["segment"]["count"], pixels)
+                                refine_job["cost"] = costs.predict(
+                                    *refine_job["size"], [model for _, model in job["pairs"]]
+                                )
+                                if cost_unit == "reports":
+                                    refine_job["cost"] = 0
+                            pbar.total += sum([refine_job["cost"] for refine_job in refine_jobs])
+                            if leases is not None:
+                                for refine_job in refine_jobs:
+                                    refine_job["normalize"] = job.get("normalize")
+                                lease_jobs.update(
+                                    dict(zip(leases.publish(refine_jobs, io, args.reference), refine_jobs))
+                                )
+                            else:
+                                pending.extendleft(reversed(refine_jobs))
+                            continue
+
+                        # Nothing needed refining, so the coarse log is final
+                        scores = []
+                        for dist, model in job["pairs"]:
+                            pooled = finish_refinement(
+                                io[dist][model]["log_path"], refines[(dist, model)], job["subsamples"]
+                            )
+                            scores.append(pooled["vmaf"]["mean"])
+
+                    # Refined pairs are only finished once their last time range
+                    # is done, at which point the ranges get merged into the
+                    # coarse log and the score is taken from the merged log
+                    elif job.get("refine"):
+                        finished = []
+                        scores = []
+                        for dist, model, log_path in get_job_logs(job, io):
+                            refines[(dist, model)]["done"].append((log_path, job["segment"]))
+                            if len(refines[(dist, model)]["done"]) == refines[(dist, model)]["total"]:
+                                pooled = finish_refinement(
+                                    io[dist][model]["log_path"], refines[(dist, model)], args.adaptive_subsamples
+                                )
+                                finished.append((dist, model))
+                                scores.append(pooled["vmaf"]["mean"])
+
+                    # Sampled pairs are only finished once their last clip is done,
+                    # at which point the clip logs get stitched together and the
+                    # score is taken from the estimate of the whole video
+                    elif job.get("sample"):
+                        finished = []
+                        scores = []
+                        for dist, model, log_path in get_job_logs(job, io):
+                            samples[(dist, model)]["done"].append((log_path, job["segment"]))
+                            if len(samples[(dist, model)]["done"]) == samples[(dist, model)]["total"]:
+                                estimate = finish_sampling(io[dist][model]["log_path"], samples[(dist, model)])
+                                io[dist][model]["estimate"] = estimate
+                                finished.append((dist, model))
+                                scores.append(estimate["mean"] if estimate is not None else None)
+
+                    # Segmented pairs are only finished once their last segment is
+                    # done, at which point the segment logs get stitched together
+                    # and the score is taken from the stitched log
+                    elif job["segment"] is not None:
+                        finished = []
+                        scores = []
+                        for dist, model, log_path in get_job_logs(job, io):
+                            segments[(dist, model)]["done"].append((log_path, job["segment"]))
+                            if len(segments[(dist, model)]["done"]) == segments[(dist, model)]["total"]:
+                                pooled = stitch_segments(io[dist][model]["log_path"], segments[(dist, model)]["done"])
+                                io[dist][model].pop("checkpoint", None)
+                                finished.append((dist, model))
+                                scores.append(pooled["vmaf"]["mean"])
+                            elif args.checkpoint_interval > 0:
+                                # Save every finished segment, so that continuing
+                                # an interrupted run resumes after it
+                                io[dist][model]["checkpoint"] = {
+                                    "commands": io[dist][model]["commands"],
+                                    "frames": ref_info["frames"],
+                                    "done": segments[(dist, model)]["done"],
+                                }
+                                state.record(dist, model, io[dist][model])
+
+                    for i, (dist, model) in enumerate(finished):
+                        vmaf_score = scores[i] if i < len(scores) else None
+                        finish_pair(dist, model, vmaf_score, io, aggregate, state)
+
+                        # Keep the finished log in the cache for later runs
+                        if (dist, model) in cache_keys:
+                            try:
+                                cache.store(
+                                    cache_keys[(dist, model)],
+                                    get_log_file(io[dist][model]["log_path"]),
+                                    score=vmaf_score,
+                                    estimate=io[dist][model].get("estimate"),
+                                    description="{} | {}".format(Path(dist).name, Path(model).name),
+                                )
+                            except OSError as ose:
+                                print("Could not cache the VMAF log of {} with {}: {}".format(dist, model, ose))
+
+                        # Since we just finished using a model on this specific dist
+                        # video file, we increment the counter for the number of models
+                        # completed for this dist file
+                        num_models[dist] += 1
+                        # If we've finished testing all models against this dist, then
+                        # we can save the aggregate statistics and move the video file
+                        # to the log location
+                        if num_models[dist] == len(io[dist].keys()):
+                            dist_finished += 1
+                            write_aggregate(dist, io, aggregate, state, packets, probes)
+
+                # The finished leases are only deleted once their results were
+                # saved, so that they are collected again after a crash
+                for lease_id in collected.keys():
+                    leases.remove(lease_id)
+
+                # Move the progress bar by the finished jobs and the finished
+                # share of the running ones
+                progress = []
+                running_cost = 0
+                for task in running:
+                    runner = my_ffs[task]["runner"]
+                    # Claimed jobs of other reference video files are not part
+                    # of this progress bar
+                    if my_ffs[task]["lease"] is None or my_ffs[task]["lease"] in lease_jobs:
+                        running_cost += my_ffs[task]["job"]["cost"] * runner.get_percent()
+                    progress.append(
+                        "{}/{} {:.0%} @ {:.1f}fps".format(
+                            runner.get_frame(),
+                            runner.get_frames(),
+                            runner.get_percent(),
+                            runner.get_fps(),
+                        )
                     )
-                    # Move the dist video file to the log location
-                    dist_path = Path(dist)
-                    dist_path_new = aggregate[dist]["log"].parent.joinpath(dist_path.name)
-                    dist_path.replace(dist_path_new)
-
-                    # Get the average VMAF score between all model files
-                    aggregate[dist]["score"] /= len(io[dist].keys())
-
-                    # Save score to aggregate dist's output message
-                    tmp_msg = "Average VMAF Score between all tested VMAF models is {}\n"
-                    aggregate[dist]["msg"] = tmp_msg.format(aggregate[dist]["score"])
-
-                    # Open the aggregate statistics file for writing to
-                    with open(aggregate[dist]["log"], "w") as aggregate_file:
-                        for model in models.keys():
-                            # Write the average score for each model to the
-                            # aggregate log file
-                            tmp_msg = "{} Score: {}\n"
-                            aggregate_file.write(tmp_msg.format(model, io[dist][model]["score"]))
-
-                        # Write average VMAF score to aggregate log file
-                        tmp_msg = "\nAverage Score: {}\n"
-                        aggregate_file.write(tmp_msg.format(aggregate[dist]["score"]))
-
-                        # Convert file size to a more human-readable format
-                        size_converted = bytes2human(aggregate[dist]["file_size"])
-
-                        # Write the size in bytes & the size in human-readable
-                        # format to the aggregate log file
-                        tmp_msg = "File Size: {}B = {}\n"
-                        aggregate_file.write(tmp_msg.format(aggregate[dist]["file_size"], size_converted))
-
-                    for model in models.keys():
-                        io[dist][model]["status"] = "MOVED"
-                pbar.update()
+                pbar.n = min(pbar.total, finished_cost + running_cost)
+                pbar.set_postfix(
+                    {
+                        "Distorted videos finished": "{} : {}%".format(
+                            dist_finished, dist_finished / max(1, len(io.keys())) * 100
+                        ),
+                        "Running": ", ".join(progress),
+                    }
+                )
 
     # All exceptions try to cancel the existing tasks in the pool and will exit
     # the program afterwards.
@@ -614,50 +2159,72 @@ if __name__ == "__main__":
             print_exc()
         was_cancelled = True
         cf_handler.shutdown(wait=False, cancel_futures=True)
-        cancellations = {task: False for task in my_ffs.keys()}
-        while not any([item for item in cancellations.values()]):
-            for task, info in my_ffs.items():
-                dist = info["dist"]
-                model = info["model"]
-                # If the task is still running, or if it finished but was cancelled,
-                # or if it raised an exception, then we cancel the task
-                if task.running() or (task.done() and task.cancelled()) or task.exception():
-                    if info["ff"].process:
-                        print("Shutting down {}...".format(info["ff"].process.pid))
-                        while info["ff"].process.poll() is None:
-                            info["ff"].process.terminate()
-                            info["ff"].process.kill()
-                            info["ff"].process.wait()
-                        if io[dist][model]["status"] not in ["DONE", "MOVED"]:
-                            time.sleep(0.5)
-                            print("\tDeleting related log file:\n\t{}...".format(Path(io[dist][model]["log_path"])))
-                            Path(io[dist][model]["log_path"]).unlink(missing_ok=True)
-                        cancellations[task] = True
-                    if io[dist][model]["status"] not in ["DONE", "MOVED"]:
-                        io[dist][model]["status"] = "CANCELLED"
-        del cancellations
+        # Delete a partially written reference spool, keeping a finished one
+        # for continuing later
+        if spool is not None:
+            spool.cancel()
+        # Hand the claimed jobs back for other workers to pick up
+        if leases is not None:
+            leases.release_all()
+        # Kill every FFmpeg process along with its process group, which also
+        # deletes their partial logs, and wait for them to exit
+        for task, info in my_ffs.items():
+            if info["runner"].get_pid() is not None and (not task.done() or task.cancelled()):
+                print("Shutting down {}...".format(info["runner"].get_pid()))
+            info["runner"].kill()
+        cf_handler.shutdown(wait=True, cancel_futures=True)
+        for task, info in my_ffs.items():
+            for dist, model in info["pairs"]:
+                if dist in io and io[dist][model]["status"] not in ["DONE", "MOVED"]:
+                    io[dist][model]["status"] = "CANCELLED"
+                    state.record(dist, model, io[dist][model])
         print("Pool has shutdown, exiting...")
     else:
         cf_handler.shutdown()
 
-    write_state(args.reference, io)
+    state.compact(io)
+    state.close()
+    costs.save()
+    probes.save()
+    if packets is not None:
+        packets.shutdown()
+    telemetry.save()
+    if cache is not None:
+        cache.save()
     # If an exception occurred, then this will finish exiting the program
     if was_cancelled:
         exit(1)
 
+    # Every calculation has finished, so the reference spool is not needed anymore
+    if spool is not None:
+        spool.remove()
+
     end = time()
     total = end - start
 
     # Show how long it took to run this entire program
     print("Program took {}".format(timedelta(seconds=total)))
-    time_avg = timedelta(seconds=total / len(my_ffs))
-    print("All calculations took an average of {}\n".format(time_avg))
+    # Runs whose calculations were all restored, skipped or run by workers
+    # never started an FFmpeg process
+    if len(my_ffs) > 0:
+        time_avg = timedelta(seconds=total / len(my_ffs))
+        print("All calculations took an average of {}\n".format(time_avg))
+    telemetry.print_summary()
 
     # Print out all the relevant info to the user
     print("The scores are as follows:")
     print("Reference: {}".format(args.reference))
     for dist, models in io.items():
         print("Distorted: {}".format(dist))
-        print(aggregate[dist]["msg"])
+        # Distorted video files with failed calculations have no aggregate score
+        print(aggregate[dist].get("msg", "Not every VMAF model finished for this distorted video file\n"))
         for model in models.keys():
-            print(io[dist][model]["msg"])
+            if "msg" in io[dist][model]:
+                print(io[dist][model]["msg"])
+            else:
+                print("\tVMAF Model: {}\n\tStatus: {}\n".format(model, io[dist][model]["status"]))
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    main(parse_arguments())
@@ -0,0 +1,91 @@
+import argparse as argp
+
+# Arguments that run a tool from the command line without loading Gooey, where
+# "--ignore-gooey" is the argument Gooey itself already skips its window for
+HEADLESS_FLAGS = ["--headless", "--ignore-gooey"]
+
+# Keyword arguments that only Gooey's parser knows about
+GOOEY_KWARGS = ["widget", "gooey_options"]
+
+
+def is_headless(argv):
+    """Check if a tool was asked to run without its Gooey window."""
+    return any([arg in HEADLESS_FLAGS for arg in argv])
+
+
+def strip_headless(argv):
+    """Remove the headless arguments from a list of arguments, which none of the parsers know about."""
+    return [arg for arg in argv if arg not in HEADLESS_FLAGS]
+
+
+def strip_gooey_kwargs(kwargs):
+    return {k: v for k, v in kwargs.items() if k not in GOOEY_KWARGS}
+
+
+class VMAF_Headless_Argument_Group(argp._ArgumentGroup):
+    def add_argument(
+        self,
+        *args,
+        **kwargs,
+    ):
+        return super().add_argument(*args, **strip_gooey_kwargs(kwargs))
+
+
+class VMAF_Headless_Subparsers:
+    """Stands in for the subparsers that Gooey shows as the pages of its sidebar.
+
+    Every page adds its arguments straight to the main parser, so that the command line takes all of
+    them at once instead of expecting the name of a page first.
+    """
+
+    def __init__(
+        self,
+        parser,
+    ):
+        self._parser = parser
+
+    def add_parser(
+        self,
+        *args,
+        **kwargs,
+    ):
+        return self._parser
+
+
+class VMAF_Headless_Parser(argp.ArgumentParser):
+    """An ArgumentParser that takes the same arguments as Gooey's GooeyParser without importing Gooey.
+
+    The Gooey only keyword arguments are dropped, and the subparsers used for the pages of Gooey's
+    sidebar are flattened into the main parser. Option strings used on more than one page go to the
+    argument added last.
+    """
+
+    def __init__(
+        self,
+        *args,
+        **kwargs,
+    ):
+        kwargs.setdefault("conflict_handler", "resolve")
+        super().__init__(*args, **kwargs)
+
+    def add_argument(
+        self,
+        *args,
+        **kwargs,
+    ):
+        return super().add_argument(*args, **strip_gooey_kwargs(kwargs))
+
+    def add_argument_group(
+        self,
+        *args,
+        **kwargs,
+    ):
+        group = VMAF_Headless_Argument_Group(self, *args, **strip_gooey_kwargs(kwargs))
+        self._action_groups.append(group)
+        return group
+
+    def add_subparsers(
+        self,
+        **kwargs,
+    ):
+        return VMAF_Headless_Subparsers(self)
@@ -228,3 +228,11 @@ class VMAF_Timer:
             msg += "{} minutes, ".format(int(minutes))
         msg += "{} seconds".format(seconds)
         return msg
+
+
+def handle_terminate(
+    signum,
+    frame,
+):
+    """Signal handler that stops a program the same way as a KeyboardInterrupt, such as when a service manager terminates it."""
+    raise KeyboardInterrupt
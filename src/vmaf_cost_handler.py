@@ -0,0 +1,78 @@
+from json import dump, load
+from pathlib import Path
+
+# Pixels per second a single libvmaf instance is assumed to process for a
+# model that has no history yet, roughly 1080p at 25 FPS
+DEFAULT_RATE = 1920 * 1080 * 25
+
+# Weight of the newest measurement when updating a model's historical rate
+SMOOTHING = 0.3
+
+
+class VMAF_Cost_Handler:
+    """Predicts how long VMAF calculations take from their frame count, resolution and models.
+
+    The speed of every finished calculation is saved per model to a history file, so that later
+    runs predict their costs from how fast the same model actually ran before.
+    """
+
+    def __init__(
+        self,
+        history_file,
+        default_rate=DEFAULT_RATE,
+    ):
+        self._history_file = Path(history_file)
+        self._default_rate = default_rate
+        self._rates = {}
+
+        if self._history_file.exists():
+            try:
+                with open(self._history_file, "r") as reader:
+                    self._rates = load(reader)
+            except (OSError, ValueError) as e:
+                print("Could not read the VMAF speed history file {}: {}".format(self._history_file, e))
+
+    def get_rate(
+        self,
+        model,
+    ):
+        """Get the historical number of pixels per second a single libvmaf instance of a model processes."""
+        return self._rates.get(Path(model).stem, self._default_rate)
+
+    def predict(
+        self,
+        frames,
+        pixels,
+        models,
+    ):
+        """Predict the number of seconds it takes to calculate the given models over the given frames."""
+        return sum([frames * pixels / self.get_rate(model) for model in models])
+
+    def record(
+        self,
+        frames,
+        pixels,
+        models,
+        seconds,
+    ):
+        """Update the historical rate of every model of a finished calculation."""
+        if seconds <= 0 or frames <= 0 or pixels <= 0 or len(models) == 0:
+            return
+
+        # Models running in the same process share its time by their predicted
+        # share of the work
+        predicted = self.predict(frames, pixels, models)
+        for model in models:
+            share = seconds * (frames * pixels / self.get_rate(model)) / predicted
+            rate = frames * pixels / share
+            key = Path(model).stem
+            if key in self._rates:
+                rate = (1 - SMOOTHING) * self._rates[key] + SMOOTHING * rate
+            self._rates[key] = rate
+
+    def save(self):
+        try:
+            with open(self._history_file, "w") as writer:
+                dump(self._rates, writer, indent=4)
+        except OSError as e:
+            print("Could not write the VMAF speed history file {}: {}".format(self._history_file, e))
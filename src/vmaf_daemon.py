@@ -0,0 +1,561 @@
+import argparse as argp
+import concurrent.futures as cf
+import multiprocessing as mp
+import signal
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from pathlib import Path
+from time import time
+
+import ffmpy
+
+from vmaf_common import handle_terminate, search_handler
+from vmaf_job_handler import (
+    build_job,
+    build_vmaf_filter,
+    build_vmaf_options,
+    escape_log_path,
+    get_job_size,
+    get_log_file,
+    get_log_location,
+    plan_normalize_filters,
+    select_normalize_filters,
+)
+from vmaf_log_handler import read_log_fps
+from vmaf_probe_handler import PROBE_CACHE_FILE, VMAF_Probe_Handler, get_ffprobe
+from vmaf_scheduler import VMAF_Thread_Scheduler
+from vmaf_state_handler import VMAF_State_Handler
+from vmaf_stream_handler import VMAF_Stream_Runner
+from vmaf_telemetry_handler import add_usage, build_row
+
+# Address the job submission API listens on by default, which only accepts
+# connections from the local machine
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8585
+
+# Number of finished jobs kept for getting their results, after which the
+# oldest ones are forgotten
+FINISHED_JOBS = 1000
+
+# Number of status changes journaled for a reference video file before its
+# completions file gets rewritten and its journal emptied
+COMPACT_RECORDS = 1000
+
+
+class VMAF_Daemon:
+    """Long running VMAF calculator that keeps its process slots warm between submitted jobs.
+
+    Every submitted job runs one FFmpeg process per distorted video file, with a libvmaf filter for
+    each of its models. Status changes are journaled to the same completions files the VMAF Calculator
+    uses, so dist-model pairs that are already done with the same options are not calculated again.
+    """
+
+    def __init__(
+        self,
+        ffmpeg="ffmpeg",
+        processes=1,
+        threads=0,
+        hwaccel=False,
+    ):
+        self._ffmpeg = ffmpeg
+        self._decode = "-hwaccel auto" if hwaccel else ""
+        self._scheduler = VMAF_Thread_Scheduler(processes=processes, threads=threads)
+        self._pool = cf.ThreadPoolExecutor(max_workers=max(1, processes))
+        self._lock = threading.Lock()
+        # Submitted jobs by their ID, in the order they were submitted
+        self._jobs = {}
+        # Save state of every reference video file by its path, along with its
+        # completions, which are only read from disk once and then kept up to
+        # date in memory, and the number of status changes since compacting
+        self._states = {}
+        self._completions = {}
+        self._records = {}
+        self._state_lock = threading.Lock()
+        # Probed info of the video files of every job, shared with the VMAF
+        # Calculator through the same probe cache file
+        self._probes = VMAF_Probe_Handler(Path(__file__).parent.joinpath(PROBE_CACHE_FILE), get_ffprobe(ffmpeg))
+        self._probe_lock = threading.Lock()
+        self._started = time()
+
+    def _get_completions(
+        self,
+        reference,
+        dists,
+    ):
+        """Get a copy of the completions of the given distorted video files of a reference video file."""
+        with self._state_lock:
+            if reference not in self._states:
+                self._states[reference] = VMAF_State_Handler(reference)
+                self._completions[reference] = self._states[reference].load()
+                self._records[reference] = 0
+            completions = self._completions[reference]
+            return {dist: dict(completions.get(dist, {})) for dist in dists}
+
+    def _record(
+        self,
+        reference,
+        dist,
+        model,
+        entry,
+    ):
+        """Journal the status of a dist-model pair, compacting the journal once it holds COMPACT_RECORDS changes."""
+        with self._state_lock:
+            state = self._states[reference]
+            state.record(dist, model, entry)
+            self._completions[reference].setdefault(dist, {})[model] = dict(entry)
+            self._records[reference] += 1
+            if self._records[reference] >= COMPACT_RECORDS:
+                state.compact(self._completions[reference])
+                self._records[reference] = 0
+
+    def submit(
+        self,
+        request,
+    ):
+        """Queue a VMAF calculation job, returning its ID.
+
+        Raises OSError if any of the video or model files can not be found, and ValueError if the request
+        is missing the reference, distorted video files or models.
+        """
+        for key in ["reference", "distorted", "models"]:
+            if not request.get(key):
+                raise ValueError('ERROR: Job is missing the "{}" field.'.format(key))
+
+        # A single distorted video file, directory or model is given as a
+        # plain string
+        for key in ["distorted", "models"]:
+            if isinstance(request[key], str):
+                request[key] = [request[key]]
+            elif not isinstance(request[key], list):
+                raise ValueError('ERROR: The "{}" field must be a list of files or directories.'.format(key))
+        if not isinstance(request.get("overwrite", False), bool):
+            raise ValueError('ERROR: The "overwrite" field must be true or false.')
+
+        reference = str(request["reference"])
+        search_handler(reference)
+        dists = []
+        for dist in request["distorted"]:
+            dists += [str(file) for file in search_handler(dist, search_for="distorted") or []]
+        models = []
+        for model in request["models"]:
+            models += [str(file) for file in search_handler(model, search_for="model") or []]
+        if len(dists) == 0 or len(models) == 0:
+            raise ValueError("ERROR: Job has no valid distorted video files or VMAF models.")
+
+        # Distorted video files with a different resolution or pixel format
+        # than the reference video file get scaled and converted to match it
+        with self._probe_lock:
+            infos = self._probes.probe_files([reference] + dists)
+            self._probes.save()
+        normalize = plan_normalize_filters(infos, reference, dists)
+
+        log_format = request.get("log_format", "xml")
+        options = build_vmaf_options(
+            request.get("psnr", False),
+            request.get("ssim", False),
+            request.get("ms_ssim", False),
+            request.get("subsamples"),
+        )
+
+        # Pick up the pairs that are already done from the completions of
+        # earlier calculations against the same reference
+        completions = self._get_completions(reference, dists)
+        overwrite = request.get("overwrite", False)
+        io = {}
+        for dist in dists:
+            io[dist] = {}
+            for model in models:
+                log_loc = get_log_location(dist, model, log_format)
+                log_loc.parent.mkdir(exist_ok=True)
+                entry = {
+                    "status": "NOT STARTED",
+                    "log_path": escape_log_path(log_loc),
+                    "commands": build_vmaf_filter(model, log_format) + options,
+                    "score": None,
+                }
+                # Results are only reused when they were calculated with the
+                # same libvmaf options and log format
+                done = completions.get(dist, {}).get(model, {})
+                if (
+                    not overwrite
+                    and done.get("status") in ["DONE", "MOVED"]
+                    and done.get("commands") == entry["commands"]
+                    and Path(log_loc).exists()
+                ):
+                    entry["status"] = "DONE"
+                    entry["score"] = done.get("score")
+                io[dist][model] = entry
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "reference": reference,
+            "io": io,
+            "infos": infos,
+            "normalize": normalize,
+            "status": "QUEUED",
+            "submitted": time(),
+            "tasks": {},
+            "runners": {},
+            "error": None,
+        }
+        # The tasks are filled in before the job is published, so that nothing
+        # ever iterates over them while they change
+        for dist in dists:
+            pairs = [(dist, model) for model in models if io[dist][model]["status"] != "DONE"]
+            if len(pairs) == 0:
+                continue
+            calculation = {"pairs": pairs, "segment": None}
+            # The frame count and resolution go into the progress and telemetry
+            calculation["size"] = get_job_size(calculation, infos, reference)
+            task = self._pool.submit(self._run, job, calculation)
+            job["tasks"][task] = dist
+        if len(job["tasks"]) == 0:
+            job["status"] = "DONE"
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict()
+
+        return job_id
+
+    def _evict(self):
+        """Forget the oldest finished jobs once there are more than FINISHED_JOBS of them."""
+        finished = []
+        for job_id, job in self._jobs.items():
+            self._update(job)
+            if job["status"] in ["DONE", "FAILED", "CANCELLED"]:
+                finished.append(job_id)
+        for job_id in finished[: max(0, len(finished) - FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _run(
+        self,
+        job,
+        calculation,
+    ):
+        """Run the FFmpeg process of a single distorted video file of a job."""
+        if job["status"] == "CANCELLED":
+            return
+        job["status"] = "RUNNING"
+        io = job["io"]
+        for dist, model in calculation["pairs"]:
+            io[dist][model]["status"] = "STARTED"
+            self._record(job["reference"], dist, model, io[dist][model])
+
+        threads = self._scheduler.plan(1)
+        normalize = select_normalize_filters(job["normalize"], [dist for dist, _ in calculation["pairs"]])
+        ff_tmp = build_job(
+            calculation,
+            io,
+            job["reference"],
+            self._decode,
+            self._decode,
+            self._ffmpeg,
+            threads=threads,
+            normalize=normalize,
+        )
+        runner = VMAF_Stream_Runner(
+            ff_tmp,
+            frames=calculation["size"][0],
+            logs=[get_log_file(io[dist][model]["log_path"]) for dist, model in calculation["pairs"]],
+        )
+        key = id(runner)
+        job["runners"][key] = runner
+        self._scheduler.start(key, threads)
+        try:
+            scores = runner.run()
+        except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+            for dist, model in calculation["pairs"]:
+                io[dist][model]["status"] = "NOT STARTED"
+                self._record(job["reference"], dist, model, io[dist][model])
+            if job["status"] != "CANCELLED":
+                job["error"] = str(e)
+            return
+        finally:
+            self._scheduler.finish(key)
+            job["runners"].pop(key, None)
+
+        log_fps = [read_log_fps(get_log_file(io[dist][model]["log_path"])) for dist, model in calculation["pairs"]]
+        log_fps = [fps for fps in log_fps if fps is not None]
+        row = build_row(
+            calculation,
+            runner.get_usage(),
+            job["infos"],
+            job["reference"],
+            threads,
+            fps=sum(log_fps) / len(log_fps) if len(log_fps) > 0 else None,
+        )
+        for i, (dist, model) in enumerate(calculation["pairs"]):
+            io[dist][model]["status"] = "DONE"
+            io[dist][model]["score"] = scores[i] if i < len(scores) else None
+            add_usage(io[dist][model], row, len(calculation["pairs"]))
+            self._record(job["reference"], dist, model, io[dist][model])
+
+    def _update(
+        self,
+        job,
+    ):
+        """Settle the status of a job once all of its processes finished."""
+        if job["status"] in ["DONE", "FAILED", "CANCELLED"]:
+            return
+        if not all([task.done() for task in job["tasks"]]):
+            return
+        job["status"] = "FAILED" if job["error"] else "DONE"
+
+    def get_job(
+        self,
+        job_id,
+    ):
+        """Get the status, scores and log locations of every dist-model pair of a job, or None if it does not exist."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        self._update(job)
+
+        results = {}
+        for dist, models in job["io"].items():
+            scores = [entry["score"] for entry in models.values() if entry["score"] is not None]
+            results[dist] = {
+                "models": {
+                    model: {
+                        "status": entry["status"],
+                        "score": entry["score"],
+                        "log": get_log_file(entry["log_path"]),
+                        "telemetry": entry.get("telemetry"),
+                    }
+                    for model, entry in models.items()
+                },
+                "average": sum(scores) / len(scores) if len(scores) == len(models) else None,
+            }
+
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "reference": job["reference"],
+            "submitted": job["submitted"],
+            "error": job["error"],
+            "results": results,
+        }
+
+    def _get_jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def get_jobs(self):
+        return [self.get_job(job["id"]) for job in self._get_jobs()]
+
+    def get_status(self):
+        """Get the queue depth and number of running and finished jobs of the daemon."""
+        counts = {}
+        jobs = self._get_jobs()
+        for job in jobs:
+            self._update(job)
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        queued = sum([len([task for task in job["tasks"] if not task.running() and not task.done()]) for job in jobs])
+
+        return {
+            "uptime": time() - self._started,
+            "queue_depth": queued,
+            "running_processes": self._scheduler.get_running_count(),
+            "free_slots": self._scheduler.get_free_slots(),
+            "jobs": counts,
+        }
+
+    def cancel(
+        self,
+        job_id,
+    ):
+        """Cancel the queued processes of a job and kill its running ones, returning False if the job does not exist."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        if job["status"] in ["DONE", "FAILED", "CANCELLED"]:
+            return True
+
+        job["status"] = "CANCELLED"
+        for task in job["tasks"]:
+            task.cancel()
+        for runner in list(job["runners"].values()):
+            runner.kill()
+
+        return True
+
+    def shutdown(self):
+        """Stop every job and save the state of every reference video file."""
+        for job in self._get_jobs():
+            self.cancel(job["id"])
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._state_lock:
+            for reference, state in self._states.items():
+                state.compact(self._completions[reference])
+                state.close()
+
+
+class VMAF_Request_Handler(BaseHTTPRequestHandler):
+    """JSON API of the VMAF daemon.
+
+    - POST /jobs submits a job and returns its ID.
+    - GET /jobs lists every job, and GET /jobs/<id> gets a single one.
+    - DELETE /jobs/<id> cancels a job.
+    - GET /status gets the queue depth and the number of running and finished jobs.
+    """
+
+    # Set to the VMAF_Daemon serving the requests
+    vmaf_daemon = None
+
+    def _respond(
+        self,
+        code,
+        body,
+    ):
+        data = dumps(body, indent=4).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _get_job_id(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._respond(200, self.vmaf_daemon.get_status())
+        elif self.path.rstrip("/") == "/jobs":
+            self._respond(200, self.vmaf_daemon.get_jobs())
+        elif self._get_job_id() is not None:
+            job = self.vmaf_daemon.get_job(self._get_job_id())
+            if job is None:
+                self._respond(404, {"error": "No job with ID {}".format(self._get_job_id())})
+            else:
+                self._respond(200, job)
+        else:
+            self._respond(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._respond(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("ERROR: Job must be a JSON object.")
+            job_id = self.vmaf_daemon.submit(request)
+        except (OSError, ValueError) as e:
+            self._respond(400, {"error": str(e)})
+            return
+        self._respond(202, {"id": job_id})
+
+    def do_DELETE(self):
+        job_id = self._get_job_id()
+        if job_id is None or not self.vmaf_daemon.cancel(job_id):
+            self._respond(404, {"error": "No job with ID {}".format(job_id)})
+            return
+        self._respond(200, self.vmaf_daemon.get_job(job_id))
+
+    def log_message(
+        self,
+        format,
+        *args,
+    ):
+        print("{} - {}".format(self.address_string(), format % args))
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for running the VMAF daemon."""
+    main_help = "Long running VMAF calculator that takes jobs over a local HTTP JSON API."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+
+    host_help = "Specify the address to listen on (Default is {}, which only accepts local connections).".format(
+        DEFAULT_HOST
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        type=str,
+        default=DEFAULT_HOST,
+        help=host_help,
+    )
+
+    port_help = "Specify the port to listen on (Default is {}).".format(DEFAULT_PORT)
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=port_help,
+    )
+
+    ffmpeg_help = 'Specify the path to the FFmpeg executable (Default is "ffmpeg").'
+    parser.add_argument(
+        "-f",
+        "--ffmpeg",
+        dest="ffmpeg",
+        type=str,
+        default="ffmpeg",
+        help=ffmpeg_help,
+    )
+
+    threads_help = 'Specify number of threads to be used for each process (Default is 0 for "autodetect").'
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        type=int,
+        default=0,
+        help=threads_help,
+    )
+
+    proc_help = "Specify number of simultaneous VMAF calculation processes to run (Default is 1)."
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        type=int,
+        default=1,
+        help=proc_help,
+    )
+
+    hwaccel_help = "Enable FFmpeg to automatically attempt to use hardware acceleration for video decoding."
+    parser.add_argument(
+        "--hwaccel",
+        dest="hwaccel",
+        action="store_true",
+        help=hwaccel_help,
+    )
+
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, mp.cpu_count()))
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    daemon = VMAF_Daemon(
+        ffmpeg=args.ffmpeg,
+        processes=args.processes,
+        threads=args.threads,
+        hwaccel=args.hwaccel,
+    )
+    VMAF_Request_Handler.vmaf_daemon = daemon
+    signal.signal(signal.SIGTERM, handle_terminate)
+    server = ThreadingHTTPServer((args.host, args.port), VMAF_Request_Handler)
+    print("VMAF daemon is listening on http://{}:{}".format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping every running VMAF calculation...")
+    finally:
+        server.server_close()
+        daemon.shutdown()
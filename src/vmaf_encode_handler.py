@@ -0,0 +1,362 @@
+import asyncio
+import itertools
+import os
+import re
+import shlex
+import signal
+import subprocess as sp
+import threading
+from collections import deque
+from pathlib import Path
+from time import perf_counter
+
+import ffmpy
+
+from vmaf_job_handler import SCALERS, build_filter_graph, build_normalize_filter
+from vmaf_settings_handler import read_toml
+from vmaf_stream_handler import STDERR_TAIL, VMAF_Stream_Runner, VMAF_Timeout_Error
+
+# Container of the encoded video files when an encode does not set one
+DEFAULT_CONTAINER = "mkv"
+
+# Keys of an [[encode]] table, every other key is an error
+ENCODE_KEYS = ["name", "codec", "container", "size", "options"]
+
+# Characters kept in the names of encoded video files, any other one is
+# replaced with a dash
+NAME_PATTERN = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def read_encodes(file):
+    """Read the [[encode]] tables of an encoder config file.
+
+    Every table needs a "codec", and can set the "name" of its encoded video files, their "container",
+    the "size" they get scaled to as "WIDTHxHEIGHT" and the FFmpeg output "options" of the encoder.
+    The size and every option can be a list of values, which get encoded in every combination.
+    """
+    try:
+        data = read_toml(file)
+    except (OSError, ValueError) as e:
+        raise ValueError("Could not read the encoder config file {}: {}".format(file, e))
+
+    setups = data.get("encode", [])
+    if not isinstance(setups, list) or len(setups) == 0:
+        raise ValueError("The encoder config file {} has no [[encode]] tables.".format(file))
+    for i, setup in enumerate(setups):
+        unknown = [key for key in setup.keys() if key not in ENCODE_KEYS]
+        if len(unknown) > 0:
+            raise ValueError("Encode {} of {} has the unknown keys {}.".format(i + 1, file, ", ".join(unknown)))
+        if "codec" not in setup:
+            raise ValueError("Encode {} of {} does not set a codec.".format(i + 1, file))
+        if not isinstance(setup.get("options", {}), dict):
+            raise ValueError("The options of encode {} of {} must be a table.".format(i + 1, file))
+
+    return setups
+
+
+def parse_size(size):
+    """Parse a "WIDTHxHEIGHT" size into a (width, height) tuple."""
+    width, _, height = str(size).lower().partition("x")
+    if not width.isdigit() or not height.isdigit() or int(width) <= 0 or int(height) <= 0:
+        raise ValueError('The size {!r} is not given as "WIDTHxHEIGHT".'.format(size))
+
+    return (int(width), int(height))
+
+
+def get_encode_name(
+    codec,
+    options,
+    size=None,
+):
+    """Get the default name of an encode from its codec, size and the value of every option."""
+    name = codec
+    if size is not None:
+        name += "_{}x{}".format(*size)
+    for key, value in options.items():
+        name += "_{}{}".format(key, value)
+
+    return name
+
+
+def plan_encodes(
+    setups,
+    output_dir,
+):
+    """Expand every encode of read_encodes into its combinations of sizes and options.
+
+    Returns a list of dicts with the "name", "codec", "size" as a (width, height) tuple or None for the
+    size of the reference, the "options" of the encoder and the "output" file it writes.
+    """
+    encodes = []
+    outputs = set()
+    for setup in setups:
+        sizes = setup.get("size", [None])
+        sizes = sizes if isinstance(sizes, list) else [sizes]
+        options = setup.get("options", {})
+        keys = list(options.keys())
+        values = [value if isinstance(value, list) else [value] for value in options.values()]
+        container = str(setup.get("container", DEFAULT_CONTAINER)).lstrip(".")
+
+        for size in sizes:
+            size = parse_size(size) if size is not None else None
+            for combination in itertools.product(*values):
+                combination = dict(zip(keys, combination))
+                name = get_encode_name(setup["codec"], combination, size)
+                if "name" in setup:
+                    fields = dict(combination, codec=setup["codec"], size="{}x{}".format(*size) if size else "")
+                    try:
+                        name = setup["name"].format(**fields)
+                    except (KeyError, IndexError) as e:
+                        raise ValueError("The name {!r} uses the unknown field {}.".format(setup["name"], e))
+                output = Path(output_dir).joinpath("{}.{}".format(NAME_PATTERN.sub("-", name), container))
+                # Two encodes writing the same file would overwrite each other's
+                # video and results
+                if output in outputs:
+                    raise ValueError("More than one encode writes to {}, give them different names.".format(output))
+                outputs.add(output)
+                encodes.append(
+                    {
+                        "name": name,
+                        "codec": setup["codec"],
+                        "size": size,
+                        "options": combination,
+                        "output": str(output),
+                    }
+                )
+
+    return encodes
+
+
+def escape_tee_path(path):
+    """Escape a file path for the tee muxer, which also cleans it up for windows systems."""
+    return str(path).replace("\\", "/").replace("'", "\\'").replace("|", "\\|")
+
+
+def build_encode(
+    encode,
+    reference,
+    ref_decode,
+    ffmpeg="ffmpeg",
+    scaler="accurate",
+):
+    """Create the ffmpy.FFmpeg command encoding the reference video file with the settings of an encode.
+
+    The tee muxer writes the encoded video stream to the output file and, as NUT, to stdout, which
+    feeds the measuring command of build_measure without the output file ever being read back.
+    """
+    options = ["-map 0:v:0", "-an", "-c:v {}".format(encode["codec"])]
+    if encode["size"] is not None:
+        options.append("-vf scale={}:{}:flags={}".format(*encode["size"], SCALERS[scaler]))
+    for key, value in encode["options"].items():
+        options.append("-{} {}".format(key, shlex.quote(str(value))))
+    # The tee muxer can not tell the encoder which of its outputs need global
+    # headers, while both of them take them
+    options.append("-flags +global_header -f tee")
+
+    return ffmpy.FFmpeg(
+        executable=ffmpeg,
+        global_options=[
+            "-hide_banner",
+            "-nostdin",
+            "-nostats",
+            "-y",
+        ],
+        inputs={reference: ref_decode},
+        outputs={"{}|[f=nut]pipe:1".format(escape_tee_path(encode["output"])): " ".join(options)},
+    )
+
+
+def build_measure(
+    encode,
+    filters,
+    ref_info,
+    reference,
+    ref_decode,
+    pix_fmt,
+    ffmpeg="ffmpeg",
+    scaler="accurate",
+    ref_chain="",
+):
+    """Create the ffmpy.FFmpeg command feeding the encoded video stream on stdin into every given libvmaf filter.
+
+    The encoded video stream gets scaled to the resolution of the reference and converted to its
+    pixel format, where ref_chain holds the filters converting the reference, see plan_normalize_filters.
+    """
+    size = encode["size"] if encode["size"] is not None else (ref_info["width"], ref_info["height"])
+    # Encoders can change the pixel format, which is only known when it is set
+    # explicitly and otherwise always gets converted
+    info = {"width": size[0], "height": size[1], "pix_fmt": encode["options"].get("pix_fmt")}
+    graph = build_filter_graph(
+        filters,
+        dist_labels=["0:v"] * len(filters),
+        ref_label="1:v",
+        dist_chains={"0:v": build_normalize_filter(info, ref_info["width"], ref_info["height"], pix_fmt, scaler)},
+        ref_chain=ref_chain,
+    )
+
+    return ffmpy.FFmpeg(
+        executable=ffmpeg,
+        global_options=[
+            "-hide_banner",
+        ],
+        inputs={"pipe:0": "-f nut", reference: ref_decode},
+        outputs={"-": "-filter_complex " + repr(graph) + " -f null"},
+    )
+
+
+class VMAF_Encode_Runner(VMAF_Stream_Runner):
+    """Runs an encoding command piped straight into the command measuring its VMAF scores.
+
+    The encoder's second tee output is read by the measuring command on stdin, so the scores arrive
+    as soon as the encode finishes. Both commands run in their own process groups, which both get
+    killed together, deleting the partially written output file along with the logs.
+    """
+
+    def __init__(
+        self,
+        encode_ff,
+        ff,
+        frames=0,
+        timeout=0,
+        logs=None,
+    ):
+        super().__init__(ff, frames=frames, timeout=timeout, logs=logs)
+        self._encode_ff = encode_ff
+        self._encoder = None
+        self._encode_tail = deque(maxlen=STDERR_TAIL)
+        self._encode_reader = None
+        self._encode_seconds = None
+
+    def get_encode_seconds(self):
+        """Get the wall seconds the encoder ran for, or None if it has not finished."""
+        return self._encode_seconds
+
+    def _read_encode_stderr_line(
+        self,
+        raw,
+    ):
+        self._encode_tail.append(raw.decode("utf-8", errors="replace").rstrip())
+
+    def _read_encode_stderr(self):
+        for raw in self._encoder.stderr:
+            self._read_encode_stderr_line(raw)
+        self._encoder.wait()
+        self._encode_seconds = perf_counter() - self._started
+
+    def _open_process(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            self._encoder = sp.Popen(
+                self._encode_ff._cmd,
+                stdin=sp.DEVNULL,
+                stdout=write_fd,
+                stderr=sp.PIPE,
+                start_new_session=os.name == "posix",
+            )
+            self._encode_ff.process = self._encoder
+            process = sp.Popen(
+                self._get_command(),
+                stdin=read_fd,
+                stdout=sp.PIPE,
+                stderr=sp.PIPE,
+                start_new_session=os.name == "posix",
+            )
+        except OSError:
+            if self._encoder is not None:
+                self._kill_encoder()
+            raise
+        finally:
+            # Only the two commands keep the pipe open, so that either one
+            # sees the other exit
+            os.close(read_fd)
+            os.close(write_fd)
+
+        self._encode_reader = threading.Thread(target=self._read_encode_stderr, daemon=True)
+        self._encode_reader.start()
+
+        return process
+
+    def _kill_encoder(self):
+        if self._encoder.returncode is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(self._encoder.pid, signal.SIGKILL)
+            else:
+                self._encoder.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def kill(self):
+        """Kill both commands along with every process in their process groups."""
+        super().kill()
+        if self._encoder is not None:
+            self._kill_encoder()
+
+    def _wait(self):
+        super()._wait()
+        self._encode_reader.join()
+
+    def _finish(self):
+        """Check how both commands exited, returning the VMAF scores of the encode if both finished."""
+        if self._process.returncode == 0 and self._encoder.returncode == 0:
+            return self.get_scores()
+
+        # Without its scores a finished encode would only get encoded again
+        self.remove_logs()
+        # Either command failing breaks the pipe of the other one, so the
+        # stderr of both is reported, starting with the encoder's
+        stderr = []
+        if self._encoder.returncode != 0:
+            stderr += ["Encoder:"] + list(self._encode_tail)
+        if self._process.returncode != 0:
+            stderr += ["Measurement:"] + list(self._tail)
+        stderr = "\n".join(stderr).encode("utf-8")
+        if self._encoder.returncode != 0:
+            command, returncode = self._encode_ff.cmd, self._encoder.returncode
+        else:
+            command, returncode = self._ff.cmd, self._process.returncode
+        if self._timed_out:
+            raise VMAF_Timeout_Error(command, returncode, b"", stderr)
+        raise ffmpy.FFRuntimeError(command, returncode, b"", stderr)
+
+    async def _open_process_async(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            self._encoder = await asyncio.create_subprocess_exec(
+                *self._encode_ff._cmd,
+                stdin=sp.DEVNULL,
+                stdout=write_fd,
+                stderr=sp.PIPE,
+                start_new_session=os.name == "posix",
+            )
+            self._encode_ff.process = self._encoder
+            process = await asyncio.create_subprocess_exec(
+                *self._get_command(),
+                stdin=read_fd,
+                stdout=sp.PIPE,
+                stderr=sp.PIPE,
+                start_new_session=os.name == "posix",
+            )
+        except OSError:
+            if self._encoder is not None:
+                self._kill_encoder()
+            raise
+        finally:
+            # Only the two commands keep the pipe open, so that either one
+            # sees the other exit
+            os.close(read_fd)
+            os.close(write_fd)
+
+        return process
+
+    async def _wait_encoder_async(self):
+        await self._read_stream(self._encoder.stderr, self._read_encode_stderr_line)
+        await self._encoder.wait()
+        self._encode_seconds = perf_counter() - self._started
+
+    async def _wait_async(self):
+        await asyncio.gather(super()._wait_async(), self._wait_encoder_async())
+
+    async def _reap_async(self):
+        await asyncio.gather(super()._reap_async(), self._encoder.wait())
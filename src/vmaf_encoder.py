@@ -0,0 +1,372 @@
+import argparse as argp
+import concurrent.futures as cf
+import multiprocessing as mp
+import signal
+from datetime import timedelta
+from pathlib import Path
+from time import time
+
+import ffmpy
+
+from vmaf_calculator import finish_pair, write_aggregate
+from vmaf_common import handle_terminate, search_handler
+from vmaf_encode_handler import (
+    VMAF_Encode_Runner,
+    build_encode,
+    build_measure,
+    plan_encodes,
+    read_encodes,
+)
+from vmaf_job_handler import (
+    SCALERS,
+    build_vmaf_filter,
+    build_vmaf_options,
+    escape_log_path,
+    get_log_file,
+    get_log_location,
+    plan_normalize_filters,
+)
+from vmaf_probe_handler import get_ffprobe, probe_video
+from vmaf_settings_handler import load_settings
+from vmaf_state_handler import VMAF_State_Handler
+from vmaf_stream_handler import create_engine
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for encoding and measuring every combination of an encoder config file."""
+    # Defaults come from the [vmaf.general] and [vmaf.calculator] sections of
+    # the project's pyproject.toml
+    settings = load_settings()
+    main_help = "Encodes the reference video file with every combination of settings in an encoder config file, "
+    main_help += "measuring the VMAF scores of every encode while it is written.\n"
+    main_help += "Every encode is tee'd straight into libvmaf, so the encoded video files are never read back, "
+    main_help += "and the results are saved in the same layout and save state as the VMAF Calculator's."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+
+    reference_help = "Reference video file to encode and measure every encode against."
+    parser.add_argument(
+        "-r",
+        "--reference",
+        dest="reference",
+        type=str,
+        required=True,
+        help=reference_help,
+    )
+
+    config_help = "Encoder config file, holding an [[encode]] table for every encoder setup.\n"
+    config_help += 'Every table sets the "codec", and optionally the "name" template of its encoded video files, '
+    config_help += 'their "container" and the "size" they get scaled to as "WIDTHxHEIGHT".\n'
+    config_help += 'The "options" table holds the FFmpeg output options of the encoder without their dashes.\n'
+    config_help += "The size and every option can be a list of values, which get encoded in every combination."
+    parser.add_argument(
+        "-c",
+        "--config",
+        dest="config",
+        type=str,
+        required=True,
+        help=config_help,
+    )
+
+    model_help = "Specify the VMAF model files to measure every encode with."
+    parser.add_argument(
+        "-m",
+        "--model",
+        dest="model",
+        nargs="+",
+        type=str,
+        required=True,
+        help=model_help,
+    )
+
+    output_help = 'Specify the directory of the encoded video files (Default is "<reference name>_encodes" next to the reference).'
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        "--output_dir",
+        dest="output_dir",
+        type=str,
+        help=output_help,
+    )
+
+    ffmpeg_help = 'Specify the path to the FFmpeg executable (Default is "{}").'.format(settings["general"]["ffmpeg"])
+    parser.add_argument(
+        "-f",
+        "--ffmpeg",
+        dest="ffmpeg",
+        type=str,
+        default=settings["general"]["ffmpeg"],
+        help=ffmpeg_help,
+    )
+
+    log_format_help = "Specify the VMAF log file format."
+    parser.add_argument(
+        "-l",
+        "--log-format",
+        "--log_format",
+        dest="log_format",
+        choices=["xml", "csv", "json"],
+        default=settings["calculator"]["log_format"],
+        help=log_format_help,
+    )
+
+    threads_help = 'Specify number of libvmaf threads of every measurement (Default is 0 for "autodetect").'
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        type=int,
+        default=settings["calculator"]["threads"],
+        help=threads_help,
+    )
+
+    proc_help = "Specify number of simultaneous encodes to run (Default is 1)."
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        type=int,
+        default=1,
+        help=proc_help,
+    )
+
+    scaler_help = (
+        "Specify the scaler used for encodes with a size, and for scaling them back to the reference resolution.\n"
+    )
+    scaler_help += '"accurate" is bicubic with accurate rounding, "fast" is fast bilinear (Default is "accurate").'
+    parser.add_argument(
+        "--scaler",
+        dest="scaler",
+        choices=list(SCALERS.keys()),
+        default="accurate",
+        help=scaler_help,
+    )
+
+    hwaccel_help = "Enable FFmpeg to automatically attempt to use hardware acceleration for decoding the reference."
+    parser.add_argument(
+        "--hwaccel",
+        dest="hwaccel",
+        action="store_true",
+        default=settings["calculator"]["hwaccel"],
+        help=hwaccel_help,
+    )
+
+    timeout_help = "Specify the number of seconds a single encode may run for (Default is 0 for no limit)."
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=int,
+        default=0,
+        help=timeout_help,
+    )
+
+    overwrite_help = "Encode every combination again, instead of skipping the ones finished in the save state."
+    parser.add_argument(
+        "--overwrite",
+        dest="overwrite",
+        action="store_true",
+        help=overwrite_help,
+    )
+
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, mp.cpu_count()))
+    if args.output_dir is None:
+        ref_path = Path(args.reference)
+        args.output_dir = str(ref_path.parent.joinpath("{}_encodes".format(ref_path.stem)))
+
+    return args
+
+
+def main(args):
+    """Run every encode of the parsed arguments."""
+    settings = load_settings()
+
+    # Make sure the reference video file and the VMAF model files exist
+    models = []
+    try:
+        search_handler(args.reference)
+        for model in args.model:
+            models += search_handler(model, search_for="model")
+        if len(models) == 0:
+            raise OSError("Could not find any VMAF model files. The program will now exit.")
+    except OSError as ose:
+        print(ose)
+        exit(1)
+
+    try:
+        encodes = plan_encodes(read_encodes(args.config), args.output_dir)
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+    try:
+        ref_info = probe_video(args.reference, get_ffprobe(args.ffmpeg))
+    except (OSError, ValueError, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+        print("Could not probe the reference video file {}: {}".format(args.reference, e))
+        exit(1)
+    # Every encode gets scaled and converted back to the reference the same
+    # way as the distorted video files of the VMAF Calculator
+    normalize = plan_normalize_filters({args.reference: ref_info}, args.reference, [], args.scaler)
+
+    # Encodes are saved in the same save state as the VMAF Calculator's, with
+    # the encoded video file as the distorted video file
+    state = VMAF_State_Handler(args.reference)
+    io = state.load()
+    aggregate = {}
+    pending = []
+    vmaf_options = build_vmaf_options(
+        settings["calculator"]["psnr"], settings["calculator"]["ssim"], settings["calculator"]["ms_ssim"]
+    )
+    try:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+        for encode in encodes:
+            dist = encode["output"]
+            log_dir = get_log_location(dist, models[0], args.log_format).parent
+            if not args.overwrite and dist in io:
+                check = [model in io[dist] and io[dist][model]["status"] in ["DONE", "MOVED"] for model in models]
+                if all(check):
+                    # Move an encode that finished right before its results
+                    # were saved the same way as the VMAF Calculator does
+                    if Path(dist).exists():
+                        Path(dist).replace(log_dir.joinpath(Path(dist).name))
+                        for model in io[dist].keys():
+                            io[dist][model]["status"] = "MOVED"
+                    print("Skipping {}, which was already encoded and measured.".format(encode["name"]))
+                    continue
+
+            log_dir.mkdir(exist_ok=True)
+            io[dist] = {}
+            for model in models:
+                log_loc = get_log_location(dist, model, args.log_format)
+                Path(log_loc).unlink(missing_ok=True)
+                io[dist][model] = {
+                    "status": "NOT STARTED",
+                    "log_path": escape_log_path(log_loc),
+                    "commands": build_vmaf_filter(model, args.log_format) + vmaf_options,
+                }
+            aggregate[dist] = {
+                "log": log_dir.joinpath("{}_aggregate.txt".format(Path(dist).stem)),
+                "score": 0,
+            }
+            pending.append(encode)
+    except OSError as ose:
+        print(ose)
+        exit(1)
+    state.compact(io)
+
+    if len(pending) == 0:
+        print("Every encode was already encoded and measured.")
+        state.close()
+        return
+
+    decode = "-hwaccel auto" if args.hwaccel else ""
+    instance_options = ":n_threads={}".format(args.threads) if args.threads > 0 else ""
+    print(
+        "Encoding and measuring {} combinations of {} with {} VMAF models, {} at a time\n".format(
+            len(pending), args.reference, len(models), args.processes
+        )
+    )
+
+    # Stop the same way as on a KeyboardInterrupt when terminated
+    signal.signal(signal.SIGTERM, handle_terminate)
+
+    # Holds the running Futures as keys, with the encode and its
+    # VMAF_Encode_Runner as values
+    running = {}
+    was_cancelled = False
+    start = time()
+    cf_handler = create_engine("threads", args.processes)
+    try:
+        for encode in pending:
+            dist = encode["output"]
+            filters = [
+                "{}{}:log_path={}".format(io[dist][model]["commands"], instance_options, io[dist][model]["log_path"])
+                for model in models
+            ]
+            runner = VMAF_Encode_Runner(
+                build_encode(encode, args.reference, decode, args.ffmpeg, args.scaler),
+                build_measure(
+                    encode,
+                    filters,
+                    ref_info,
+                    args.reference,
+                    decode,
+                    normalize["pix_fmt"],
+                    args.ffmpeg,
+                    args.scaler,
+                    normalize["reference"],
+                ),
+                frames=ref_info["frames"],
+                timeout=args.timeout,
+                logs=[get_log_file(io[dist][model]["log_path"]) for model in models] + [dist],
+            )
+            for model in models:
+                io[dist][model]["status"] = "STARTED"
+                state.record(dist, model, io[dist][model])
+            running[cf_handler.submit(runner.run)] = {"encode": encode, "runner": runner}
+
+        for task in cf.as_completed(running.keys()):
+            encode = running[task]["encode"]
+            runner = running[task]["runner"]
+            dist = encode["output"]
+            try:
+                scores = task.result()
+            except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+                # A failed encode, such as one with an unknown option, does not
+                # stop the other encodes
+                print("Encode {} failed:\n{}".format(encode["name"], e))
+                for model in models:
+                    io[dist][model]["status"] = "CANCELLED"
+                    state.record(dist, model, io[dist][model])
+                continue
+
+            seconds = runner.get_encode_seconds()
+            aggregate[dist]["file_size"] = Path(dist).stat().st_size
+            for model, score in zip(models, scores + [None] * (len(models) - len(scores))):
+                io[dist][model]["encode"] = {
+                    "codec": encode["codec"],
+                    "size": encode["size"],
+                    "options": encode["options"],
+                    "seconds": seconds,
+                }
+                finish_pair(dist, model, score, io, aggregate, state)
+            write_aggregate(dist, io, aggregate, state)
+
+            # Add how long the encode took and its bitrate to the aggregate log
+            # file, for comparing the encodes by their cost as well
+            with open(aggregate[dist]["log"], "a") as aggregate_file:
+                if seconds is not None:
+                    aggregate_file.write("Encode Time: {}\n".format(timedelta(seconds=seconds)))
+                if ref_info["frames"] > 0 and ref_info["fps"] > 0:
+                    bitrate = aggregate[dist]["file_size"] * 8 / (ref_info["frames"] / ref_info["fps"])
+                    aggregate_file.write("Bitrate: {:.0f} kb/s\n".format(bitrate / 1000))
+            print("Finished {}:\n{}".format(encode["name"], aggregate[dist]["msg"]))
+
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected, working on shutting down pool...")
+        was_cancelled = True
+        cf_handler.shutdown(wait=False, cancel_futures=True)
+        # Kill every encode along with its measurement, which also deletes
+        # their partially written video files and logs
+        for task, info in running.items():
+            info["runner"].kill()
+        cf_handler.shutdown(wait=True, cancel_futures=True)
+        for task, info in running.items():
+            dist = info["encode"]["output"]
+            for model in models:
+                if io[dist][model]["status"] not in ["DONE", "MOVED"]:
+                    io[dist][model]["status"] = "CANCELLED"
+                    state.record(dist, model, io[dist][model])
+        print("Pool has shutdown, exiting...")
+    else:
+        cf_handler.shutdown()
+
+    state.compact(io)
+    state.close()
+    if was_cancelled:
+        exit(1)
+
+    print("Program took {}".format(timedelta(seconds=time() - start)))
+
+
+if __name__ == "__main__":
+    main(parse_arguments())
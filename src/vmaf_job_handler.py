@@ -0,0 +1,451 @@
+from pathlib import Path
+
+import ffmpy
+
+# Number of frames shared by neighbouring segments on each side, since the
+# motion features of a frame depend on the frames before and after it
+MOTION_OVERLAP = 1
+
+# Pixel formats libvmaf reads directly, any other format gets converted to the
+# closest one of these first
+VMAF_PIX_FMTS = [
+    "yuv420p",
+    "yuv422p",
+    "yuv444p",
+    "yuv420p10le",
+    "yuv422p10le",
+    "yuv444p10le",
+]
+
+# FFmpeg scaler flags used for scaling distorted video files to the resolution
+# of the reference video file, bicubic being what VMAF's models were trained on
+SCALERS = {
+    "fast": "fast_bilinear",
+    "accurate": "bicubic+accurate_rnd+full_chroma_int",
+}
+
+
+def build_vmaf_filter(
+    model,
+    log_format="xml",
+):
+    """Start the libvmaf filter of a VMAF model, without its shared options and log path."""
+    # Plug in the vmaf model, escaped for the filter graph syntax
+    vmaf_filter = "libvmaf=model_path={}".format(model).replace("\\", "/").replace(":", "\\:")
+    # Add specified log format argument to libvmaf filter
+    return vmaf_filter + ":log_fmt={}".format(log_format)
+
+
+def build_vmaf_options(
+    psnr=False,
+    ssim=False,
+    ms_ssim=False,
+    subsamples=None,
+):
+    """Build the libvmaf filter options shared by every VMAF model."""
+    options = ""
+    if psnr:
+        options += ":psnr=1"
+    if ssim:
+        options += ":ssim=1"
+    if ms_ssim:
+        options += ":ms_ssim=1"
+    if subsamples:
+        options += ":n_subsample={}".format(subsamples)
+
+    return options
+
+
+def get_log_location(
+    dist,
+    model,
+    log_format="xml",
+):
+    """Get the log file of a dist-model pair, inside the results folder next to the distorted video file."""
+    dist_path = Path(dist)
+    log_dir = dist_path.parent.joinpath("{}_results".format(dist_path.stem))
+    return log_dir.joinpath("{}_{}.{}".format(dist_path.stem, Path(model).stem, log_format))
+
+
+def get_packet_location(dist):
+    """Get the packet log of a distorted video file, inside the results folder next to it."""
+    dist_path = Path(dist)
+    log_dir = dist_path.parent.joinpath("{}_results".format(dist_path.stem))
+    return log_dir.joinpath("{}_packets.csv".format(dist_path.stem))
+
+
+def escape_log_path(log_loc):
+    """Escape a log file path for the libvmaf filter, which also cleans it up for windows systems."""
+    return str(log_loc).replace("\\", "/").replace(":", "\\:")
+
+
+def get_log_file(log_path):
+    """Get the actual file path of a log path that was escaped for the libvmaf filter."""
+    return log_path.replace("\\:", ":")
+
+
+def get_vmaf_pix_fmt(pix_fmt):
+    """Get the pixel format libvmaf reads that is closest to the given one, keeping its chroma subsampling and bit depth."""
+    if pix_fmt in VMAF_PIX_FMTS:
+        return pix_fmt
+
+    chroma = "420"
+    for subsampling in ["422", "444"]:
+        if subsampling in pix_fmt:
+            chroma = subsampling
+    # Anything above 8 bits per sample gets converted to 10 bits
+    depth = "10le" if any(bits in pix_fmt for bits in ["p10", "p12", "p16", "p010", "p016"]) else ""
+
+    return "yuv{}p{}".format(chroma, depth)
+
+
+def build_normalize_filter(
+    info,
+    width,
+    height,
+    pix_fmt,
+    scaler="accurate",
+):
+    """Build the filters that scale a probed video stream to the given resolution and convert it to the given pixel format.
+
+    Returns an empty string if the video stream already matches both.
+    """
+    chain = []
+    if info["width"] != width or info["height"] != height:
+        chain.append("scale={}:{}:flags={}".format(width, height, SCALERS[scaler]))
+    if info.get("pix_fmt") != pix_fmt:
+        chain.append("format={}".format(pix_fmt))
+
+    return ",".join(chain)
+
+
+def plan_normalize_filters(
+    infos,
+    reference,
+    dists,
+    scaler="accurate",
+):
+    """Plan the filters that bring every distorted video file to the resolution and pixel format of the reference video file.
+
+    Returns a dict with the "reference" filters, which convert the reference video file to a pixel format
+    libvmaf reads, the "pix_fmt" it gets converted to, and the "distorted" filters of every distorted video
+    file. Video files that were not probed get no filters.
+    """
+    normalize = {
+        "reference": "",
+        "pix_fmt": None,
+        "distorted": {},
+    }
+    ref_info = infos.get(reference)
+    if ref_info is None or ref_info["width"] <= 0 or ref_info["height"] <= 0:
+        return normalize
+
+    pix_fmt = get_vmaf_pix_fmt(ref_info.get("pix_fmt") or "yuv420p")
+    normalize["pix_fmt"] = pix_fmt
+    if ref_info.get("pix_fmt") and ref_info["pix_fmt"] != pix_fmt:
+        normalize["reference"] = "format={}".format(pix_fmt)
+    for dist in dists:
+        if dist in infos:
+            normalize["distorted"][dist] = build_normalize_filter(
+                infos[dist], ref_info["width"], ref_info["height"], pix_fmt, scaler
+            )
+
+    return normalize
+
+
+def select_normalize_filters(
+    normalize,
+    dists,
+):
+    """Get the normalising filters of plan_normalize_filters for only the given distorted video files."""
+    return dict(
+        normalize, distorted={dist: normalize["distorted"][dist] for dist in dists if dist in normalize["distorted"]}
+    )
+
+
+def build_filter_graph(
+    filters,
+    dist_labels=None,
+    ref_label="1:v",
+    dist_chains=None,
+    ref_chain="",
+):
+    """Build a filter graph that feeds every given libvmaf filter from a single decode of every input.
+
+    dist_labels holds the distorted input stream used by each filter, defaulting to the first input.
+    dist_chains holds the filters normalising every distorted input stream and ref_chain those of the
+    reference, which run once on every input before it gets split between the libvmaf instances.
+    """
+    if dist_labels is None:
+        dist_labels = ["0:v"] * len(filters)
+    dist_chains = dist_chains if dist_chains else {}
+
+    # Normalise every input once, so that every libvmaf instance using it
+    # shares the same scaled and converted frames
+    graph = []
+    norm_labels = {}
+    for i, label in enumerate(dict.fromkeys(dist_labels)):
+        norm_labels[label] = label
+        if dist_chains.get(label):
+            norm_labels[label] = "norm{}".format(i)
+            graph.append("[{}]{}[{}]".format(label, dist_chains[label], norm_labels[label]))
+    dist_labels = [norm_labels[label] for label in dist_labels]
+    if ref_chain:
+        graph.append("[{}]{}[normref]".format(ref_label, ref_chain))
+        ref_label = "normref"
+
+    if len(filters) == 1:
+        graph.append("[{}][{}]{}".format(dist_labels[0], ref_label, filters[0]))
+        return ";".join(graph)
+
+    # Split every decoded distorted input once for every libvmaf instance using it
+    dist_pads = {}
+    for i, label in enumerate(dict.fromkeys(dist_labels)):
+        count = dist_labels.count(label)
+        if count == 1:
+            dist_pads[label] = [label]
+            continue
+        dist_pads[label] = ["dist{}_{}".format(i, j) for j in range(count)]
+        graph.append("[{}]split={}{}".format(label, count, "".join(["[{}]".format(pad) for pad in dist_pads[label]])))
+
+    # Split the decoded reference once for every libvmaf instance
+    ref_pads = ["ref{}".format(i) for i in range(len(filters))]
+    graph.append("[{}]split={}{}".format(ref_label, len(filters), "".join(["[{}]".format(pad) for pad in ref_pads])))
+
+    for i, vmaf_filter in enumerate(filters):
+        graph.append("[{}][{}]{}".format(dist_pads[dist_labels[i]].pop(0), ref_pads[i], vmaf_filter))
+
+    return ";".join(graph)
+
+
+def plan_batches(
+    dists,
+    batch_size=1,
+    batch_memory=0,
+    dist_memory=None,
+):
+    """Group distorted video files into batches that share a single decode of the reference video file.
+
+    Batches hold at most batch_size files, and the estimated memory of their decoded frames
+    (taken from dist_memory, in bytes) stays within batch_memory MiB when it is not 0.
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for dist in dists:
+        dist_bytes = dist_memory.get(dist, 0) if dist_memory else 0
+        too_big = batch_memory > 0 and batch_bytes + dist_bytes > batch_memory * 1024 * 1024
+        if len(batch) > 0 and (len(batch) >= batch_size or too_big):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(dist)
+        batch_bytes += dist_bytes
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+
+def plan_segments(
+    frames,
+    count,
+):
+    """Split a video of the given number of frames into consecutive segments.
+
+    Every segment keeps the frames in the range [start, end), but is calculated starting from frame
+    "first" for "count" frames, so that it overlaps its neighbours by MOTION_OVERLAP frames.
+    """
+    count = max(1, min(count, frames))
+    segments = []
+    for i in range(count):
+        start = frames * i // count
+        end = frames * (i + 1) // count
+        first = max(0, start - MOTION_OVERLAP)
+        last = min(frames, end + MOTION_OVERLAP)
+        segments.append(
+            {
+                "index": i,
+                "start": start,
+                "end": end,
+                "first": first,
+                "count": last - first,
+            }
+        )
+
+    return segments
+
+
+def plan_refinement(
+    logs,
+    frames,
+    subsamples,
+    threshold,
+    delta,
+):
+    """Find the time ranges of subsampled VMAF logs that are worth calculating again at full density.
+
+    Every sample with a VMAF score below threshold, or that differs from a neighbouring sample by more
+    than delta, gets the frames up to its neighbouring samples refined. The ranges of every log are
+    merged, and returned as segments in the same layout as plan_segments.
+    """
+    ranges = []
+    for log in logs:
+        samples = [(frame["frameNum"], frame["metrics"].get("vmaf")) for frame in log["frames"]]
+        samples = [(frame_num, score) for frame_num, score in samples if score is not None]
+        for i, (frame_num, score) in enumerate(samples):
+            neighbours = [samples[j][1] for j in [i - 1, i + 1] if 0 <= j < len(samples)]
+            if score < threshold or any([abs(score - neighbour) > delta for neighbour in neighbours]):
+                ranges.append((max(0, frame_num - subsamples + 1), min(frames, frame_num + subsamples)))
+
+    # Merge the overlapping and touching ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    segments = []
+    for i, (start, end) in enumerate(merged):
+        first = max(0, start - MOTION_OVERLAP)
+        last = min(frames, end + MOTION_OVERLAP)
+        segments.append(
+            {
+                "index": i,
+                "start": start,
+                "end": end,
+                "first": first,
+                "count": last - first,
+            }
+        )
+
+    return segments
+
+
+def get_segment_log(
+    log_path,
+    index,
+):
+    """Get the log path used by a single segment of a calculation."""
+    log = Path(log_path)
+    return str(log.with_name("{}_segment{:03d}{}".format(log.stem, index, log.suffix)))
+
+
+def get_job_logs(
+    job,
+    io,
+):
+    """Get the dist, model and log path written by every libvmaf instance of a job."""
+    logs = []
+    for dist, model in job["pairs"]:
+        log_path = io[dist][model]["log_path"]
+        if job["segment"] is not None:
+            log_path = get_segment_log(log_path, job["segment"]["index"])
+        logs.append((dist, model, log_path))
+
+    return logs
+
+
+def build_job(
+    job,
+    io,
+    ref_input,
+    decode,
+    ref_decode,
+    ffmpeg="ffmpeg",
+    threads=0,
+    decode_threads=1,
+    normalize=None,
+):
+    """Create the ffmpy.FFmpeg command of a job, feeding every one of its dist-model pairs from a single decode.
+
+    threads sets libvmaf's n_threads, and decode_threads the threads of every input's decoder. normalize
+    holds the filters scaling and converting the inputs, see plan_normalize_filters.
+    """
+    # Distorted video files of this job, in the order of their inputs
+    dists = list(dict.fromkeys([dist for dist, _ in job["pairs"]]))
+    decode = " ".join(["-threads {}".format(decode_threads), decode]).strip()
+    ref_decode = " ".join(["-threads {}".format(decode_threads), ref_decode]).strip()
+    instance_options = ":n_threads={}".format(threads) if threads > 0 else ""
+    # The coarse pass of adaptive subsampling only calculates every Nth frame
+    if job.get("subsamples"):
+        instance_options += ":n_subsample={}".format(job["subsamples"])
+
+    # Segments seek both inputs to their first frame, half a frame early to
+    # avoid rounding onto the next frame, and stop after their last frame
+    seek = ""
+    limit = ""
+    if job["segment"] is not None:
+        if job["segment"]["first"] > 0:
+            seek = "-ss {:.6f} ".format((job["segment"]["first"] - 0.5) / job["segment"]["fps"])
+        limit = " -frames:v {}".format(job["segment"]["count"])
+
+    # Build the filter graph feeding one libvmaf filter per dist-model pair,
+    # with the reference video file as the last input
+    graph = build_filter_graph(
+        [
+            "{}{}:log_path={}".format(io[dist][model]["commands"], instance_options, log_path)
+            for dist, model, log_path in get_job_logs(job, io)
+        ],
+        dist_labels=["{}:v".format(dists.index(dist)) for dist, _ in job["pairs"]],
+        ref_label="{}:v".format(len(dists)),
+        dist_chains=(
+            {"{}:v".format(i): normalize["distorted"].get(dist, "") for i, dist in enumerate(dists)}
+            if normalize
+            else None
+        ),
+        ref_chain=normalize["reference"] if normalize else "",
+    )
+    inputs = {dist: seek + decode for dist in dists}
+    inputs[ref_input] = seek + ref_decode
+
+    return ffmpy.FFmpeg(
+        executable=ffmpeg,
+        global_options=[
+            "-hide_banner",
+        ],
+        inputs=inputs,
+        outputs={"-": "-filter_complex " + repr(graph) + limit + " -f null"},
+    )
+
+
+def get_job_size(
+    job,
+    infos,
+    reference,
+):
+    """Get the number of frames and pixels per frame a job calculates VMAF over, or zeroes if they are unknown."""
+    files = [reference] + [dist for dist, _ in job["pairs"]]
+    if any([file not in infos for file in files]):
+        return (0, 0)
+
+    # libvmaf works at the resolution of the largest input
+    pixels = max([infos[file]["width"] * infos[file]["height"] for file in files])
+    if job["segment"] is not None:
+        frames = job["segment"]["count"]
+    else:
+        frames = infos[reference]["frames"]
+
+    return (frames, pixels)
+
+
+def order_jobs(
+    jobs,
+    dists,
+    order="submission",
+):
+    """Sort the jobs by the given ordering policy.
+
+    - "submission" keeps the jobs in the order they were created.
+    - "distorted" runs every job of a distorted video file before moving on to the next one.
+    - "lpt" runs the jobs with the longest predicted cost first.
+    - "spt" runs the jobs with the shortest predicted cost first.
+    """
+    if order == "distorted":
+        return sorted(jobs, key=lambda job: min([dists.index(dist) for dist, _ in job["pairs"]]))
+    elif order == "lpt":
+        return sorted(jobs, key=lambda job: job["cost"], reverse=True)
+    elif order == "spt":
+        return sorted(jobs, key=lambda job: job["cost"])
+    return list(jobs)
@@ -0,0 +1,332 @@
+import hashlib
+import os
+import socket
+from json import dump, dumps, load
+from pathlib import Path
+from time import time
+
+# Seconds a claimed job stays leased without being renewed, after which any
+# worker may put it back into the queue
+LEASE_TIME = 60
+
+
+class VMAF_Lease_Handler:
+    """Shares VMAF calculation jobs between any number of workers through a shared directory.
+
+    Jobs are published as files in the "pending" directory. A worker claims a job by renaming its file
+    into the "claimed" directory, which only one worker can succeed at, and renews the lease by touching
+    the file while the job runs. A job whose lease was not renewed in time belonged to a worker that
+    crashed, so it gets renamed back into "pending". Finished jobs are written to the "done" directory
+    along with their VMAF scores. Lease times are measured by the clock of the shared directory's file
+    server, which may differ from the clocks of the workers.
+
+    Every worker must see the video files, models and log locations under the same paths.
+    """
+
+    def __init__(
+        self,
+        lease_dir,
+        worker=None,
+        lease_time=LEASE_TIME,
+    ):
+        self._lease_dir = Path(lease_dir)
+        self._pending_dir = self._lease_dir.joinpath("pending")
+        self._claimed_dir = self._lease_dir.joinpath("claimed")
+        self._done_dir = self._lease_dir.joinpath("done")
+        # Touched by every worker to read the current time of the file server
+        self._clock_file = self._lease_dir.joinpath(".clock")
+        self._worker = worker if worker else "{}_{}".format(socket.gethostname(), os.getpid())
+        self._lease_time = lease_time
+        # Names of the lease files claimed by this worker
+        self._claimed = set()
+        # IDs of the finished leases that were already collected
+        self._collected = set()
+
+        for directory in [self._pending_dir, self._claimed_dir, self._done_dir]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def get_worker(self):
+        return self._worker
+
+    def get_claimed(self):
+        return set(self._claimed)
+
+    def _write(
+        self,
+        file,
+        data,
+    ):
+        # Write to a temporary file first so that no worker ever reads a half
+        # written lease file
+        tmp_file = file.with_name(".{}.{}.tmp".format(file.name, self._worker))
+        with open(tmp_file, "w") as writer:
+            dump(data, writer, indent=4)
+        tmp_file.replace(file)
+
+    def _read(
+        self,
+        file,
+    ):
+        with open(file, "r") as reader:
+            lease = load(reader)
+        # JSON turns the tuples of a job into lists
+        lease["job"]["pairs"] = [tuple(pair) for pair in lease["job"]["pairs"]]
+        if "size" in lease["job"]:
+            lease["job"]["size"] = tuple(lease["job"]["size"])
+        return lease
+
+    def _find(
+        self,
+        lease_id,
+    ):
+        """Get the name of the lease file of a job, in whichever directory it currently is."""
+        for directory in [self._done_dir, self._claimed_dir, self._pending_dir]:
+            for file in directory.glob("*_{}.json".format(lease_id)):
+                return file
+        return None
+
+    def get_job_id(
+        self,
+        job,
+        io,
+        reference,
+    ):
+        """Get the lease ID of a job, which only depends on what the job calculates and where its logs go."""
+        key = dumps(
+            [
+                reference,
+                [
+                    (dist, model, io[dist][model]["commands"], io[dist][model]["log_path"])
+                    for dist, model in job["pairs"]
+                ],
+                job["segment"],
+                job.get("subsamples"),
+                job.get("refine"),
+                job.get("sample"),
+                job.get("normalize"),
+            ],
+            sort_keys=True,
+        )
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest()
+
+    def _drop_superseded(
+        self,
+        jobs,
+        reference,
+        lease_ids,
+    ):
+        """Delete the pending leases of the given jobs' dist-model pairs that are not among the given lease IDs.
+
+        These were left behind by an interrupted run with other options, whose logs nobody collects.
+        """
+        pairs = set([tuple(pair) for job in jobs for pair in job["pairs"]])
+        lease_ids = set(lease_ids)
+        dropped = 0
+        for file in self._pending_dir.glob("*.json"):
+            if self.get_lease_id(file) in lease_ids:
+                continue
+            try:
+                lease = self._read(file)
+            except (FileNotFoundError, ValueError):
+                continue
+            if lease["reference"] == reference and len(pairs.intersection(lease["job"]["pairs"])) > 0:
+                file.unlink(missing_ok=True)
+                dropped += 1
+        if dropped > 0:
+            print("Dropped {} pending VMAF calculation jobs that were published with other options".format(dropped))
+
+    def publish(
+        self,
+        jobs,
+        io,
+        reference,
+    ):
+        """Publish jobs for any worker to claim, returning their lease IDs in the same order.
+
+        Jobs that were already published keep their existing lease file, so publishing the same jobs
+        again after a crash picks up where the workers left off. Pending jobs of the same dist-model pairs
+        that were published with other options are dropped.
+        """
+        lease_ids = [self.get_job_id(job, io, reference) for job in jobs]
+        self._drop_superseded(jobs, reference, lease_ids)
+        for order, (job, lease_id) in enumerate(zip(jobs, lease_ids)):
+            if self._find(lease_id) is not None:
+                continue
+
+            # Everything a worker needs to build the job's FFmpeg command
+            lease_io = {}
+            for dist, model in job["pairs"]:
+                if dist not in lease_io:
+                    lease_io[dist] = {}
+                lease_io[dist][model] = {
+                    "commands": io[dist][model]["commands"],
+                    "log_path": io[dist][model]["log_path"],
+                }
+            lease = {
+                "reference": reference,
+                "job": job,
+                "io": lease_io,
+            }
+            self._write(self._pending_dir.joinpath("{:06d}_{}.json".format(order, lease_id)), lease)
+
+        return lease_ids
+
+    def claim(self):
+        """Claim the next pending job, returning its lease ID and lease, or None if there is nothing to claim."""
+        self.requeue_expired()
+        for file in sorted(self._pending_dir.glob("*.json")):
+            claimed = self._claimed_dir.joinpath(file.name)
+            # A requeued job may still have been finished by the worker that
+            # lost its lease
+            if self._done_dir.joinpath(file.name).exists():
+                file.unlink(missing_ok=True)
+                continue
+            # Renaming keeps the modification time, which is what the lease
+            # expiry is measured from, so the lease is renewed under a name
+            # that requeue_expired does not take for a claimed job yet
+            staged = self._claimed_dir.joinpath("{}.claim".format(file.name))
+            try:
+                # Only a single worker can rename the same file
+                file.rename(staged)
+                os.utime(staged)
+                staged.rename(claimed)
+                lease = self._read(claimed)
+            except (FileNotFoundError, ValueError):
+                continue
+            self._claimed.add(claimed.name)
+            return (self.get_lease_id(claimed), lease)
+
+        return None
+
+    def get_lease_id(
+        self,
+        file,
+    ):
+        return Path(file).stem.split("_", 1)[1]
+
+    def renew(self):
+        """Renew the leases of every job claimed by this worker."""
+        for name in list(self._claimed):
+            try:
+                os.utime(self._claimed_dir.joinpath(name))
+            except FileNotFoundError:
+                # The lease expired and was requeued by another worker
+                self._claimed.discard(name)
+
+    def get_time(self):
+        """Get the current time by the clock that sets the modification times of the lease files.
+
+        Files on a network drive get their modification times from the file server, so the time is read
+        back from a file touched just now instead of this machine's clock.
+        """
+        try:
+            self._clock_file.touch()
+            return self._clock_file.stat().st_mtime
+        except OSError:
+            return time()
+
+    def requeue_expired(self):
+        """Put every job whose lease was not renewed in time back into the queue, returning how many were requeued."""
+        requeued = 0
+        now = self.get_time()
+        # Jobs being claimed are requeued too, for workers that crashed halfway
+        # through claiming one. A claim that is still going on then fails on
+        # its next rename, leaving the job pending for the next claim.
+        for file in list(self._claimed_dir.glob("*.json")) + list(self._claimed_dir.glob("*.json.claim")):
+            name = file.stem if file.suffix == ".claim" else file.name
+            try:
+                if now - file.stat().st_mtime < self._lease_time or name in self._claimed:
+                    continue
+                file.rename(self._pending_dir.joinpath(name))
+                requeued += 1
+            except FileNotFoundError:
+                continue
+        if requeued > 0:
+            print("Requeued {} VMAF calculation jobs with expired leases".format(requeued))
+
+        return requeued
+
+    def complete(
+        self,
+        lease_id,
+        scores,
+        seconds,
+        error=None,
+        usage=None,
+    ):
+        """Save the VMAF scores of a finished job, or the error it failed with, and drop its lease.
+
+        usage holds the resource usage of the job's FFmpeg process, see VMAF_Stream_Runner.get_usage.
+        """
+        file = self._find(lease_id)
+        if file is None:
+            return
+        try:
+            lease = self._read(file)
+        except (FileNotFoundError, ValueError):
+            return
+        lease["scores"] = scores
+        lease["seconds"] = seconds
+        lease["worker"] = self._worker
+        lease["error"] = error
+        lease["usage"] = usage
+        self._write(self._done_dir.joinpath(file.name), lease)
+        self.release(lease_id, requeue=False)
+        # Nobody needs to run the job again if its lease had been requeued
+        self._pending_dir.joinpath(file.name).unlink(missing_ok=True)
+
+    def release(
+        self,
+        lease_id,
+        requeue=True,
+    ):
+        """Drop the lease of a claimed job, putting it back into the queue unless it was finished."""
+        for name in list(self._claimed):
+            if self.get_lease_id(name) != lease_id:
+                continue
+            self._claimed.discard(name)
+            claimed = self._claimed_dir.joinpath(name)
+            try:
+                if requeue:
+                    claimed.rename(self._pending_dir.joinpath(name))
+                else:
+                    claimed.unlink()
+            except FileNotFoundError:
+                pass
+
+    def release_all(self):
+        for name in list(self._claimed):
+            self.release(self.get_lease_id(name))
+
+    def collect(
+        self,
+        lease_ids,
+    ):
+        """Get the leases of the given lease IDs that finished since the last time they were collected."""
+        lease_ids = set(lease_ids) - self._collected
+        finished = {}
+        for file in self._done_dir.glob("*.json"):
+            lease_id = self.get_lease_id(file)
+            if lease_id not in lease_ids:
+                continue
+            try:
+                finished[lease_id] = self._read(file)
+            except ValueError:
+                continue
+            self._collected.add(lease_id)
+
+        return finished
+
+    def remove(
+        self,
+        lease_id,
+    ):
+        """Delete the finished lease of a job once its results were saved, so the job can be published again later."""
+        for file in self._done_dir.glob("*_{}.json".format(lease_id)):
+            file.unlink(missing_ok=True)
+
+    def count_pending(self):
+        return len(list(self._pending_dir.glob("*.json")))
+
+    def count_claimed(self):
+        return len(list(self._claimed_dir.glob("*.json")))
@@ -0,0 +1,274 @@
+import csv
+import json
+import xml.etree.ElementTree as xml
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+
+# Version written into merged VMAF logs when the source logs do not have one
+DEFAULT_VERSION = "2.1.1"
+
+
+def get_log_format(file):
+    """Get the VMAF log format from a log file's extension."""
+    ext = Path(file).suffix.lower().replace(".", "")
+    if ext not in ["xml", "json", "csv"]:
+        raise OSError("ERROR: Could not determine the VMAF log format of file {}".format(file))
+    return ext
+
+
+def read_log(file):
+    """Read every per-frame metric of a VMAF log file.
+
+    Returns a dict with the "version", "fps", "params" and "frames" keys, where "frames" is a list of
+    dicts with the "frameNum" and "metrics" keys in the same layout as libvmaf's JSON logs. Logs made
+    by adaptive subsampling also get a "refine" key, see merge_refined.
+    """
+    fmt = get_log_format(file)
+    log = {
+        "version": DEFAULT_VERSION,
+        "fps": None,
+        "params": {},
+        "frames": [],
+    }
+
+    if fmt == "xml":
+        root = xml.parse(str(file)).getroot()
+        log["version"] = root.attrib.get("version", DEFAULT_VERSION)
+        params = root.find("params")
+        if params is not None:
+            log["params"] = dict(params.attrib)
+        fyi = root.find("fyi")
+        if fyi is not None:
+            # VMAF version 1 calls it "execFps"
+            fps = fyi.attrib.get("fps", fyi.attrib.get("execFps"))
+            log["fps"] = float(fps) if fps is not None else None
+        refine = root.find("refine")
+        if refine is not None:
+            log["refine"] = {
+                "subsamples": int(refine.attrib["subsamples"]),
+                "exact": parse_ranges(refine.attrib.get("exact", "")),
+            }
+        for frame in root.iter("frame"):
+            metrics = {k: float(v) for k, v in frame.attrib.items() if k != "frameNum"}
+            log["frames"].append({"frameNum": int(frame.attrib["frameNum"]), "metrics": metrics})
+    elif fmt == "json":
+        with open(str(file), "r") as reader:
+            data = json.load(reader)
+        log["version"] = data.get("version", DEFAULT_VERSION)
+        log["fps"] = data.get("fps")
+        log["params"] = data.get("params", {})
+        if "refine" in data:
+            log["refine"] = data["refine"]
+        for frame in data.get("frames", []):
+            metrics = {k: float(v) for k, v in frame["metrics"].items()}
+            log["frames"].append({"frameNum": int(frame["frameNum"]), "metrics": metrics})
+    else:
+        with open(str(file), "r", newline="") as reader:
+            for row in csv.DictReader(reader):
+                metrics = {k: float(v) for k, v in row.items() if k and k != "Frame" and v not in [None, ""]}
+                log["frames"].append({"frameNum": int(row["Frame"]), "metrics": metrics})
+
+    return log
+
+
+def read_log_fps(file):
+    """Read the frames per second libvmaf reported in a VMAF log file, without reading its frames where possible.
+
+    Returns None for CSV logs, which do not hold it, and for logs that can not be read.
+    """
+    try:
+        fmt = get_log_format(file)
+        if fmt == "xml":
+            # The fyi element comes before the frames, so parsing stops there
+            for _, element in xml.iterparse(str(file)):
+                if element.tag == "fyi":
+                    fps = element.attrib.get("fps", element.attrib.get("execFps"))
+                    return float(fps) if fps is not None else None
+                if element.tag == "frame":
+                    return None
+        elif fmt == "json":
+            with open(str(file), "r") as reader:
+                data = json.load(reader)
+            # VMAF version 1 calls it "ExecFps"
+            fps = data.get("fps", data.get("ExecFps"))
+            return float(fps) if fps is not None else None
+    except (OSError, ValueError, xml.ParseError):
+        pass
+    return None
+
+
+def format_ranges(ranges):
+    """Format frame ranges like [(0, 10), (20, 25)] as "0-10,20-25"."""
+    return ",".join(["{}-{}".format(start, end) for start, end in ranges])
+
+
+def parse_ranges(text):
+    """Parse frame ranges formatted by format_ranges."""
+    ranges = []
+    for part in text.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            ranges.append((int(start), int(end)))
+    return ranges
+
+
+def get_frame_weights(log):
+    """Get how many frames of the video every frame of a log stands for.
+
+    Every frame stands for itself, except in logs made by adaptive subsampling, where every sampled
+    frame also stands for the frames after it up to the next sample, minus the frames that were
+    calculated exactly.
+    """
+    if "refine" not in log:
+        return [1] * len(log["frames"])
+
+    subsamples = log["refine"]["subsamples"]
+    exact = log["refine"]["exact"]
+    weights = []
+    for frame in log["frames"]:
+        frame_num = frame["frameNum"]
+        if any([start <= frame_num < end for start, end in exact]):
+            weights.append(1)
+            continue
+        covered = set(range(frame_num, frame_num + subsamples))
+        for start, end in exact:
+            covered -= set(range(start, end))
+        weights.append(len(covered))
+
+    return weights
+
+
+def pool_metrics(
+    frames,
+    weights=None,
+):
+    """Recompute the pooled min, max, mean and harmonic mean of every metric, the same way libvmaf does.
+
+    weights gives how many frames every frame stands for, which defaults to 1 for every frame.
+    """
+    if weights is None:
+        weights = [1] * len(frames)
+    values = {}
+    for frame, weight in zip(frames, weights):
+        for metric, value in frame["metrics"].items():
+            if metric not in values:
+                values[metric] = []
+            values[metric].append((value, weight))
+
+    pooled = {}
+    for metric, items in values.items():
+        total = sum([weight for _, weight in items])
+        pooled[metric] = {
+            "min": min([value for value, _ in items]),
+            "max": max([value for value, _ in items]),
+            "mean": sum([value * weight for value, weight in items]) / total,
+            "harmonic_mean": total / sum([weight / (value + 1.0) for value, weight in items]) - 1.0,
+        }
+
+    return pooled
+
+
+def write_log(
+    file,
+    log,
+    fmt=None,
+):
+    """Write a VMAF log in libvmaf's version 2 layout, recomputing its pooled metrics from its frames."""
+    if fmt is None:
+        fmt = get_log_format(file)
+    pooled = pool_metrics(log["frames"], get_frame_weights(log))
+
+    if fmt == "xml":
+        lines = ["<VMAF version={}>".format(quoteattr(str(log.get("version", DEFAULT_VERSION))))]
+        params = " ".join(["{}={}".format(k, quoteattr(str(v))) for k, v in log.get("params", {}).items()])
+        lines.append("  <params {}/>".format(params + " " if params else ""))
+        if log.get("fps") is not None:
+            lines.append('  <fyi fps="{:.2f}" />'.format(log["fps"]))
+        if "refine" in log:
+            lines.append(
+                '  <refine subsamples="{}" exact="{}" />'.format(
+                    log["refine"]["subsamples"], format_ranges(log["refine"]["exact"])
+                )
+            )
+        lines.append("  <frames>")
+        for frame in log["frames"]:
+            metrics = " ".join(['{}="{:.6f}"'.format(k, v) for k, v in frame["metrics"].items()])
+            lines.append('    <frame frameNum="{}" {} />'.format(frame["frameNum"], metrics))
+        lines.append("  </frames>")
+        lines.append("  <pooled_metrics>")
+        for metric, pools in pooled.items():
+            values = " ".join(['{}="{:.6f}"'.format(k, v) for k, v in pools.items()])
+            lines.append('    <metric name="{}" {} />'.format(metric, values))
+        lines.append("  </pooled_metrics>")
+        lines.append("  <aggregate_metrics />")
+        lines.append("</VMAF>")
+        with open(str(file), "w") as writer:
+            writer.write("\n".join(lines) + "\n")
+    elif fmt == "json":
+        data = {
+            "version": log.get("version", DEFAULT_VERSION),
+            "fps": log.get("fps"),
+            "frames": log["frames"],
+            "pooled_metrics": pooled,
+            "aggregate_metrics": {},
+        }
+        if "refine" in log:
+            data["refine"] = log["refine"]
+        with open(str(file), "w") as writer:
+            json.dump(data, writer, indent=2)
+    else:
+        metrics = list(log["frames"][0]["metrics"].keys()) if len(log["frames"]) > 0 else []
+        with open(str(file), "w", newline="") as writer:
+            writer.write(",".join(["Frame"] + metrics) + ",\n")
+            for frame in log["frames"]:
+                row = [str(frame["frameNum"])] + ["{:.6f}".format(frame["metrics"][m]) for m in metrics]
+                writer.write(",".join(row) + ",\n")
+
+    return pooled
+
+
+def stitch_logs(segments):
+    """Stitch the logs of consecutive parts of a video into a single log.
+
+    segments is a list of (log, first_frame, start, end) tuples, where the log's first frame is the
+    video's frame number first_frame, and only the video's frames in the range [start, end) are kept.
+    """
+    stitched = None
+    for log, first_frame, start, end in sorted(segments, key=lambda segment: segment[2]):
+        if stitched is None:
+            stitched = {k: v for k, v in log.items() if k != "frames"}
+            stitched["frames"] = []
+            stitched["fps"] = None
+        for frame in log["frames"]:
+            frame_num = frame["frameNum"] + first_frame
+            if start <= frame_num < end:
+                stitched["frames"].append({"frameNum": frame_num, "metrics": frame["metrics"]})
+
+    return stitched
+
+
+def merge_refined(
+    coarse,
+    parts,
+    subsamples,
+):
+    """Merge the logs of time ranges calculated at full density into the log of a subsampled calculation.
+
+    parts is a list of (log, first_frame, start, end) tuples in the same layout as for stitch_logs.
+    The merged log keeps the sampled frames outside of the refined ranges, and records the subsample
+    interval and the ranges of exact frames in its "refine" key so that it can be pooled correctly.
+    """
+    exact = sorted([(start, end) for _, _, start, end in parts])
+    merged = {k: v for k, v in coarse.items() if k != "frames"}
+    merged["frames"] = [
+        frame for frame in coarse["frames"] if not any([start <= frame["frameNum"] < end for start, end in exact])
+    ]
+    if len(parts) > 0:
+        merged["frames"] += stitch_logs(parts)["frames"]
+    merged["frames"].sort(key=lambda frame: frame["frameNum"])
+    merged["refine"] = {
+        "subsamples": subsamples,
+        "exact": exact,
+    }
+
+    return merged
@@ -0,0 +1,107 @@
+from vmaf_probe_handler import estimate_frame_bytes
+from vmaf_profile_handler import get_resolution_class
+
+# Memory of an FFmpeg process before it decodes anything, including the
+# libvmaf models it loads
+BASE_BYTES = 96 * 1024 * 1024
+
+# Estimated number of decoded frames held in memory for every input, between
+# the decoder's reference frames and the queues of the filter graph
+INPUT_FRAME_BUFFERS = 8
+
+# Bytes every libvmaf instance keeps for every pixel of a frame, for the float
+# buffers of its feature extractors
+VMAF_BYTES_PER_PIXEL = 32
+
+# Bytes every libvmaf thread keeps for every pixel of a frame, for the pictures
+# it holds while extracting features
+VMAF_THREAD_BYTES_PER_PIXEL = 8
+
+# Weight of the newest measurement when lowering the correction of a resolution
+# class, while higher measurements are taken over right away
+SMOOTHING = 0.3
+
+
+def read_available_memory():
+    """Read the memory available for starting new processes from /proc/meminfo, or None where there is no /proc."""
+    try:
+        with open("/proc/meminfo", "r") as reader:
+            for line in reader:
+                # Lines look like "MemAvailable:   12345678 kB"
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class VMAF_Memory_Handler:
+    """Estimates the peak memory of VMAF calculation jobs from their inputs, models and threads.
+
+    The estimate of every resolution class is corrected by the peak memory finished jobs actually
+    used, so that the jobs started later in a run get closer estimates. Corrections go up right away
+    and come down slowly, since underestimating is what gets processes killed.
+    """
+
+    def __init__(
+        self,
+        budget=0,
+    ):
+        # Bytes every running job has to fit into together
+        self._budget = budget if budget > 0 else read_available_memory()
+        self._corrections = {}
+
+    def get_budget(self):
+        """Get the memory budget in bytes, or None if it could not be read from the system."""
+        return self._budget
+
+    def get_correction(
+        self,
+        pixels,
+    ):
+        return self._corrections.get(get_resolution_class(pixels, 1), 1.0)
+
+    def estimate_raw(
+        self,
+        job,
+        infos,
+        reference,
+        threads,
+    ):
+        """Estimate the peak memory of a job in bytes from its inputs, models and threads, without any correction."""
+        files = list(dict.fromkeys([dist for dist, _ in job["pairs"]])) + [reference]
+        # Inputs that were not probed are assumed to be as large as the reference
+        default = infos.get(reference, {"width": 1920, "height": 1080, "pix_fmt": "yuv420p"})
+        frame_bytes = [estimate_frame_bytes(infos.get(file, default)) for file in files]
+        pixels = max([infos.get(file, default)["width"] * infos.get(file, default)["height"] for file in files])
+
+        instance_bytes = pixels * (VMAF_BYTES_PER_PIXEL + VMAF_THREAD_BYTES_PER_PIXEL * max(1, threads))
+        return BASE_BYTES + sum(frame_bytes) * INPUT_FRAME_BUFFERS + len(job["pairs"]) * instance_bytes
+
+    def estimate(
+        self,
+        job,
+        infos,
+        reference,
+        threads,
+    ):
+        """Estimate the peak memory of a job in bytes, corrected by the jobs of its resolution class that finished."""
+        raw = self.estimate_raw(job, infos, reference, threads)
+        return int(raw * self.get_correction(job.get("size", (0, 0))[1]))
+
+    def record(
+        self,
+        job,
+        raw,
+        max_rss,
+    ):
+        """Update the correction of a finished job's resolution class from its raw estimate and peak memory."""
+        if not max_rss or raw <= 0:
+            return
+
+        key = get_resolution_class(job.get("size", (0, 0))[1], 1)
+        ratio = max_rss / raw
+        correction = self._corrections.get(key, 1.0)
+        if key in self._corrections and ratio < correction:
+            ratio = (1 - SMOOTHING) * correction + SMOOTHING * ratio
+        self._corrections[key] = ratio
@@ -0,0 +1,159 @@
+import concurrent.futures as cf
+import csv
+import multiprocessing as mp
+import subprocess as sp
+from pathlib import Path
+
+import ffmpy
+
+from vmaf_job_handler import get_packet_location
+from vmaf_probe_handler import PROBE_WORKERS
+
+# Columns of a packet log, one row for every packet of the video stream in
+# presentation order
+PACKET_COLUMNS = ["frame", "time", "duration", "size", "key"]
+
+
+def read_packets(
+    file,
+    ffprobe="ffprobe",
+):
+    """Read the timestamp, duration, size and key frame flag of every packet of the first video stream of a file.
+
+    ffprobe only demuxes the file without decoding it, so this costs about as much as reading the file once.
+    The packets are returned in presentation order, which matches the order of the frames in a VMAF log.
+    """
+    ff = ffmpy.FFprobe(
+        executable=ffprobe,
+        global_options=[
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,duration_time,size,flags",
+            "-print_format",
+            "csv=print_section=0",
+        ],
+        inputs={str(file): None},
+    )
+    out, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+
+    packets = []
+    for line in out.decode("utf-8").splitlines():
+        # ffprobe prints the entries in the order of its packet section, which
+        # is pts_time, duration_time, size and flags
+        fields = line.strip().split(",")
+        if len(fields) < 4:
+            continue
+        try:
+            packet = {
+                "time": float(fields[0]),
+                "duration": float(fields[1]) if fields[1] not in ["", "N/A"] else 0.0,
+                "size": int(fields[2]),
+                "key": "K" in fields[3],
+            }
+        except ValueError:
+            # Packets without a timestamp are never shown
+            continue
+        packets.append(packet)
+    packets.sort(key=lambda packet: packet["time"])
+
+    return packets
+
+
+def write_packets(
+    packets,
+    packet_log,
+):
+    """Write the packets of read_packets to a packet log CSV file."""
+    packet_log = Path(packet_log)
+    # Write to a temporary file first so an interrupted write never leaves a
+    # partial packet log behind
+    tmp_file = packet_log.with_suffix(".tmp")
+    with open(tmp_file, "w", newline="") as writer:
+        csv_writer = csv.writer(writer)
+        csv_writer.writerow(PACKET_COLUMNS)
+        for i, packet in enumerate(packets):
+            csv_writer.writerow(
+                [
+                    i,
+                    "{:.6f}".format(packet["time"]),
+                    "{:.6f}".format(packet["duration"]),
+                    packet["size"],
+                    int(packet["key"]),
+                ]
+            )
+    tmp_file.replace(packet_log)
+
+
+def read_packet_log(packet_log):
+    """Read the packets of a packet log CSV file written by write_packets."""
+    packets = []
+    with open(packet_log, "r", newline="") as reader:
+        for row in csv.DictReader(reader):
+            packets.append(
+                {
+                    "time": float(row["time"]),
+                    "duration": float(row["duration"]),
+                    "size": int(row["size"]),
+                    "key": row["key"] == "1",
+                }
+            )
+
+    return packets
+
+
+class VMAF_Packet_Handler:
+    """Writes the packet log of every distorted video file next to its VMAF logs.
+
+    The demux-only ffprobe passes run in the background while libvmaf runs, by a bounded number of
+    ffprobe processes at once. A distorted video file is only moved into its results folder once its
+    packet log was written, see wait.
+    """
+
+    def __init__(
+        self,
+        ffprobe="ffprobe",
+        workers=PROBE_WORKERS,
+    ):
+        self._ffprobe = ffprobe
+        # ffprobe does the work in its own processes, so threads are enough
+        # for running several of them at once
+        self._pool = cf.ThreadPoolExecutor(max_workers=max(1, min(workers, mp.cpu_count())))
+        self._tasks = {}
+
+    def _write(
+        self,
+        dist,
+        packet_log,
+    ):
+        try:
+            packet_log.parent.mkdir(exist_ok=True)
+            write_packets(read_packets(dist, self._ffprobe), packet_log)
+        except (OSError, ValueError, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+            print("Could not read the packets of {}: {}".format(dist, e))
+
+    def submit(
+        self,
+        dist,
+    ):
+        """Start writing the packet log of a distorted video file, unless it exists from an earlier run."""
+        packet_log = get_packet_location(dist)
+        if dist in self._tasks or packet_log.exists():
+            return
+        self._tasks[dist] = self._pool.submit(self._write, dist, packet_log)
+
+    def wait(
+        self,
+        dist,
+    ):
+        """Wait for the packet log of a distorted video file, which is written right away if it was never started."""
+        self.submit(dist)
+        if dist in self._tasks:
+            self._tasks.pop(dist).result()
+
+    def shutdown(self):
+        """Drop the packet logs that have not started yet, waiting for the running ones."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._tasks = {}
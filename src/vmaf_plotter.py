@@ -3,6 +3,7 @@
 import argparse as argp
 import concurrent.futures as cf
 import multiprocessing as mp
+import sys
 import time
 import warnings
 from collections import OrderedDict
@@ -10,37 +11,42 @@ from multiprocessing import Manager, cpu_count
 from pathlib import Path
 from traceback import print_exc
 
-import matplotlib as mpl
-
-mpl.use("agg", force=True)
-import numpy as np
-import pandas as pd
-from gooey import Gooey, GooeyParser
-from matplotlib import pyplot as plt
-from tqdm import tqdm
-
+from vmaf_cli_handler import VMAF_Headless_Parser, is_headless, strip_headless
 from vmaf_common import VMAF_Timer, search_handler
+from vmaf_packet_handler import read_packet_log
+from vmaf_probe_handler import PROBE_CACHE_FILE, VMAF_Probe_Handler
 
 # from vmaf_config_handler import VMAF_Config_Handler
 from vmaf_report_handler import VMAF_Report_Handler
+from vmaf_settings_handler import SETTINGS_FILE, load_settings
+
+
+def get_pyplot():
+    """Import matplotlib's pyplot with the non-interactive Agg backend.
 
+    pandas, numpy and matplotlib are only imported by the stages that use them, so that parsing the
+    arguments does not have to wait for them.
+    """
+    import matplotlib as mpl
 
-@Gooey(
-    program_name="VMAF Plotter",
-    default_size=(1280, 720),
-    advanced=True,
-    use_cmd_args=True,
-    navigation="SIDEBAR",
-    show_sidebar=True,
-)
-def parse_arguments():
+    mpl.use("agg", force=True)
+    from matplotlib import pyplot as plt
+
+    return plt
+
+
+def build_parser(parser_class):
+    """Build the parser of the user given arguments for plotting VMAF, either a GooeyParser or a VMAF_Headless_Parser."""
+    # Defaults come from the [vmaf.plotter.*] sections of the project's
+    # pyproject.toml
+    settings = load_settings()["plotter"]
     main_help = "Plot VMAF to graph, save it as both a static image and as a transparent animated video file.\n"
     main_help += "All of the following arguments have default values within the config file.\n"
     # main_help += "Arguments will override the values for the variables set in the config file when specified.\n"
     # main_help += (
     #     "Settings that are not specified in the config file will use default values as deemed by the program.\n"
     # )
-    parser = GooeyParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+    parser = parser_class(description=main_help, formatter_class=argp.RawTextHelpFormatter)
     subparsers = parser.add_subparsers()
 
     main_parser = subparsers.add_parser("Main", help="Main arguments")
@@ -57,7 +63,7 @@ def parse_arguments():
 
     config_help = "TOML Configuration file.\n"
     config_args.add_argument(
-        "-c", "--config", dest="config", default="pyproject.toml", help=config_help, widget="FileChooser"
+        "-c", "--config", dest="config", default=str(SETTINGS_FILE), help=config_help, widget="FileChooser"
     )
 
     vmaf_help = "VMAF report directory.\n"
@@ -120,7 +126,20 @@ def parse_arguments():
     )
 
     fps_help = "Specify the FPS for the video file (Default is 60).\n"
-    data_args.add_argument("-f", "--fps", dest="fps", default=60.0, type=float, help=fps_help)
+    data_args.add_argument("-f", "--fps", dest="fps", default=settings["video"]["framerate"], type=float, help=fps_help)
+
+    bitrate_window_help = (
+        "Specify the seconds of video the bitrate is averaged over in the bitrate graph (Default is 1).\n"
+    )
+    bitrate_window_help += 'Only used for reports whose distorted video files had their packets read by the VMAF Calculator with "--packets".'
+    data_args.add_argument(
+        "--bitrate-window",
+        "--bitrate_window",
+        dest="bitrate_window",
+        default=1.0,
+        type=float,
+        help=bitrate_window_help,
+    )
 
     threads_help = "Specify number of CPU threads to use for calculating the different VMAF statistics.\n"
     threads_help += ""
@@ -129,7 +148,7 @@ def parse_arguments():
         "--threads",
         dest="threads",
         type=int,
-        default=mp.cpu_count(),
+        default=settings["graphing"]["threads"] or mp.cpu_count(),
         help=threads_help,
         widget="Slider",
         gooey_options={"min": 1, "max": mp.cpu_count()},
@@ -137,7 +156,17 @@ def parse_arguments():
 
     misc_args.add_argument("-v", "--version", action="version", version="2021-12-06")
 
-    args = parser.parse_args()
+    return parser
+
+
+def check_arguments(
+    parser,
+    args,
+):
+    """Check the parsed arguments for plotting VMAF, collecting every VMAF report to plot."""
+    # A single VMAF report directory is given as a plain string
+    if isinstance(args.VMAF, str):
+        args.VMAF = [args.VMAF]
     if args.VMAF is None or len(args.VMAF) == 0:
         parser.exit(status=1, message="No VMAF files or directories were provided.")
 
@@ -154,6 +183,9 @@ def parse_arguments():
     if args.fps <= 0.0:
         parser.exit(status=1, message="Can't use FPS value less than or equal to 0.")
 
+    if args.bitrate_window <= 0.0:
+        parser.exit(status=1, message="Can't use a bitrate window less than or equal to 0 seconds.")
+
     output_files = {}
     if not args.output:
         for v in args.VMAF:
@@ -203,6 +235,39 @@ def parse_arguments():
     return args, original_location
 
 
+def parse_arguments(argv=None):
+    """Parse user given arguments for plotting VMAF.
+
+    The arguments are taken from Gooey's window, unless running headless or without Gooey installed,
+    in which case Gooey and wxPython are never imported at all.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not is_headless(argv):
+        try:
+            from gooey import Gooey, GooeyParser
+        except ImportError:
+            print("Could not import Gooey, running headless instead.")
+        else:
+
+            @Gooey(
+                program_name="VMAF Plotter",
+                default_size=(1280, 720),
+                advanced=True,
+                use_cmd_args=True,
+                navigation="SIDEBAR",
+                show_sidebar=True,
+            )
+            def parse_window():
+                parser = build_parser(GooeyParser)
+                return check_arguments(parser, parser.parse_args())
+
+            return parse_window()
+
+    parser = build_parser(VMAF_Headless_Parser)
+    return check_arguments(parser, parser.parse_args(strip_headless(argv)))
+
+
 def check_report(
     report,
     config,
@@ -229,12 +294,16 @@ def quantile_abs_dev(
     array,
     quantile,
 ):
+    import pandas as pd
+
     quantile = array.quantile(quantile)
     x = pd.DataFrame(array - quantile).abs()
     return round(float(x.mean()), 3)
 
 
 def create_datapoint(data):
+    import pandas as pd
+
     point = {}
     point["list"] = data
     point["dataset"] = pd.Series(data)
@@ -315,11 +384,81 @@ def create_datapoint(data):
     return point
 
 
+def find_video(
+    report,
+    output,
+):
+    """Find the distorted video file of a VMAF report, which the VMAF Calculator moves next to its logs."""
+    name, _ = get_name_model(Path(report).stem)
+    for location in dict.fromkeys([Path(report).parent, Path(output)]):
+        for ext in [".mkv", ".mp4"]:
+            if location.joinpath(name + ext).is_file():
+                return location.joinpath(name + ext)
+    return None
+
+
+def find_packet_log(
+    report,
+    output,
+):
+    """Find the packet log the VMAF Calculator writes next to the logs of a distorted video file with "--packets"."""
+    name, _ = get_name_model(Path(report).stem)
+    for location in dict.fromkeys([Path(report).parent, Path(output)]):
+        if location.joinpath("{}_packets.csv".format(name)).is_file():
+            return location.joinpath("{}_packets.csv".format(name))
+    return None
+
+
+def create_packet_stats(
+    packets,
+    scores,
+    window,
+):
+    """Get the bitrate, bits per frame and VMAF per megabit of a distorted video file from its packets.
+
+    The bits of every frame, the bitrate and VMAF per megabit averaged over the given seconds of video,
+    and the key frames are also listed per frame, which only happens when there is a packet for every
+    frame of the VMAF scores.
+    """
+    import pandas as pd
+
+    bits = pd.Series([packet["size"] * 8 for packet in packets], dtype="float64")
+    durations = pd.Series([packet["duration"] for packet in packets], dtype="float64")
+    # Packets without a duration last as long as the average packet
+    if durations.sum() > 0:
+        durations = durations.where(durations > 0, durations[durations > 0].mean())
+    duration = durations.sum()
+
+    stats = {}
+    stats["Bitrate"] = bits.sum() / duration / 1000 if duration > 0 else None
+    stats["Bits Per Frame"] = bits.mean()
+    stats["Key Frames"] = len([packet for packet in packets if packet["key"]])
+    stats["VMAF Per Mbps"] = pd.Series(scores).mean() / (stats["Bitrate"] / 1000) if stats["Bitrate"] else None
+
+    # A frame more or less is left over from how the last frame was counted
+    if duration > 0 and abs(len(packets) - len(scores)) <= 1:
+        count = min(len(packets), len(scores))
+        # Only whole windows are averaged, since the first frames of a video
+        # would otherwise show the key frame's size as the bitrate
+        frames = max(1, min(count, int(round(len(packets) / duration * window))))
+        bits = bits[:count]
+        bitrate = bits.rolling(frames).sum() / durations[:count].rolling(frames).sum()
+        quality = pd.Series(scores[:count], dtype="float64").rolling(frames).mean()
+        stats["bits"] = bits.tolist()
+        stats["bitrate"] = (bitrate / 1000).tolist()
+        stats["quality"] = (quality / (bitrate / 1000000)).tolist()
+        stats["keys"] = [i for i, packet in enumerate(packets[:count]) if packet["key"]]
+
+    return stats
+
+
 def get_stats(
     data,
     output,
     datapoints,
     report,
+    info=None,
+    window=1.0,
 ):
     main = {}
 
@@ -333,9 +472,19 @@ def get_stats(
 
     main["File Path"] = Path(output)
     main["File Name"] = Path(report).stem
-    name, model = get_name_model(main["File Name"])
-    # main["File Size"] = bytes2human(main["File Path"].joinpath(name + ".mp4").stat().st_size)
-    main["File Size"] = main["File Path"].joinpath(name + ".mp4").stat().st_size
+    # The size of the distorted video file comes from the probe cache, or from
+    # the video file itself when it was never probed
+    if info is not None:
+        main["File Size"] = info["size"]
+    else:
+        video = find_video(report, output)
+        main["File Size"] = video.stat().st_size if video is not None else None
+
+    # Bitrate statistics for distorted video files whose packets were read by
+    # the VMAF Calculator
+    packet_log = find_packet_log(report, output)
+    if packet_log is not None:
+        main["Packets"] = create_packet_stats(read_packet_log(packet_log), data["VMAF"], window)
 
     return main
 
@@ -354,6 +503,9 @@ def write_stats(
         for point in datapoints:
             for metric in metrics.keys():
                 stat.write("{} {} Score: {}\n".format(metric, point.upper(), main[point][metric]))
+        if "Packets" in main:
+            for metric in ["Bitrate", "Bits Per Frame", "Key Frames", "VMAF Per Mbps"]:
+                stat.write("{}: {}\n".format(metric, main["Packets"][metric]))
     # print("Done!")
 
 
@@ -363,6 +515,9 @@ def create_plot(
     metrics,
     font_size,
 ):
+    import numpy as np
+
+    plt = get_pyplot()
     fig, ax = plt.subplots()
 
     # [
@@ -441,6 +596,51 @@ def create_image(
     # print("Done!")
 
 
+def create_bitrate_image(
+    main,
+    res,
+    window,
+    font_size,
+):
+    """Save the bits per frame, the windowed bitrate against VMAF and the windowed VMAF per megabit as one image."""
+    plt = get_pyplot()
+    packets = main["Packets"]
+    fig, (ax_bits, ax_bitrate, ax_quality) = plt.subplots(3, 1, sharex=True)
+    fig.dpi = 100
+
+    ax_bits.plot([bits / 1000 for bits in packets["bits"]], linewidth=0.7, antialiased=True, rasterized=True)
+    ax_bits.scatter(
+        packets["keys"],
+        [packets["bits"][i] / 1000 for i in packets["keys"]],
+        color="red",
+        marker="x",
+        label="Key Frames: {}".format(len(packets["keys"])),
+    )
+    ax_bits.set_ylabel("kbit / frame", fontsize=font_size)
+    ax_bits.legend(loc="upper right", fancybox=True, shadow=False)
+
+    ax_bitrate.plot(packets["bitrate"], linewidth=0.7, antialiased=True, rasterized=True)
+    ax_bitrate.set_ylabel("kb/s ({}s)".format(window), fontsize=font_size)
+    ax_vmaf = ax_bitrate.twinx()
+    ax_vmaf.plot(main["VMAF"]["list"][: len(packets["bitrate"])], color="orange", linewidth=0.7, rasterized=True)
+    ax_vmaf.set_ylabel("VMAF", fontsize=font_size)
+    ax_vmaf.set_ylim(0, 100)
+
+    ax_quality.plot(packets["quality"], linewidth=0.7, antialiased=True, rasterized=True)
+    ax_quality.set_ylabel("VMAF / Mbps", fontsize=font_size)
+    ax_quality.set_xlabel(
+        "Frames: {} | Bitrate: {:.0f} kb/s | VMAF Per Mbps: {:.2f}".format(
+            len(packets["bits"]), packets["Bitrate"], packets["VMAF Per Mbps"]
+        ),
+        fontsize=font_size,
+    )
+    plt.margins(0)
+
+    image_file = str(main["File Path"].joinpath("{0}_bitrate_{1}.png".format(main["File Name"], res)))
+    fig.savefig(image_file, dpi=100, transparent=True)
+    plt.close(fig)
+
+
 def create_video(
     main,
     point,
@@ -449,6 +649,8 @@ def create_video(
     fig,
     ax,
 ):
+    from matplotlib import animation
+
     ax.set_ylim(0, main[point]["Maximum"])
     ax.set_xlim(
         main["index"][0] - main["index"][60],
@@ -472,7 +674,7 @@ def create_video(
     length = len(main["index"])
 
     (line,) = ax.plot(main["index"], main[point]["dataset"])
-    anim = mpl.animation.FuncAnimation(
+    anim = animation.FuncAnimation(
         fig,
         animate,
         init_func=init,
@@ -535,6 +737,7 @@ def handle_plotting(
     pos,
     sema,
 ):
+    plt = get_pyplot()
     plots = {}
     images = []
     videos = []
@@ -584,6 +787,11 @@ def handle_plotting(
                     )
                 )
 
+        # Only reports with a packet for every frame have the per frame
+        # bitrate lists, see create_packet_stats
+        if "image" in args.output_types and "VMAF" in data and "bits" in data.get("Packets", {}):
+            images.append(pool_image.submit(create_bitrate_image, data, args.res, args.bitrate_window, font_size))
+
         if "image" in args.output_types:
             cf.wait(images)
 
@@ -595,6 +803,10 @@ def handle_plotting(
 
 
 def main(args, original_location):
+    import pandas as pd
+    from tqdm import tqdm
+
+    plt = get_pyplot()
     timer = VMAF_Timer()
     # 0 means that higher values rank better, and 1 means lower values rank better
     metrics = {
@@ -787,6 +999,14 @@ def main(args, original_location):
             )
             font_size = 25
 
+    # Look up every distorted video file in the probe cache the VMAF
+    # Calculator filled, without probing the ones it has not seen
+    probes = VMAF_Probe_Handler(Path(__file__).parent.joinpath(PROBE_CACHE_FILE))
+    infos = {}
+    for key in data.keys():
+        video = find_video(key, args.output[key])
+        infos[key] = probes.get(video) if video is not None else None
+
     ret_get_stats = {}
     ret_write_stats = {}
     ret_plots = {}
@@ -825,7 +1045,13 @@ def main(args, original_location):
             for key, value in data.items():
                 ret_get_stats[
                     pool_main.submit(
-                        get_stats, data=value, output=args.output[key], datapoints=args.datapoints, report=key
+                        get_stats,
+                        data=value,
+                        output=args.output[key],
+                        datapoints=args.datapoints,
+                        report=key,
+                        info=infos[key],
+                        window=args.bitrate_window,
                     )
                 ] = key
 
@@ -904,6 +1130,11 @@ def main(args, original_location):
                     dict_scores[model][name]["{} {}".format(point, metric)] = value
                     dict_scores_dist[name]["{} {} {}".format(model, point, metric)] = value
             dict_scores_dist[name]["File Size"] = main[rep]["File Size"]
+            # Bitrate and VMAF per megabit, for the distorted video files
+            # whose packets were read
+            if "Packets" in main[rep]:
+                dict_scores_dist[name]["Bitrate"] = main[rep]["Packets"]["Bitrate"]
+                dict_scores[model][name]["VMAF Per Mbps"] = main[rep]["Packets"]["VMAF Per Mbps"]
 
         dist_tmp = OrderedDict()
         for k in sorted(dict_scores_dist.keys()):
@@ -0,0 +1,312 @@
+import concurrent.futures as cf
+import json
+import multiprocessing as mp
+import subprocess as sp
+from pathlib import Path
+
+import ffmpy
+
+# Number of bytes used for a single pixel in every plane, relative to the luma
+# plane, for the chroma subsamplings FFmpeg reports in its pixel format names
+CHROMA_FACTORS = {
+    "420": 1.5,
+    "422": 2.0,
+    "444": 3.0,
+}
+
+# Scene change score between two frames above which a frame starts a new scene
+SCENE_THRESHOLD = 0.3
+
+# Width the reference video is scaled down to for detecting scene cuts
+SCENE_WIDTH = 160
+
+# Cache of the probed info of every video file, kept next to the programs
+PROBE_CACHE_FILE = "vmaf_probes.json"
+
+# Most ffprobe processes running at once while filling the probe cache
+PROBE_WORKERS = 8
+
+
+def get_ffprobe(ffmpeg="ffmpeg"):
+    """Return the ffprobe executable that sits next to the given FFmpeg executable."""
+    ffmpeg_path = Path(ffmpeg)
+    name = ffmpeg_path.name.replace("ffmpeg", "ffprobe")
+    # Keep relying on the "Path" environment variable if no directory was given
+    if str(ffmpeg_path.parent) == ".":
+        return name
+    return str(ffmpeg_path.with_name(name))
+
+
+def parse_rate(rate):
+    """Convert an FFmpeg rational such as "60000/1001" into a float."""
+    try:
+        num, den = str(rate).split("/")
+        return float(num) / float(den) if float(den) != 0 else 0.0
+    except ValueError:
+        return float(rate)
+
+
+def probe_video(
+    file,
+    ffprobe="ffprobe",
+):
+    """Probe the first video stream of a file for the info needed to plan VMAF calculations."""
+    ff = ffmpy.FFprobe(
+        executable=ffprobe,
+        global_options=[
+            "-v",
+            "error",
+            "-print_format",
+            "json",
+            "-show_format",
+            "-show_streams",
+            "-select_streams",
+            "v:0",
+        ],
+        inputs={str(file): None},
+    )
+    out, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    data = json.loads(out.decode("utf-8"))
+    if len(data.get("streams", [])) == 0:
+        raise OSError("ERROR: Could not find a video stream in file {}".format(file))
+
+    stream = data["streams"][0]
+    info = {
+        "codec": stream.get("codec_name"),
+        "width": int(stream.get("width", 0)),
+        "height": int(stream.get("height", 0)),
+        "pix_fmt": stream.get("pix_fmt"),
+        "fps": parse_rate(stream.get("avg_frame_rate", "0/1")),
+        "duration": float(stream.get("duration", data.get("format", {}).get("duration", 0.0))),
+        "size": int(data.get("format", {}).get("size", Path(file).stat().st_size)),
+    }
+
+    # MKV files don't store the frame count, so estimate it from the duration
+    info["exact_frames"] = "nb_frames" in stream
+    if info["exact_frames"]:
+        info["frames"] = int(stream["nb_frames"])
+    else:
+        info["frames"] = int(round(info["duration"] * info["fps"]))
+
+    return info
+
+
+def estimate_frame_bytes(info):
+    """Estimate the size of a single decoded frame of a probed video stream."""
+    pix_fmt = info.get("pix_fmt") or "yuv420p"
+    factor = 1.5
+    for subsampling, chroma_factor in CHROMA_FACTORS.items():
+        if subsampling in pix_fmt:
+            factor = chroma_factor
+    # Anything above 8 bits per sample is stored in 16 bits
+    sample_bytes = 2 if any(depth in pix_fmt for depth in ["p10", "p12", "p16"]) else 1
+
+    return int(info["width"] * info["height"] * factor * sample_bytes)
+
+
+def find_frame_mismatches(
+    infos,
+    reference,
+    dists,
+):
+    """Get the frame counts of the distorted video files whose frame count differs from the reference video file's.
+
+    libvmaf compares the frames of both inputs in order, so a distorted video file with dropped or added
+    frames gets compared against the wrong reference frames. Frame counts estimated from the duration
+    may be a frame off, which is not counted as a mismatch. Video files that were not probed are left out.
+    """
+    ref_info = infos.get(reference)
+    if ref_info is None or ref_info["frames"] <= 0:
+        return {}
+
+    mismatches = {}
+    for dist in dists:
+        info = infos.get(dist)
+        if info is None or info["frames"] <= 0:
+            continue
+        tolerance = 0 if ref_info.get("exact_frames") and info.get("exact_frames") else 1
+        if abs(info["frames"] - ref_info["frames"]) > tolerance:
+            mismatches[dist] = info["frames"]
+
+    return mismatches
+
+
+class VMAF_Probe_Handler:
+    """Persistent cache of the probed info of video files, keyed by their path, size and modification time.
+
+    Files that are missing from the cache or changed since they were probed are probed again, by a
+    bounded number of ffprobe processes at once. The cache file is merged with the entries other
+    programs saved in the meantime, so the calculator, encoder and workers can all share it.
+    """
+
+    def __init__(
+        self,
+        cache_file,
+        ffprobe="ffprobe",
+        workers=PROBE_WORKERS,
+    ):
+        self._cache_file = Path(cache_file)
+        self._ffprobe = ffprobe
+        self._workers = max(1, min(workers, mp.cpu_count()))
+        self._entries = self._read()
+        # Entries probed by this program, which are the only ones it saves
+        self._probed = {}
+
+    def get_cache_file(self):
+        return self._cache_file
+
+    def _read(self):
+        if not self._cache_file.exists():
+            return {}
+        try:
+            with open(self._cache_file, "r") as reader:
+                return json.load(reader)
+        except (OSError, ValueError) as e:
+            print("Could not read the probe cache file {}: {}".format(self._cache_file, e))
+            return {}
+
+    def _get_key(
+        self,
+        file,
+    ):
+        """Get the cache key of a file along with its size and modification time."""
+        path = Path(file).resolve()
+        stat = path.stat()
+        return str(path), stat.st_size, stat.st_mtime_ns
+
+    def get(
+        self,
+        file,
+    ):
+        """Get the cached info of a file, or None if it was never probed or changed since then."""
+        try:
+            key, size, mtime = self._get_key(file)
+        except OSError:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry["size"] != size or entry["mtime"] != mtime:
+            return None
+
+        return entry["info"]
+
+    def _probe(
+        self,
+        file,
+    ):
+        key, size, mtime = self._get_key(file)
+        info = probe_video(file, self._ffprobe)
+        return key, {"size": size, "mtime": mtime, "info": info}
+
+    def probe_files(
+        self,
+        files,
+    ):
+        """Get the info of every given file, probing the files missing from the cache in parallel.
+
+        Files that could not be probed are left out.
+        """
+        infos = {}
+        missing = []
+        for file in dict.fromkeys(files):
+            info = self.get(file)
+            if info is not None:
+                infos[file] = info
+            else:
+                missing.append(file)
+        if len(missing) == 0:
+            return infos
+
+        # ffprobe does the work in its own processes, so threads are enough
+        # for running several of them at once
+        with cf.ThreadPoolExecutor(max_workers=self._workers) as pool:
+            tasks = {pool.submit(self._probe, file): file for file in missing}
+            for task in cf.as_completed(tasks):
+                file = tasks[task]
+                try:
+                    key, entry = task.result()
+                except (OSError, ValueError, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+                    print("Could not probe {}: {}".format(file, e))
+                    continue
+                self._entries[key] = entry
+                self._probed[key] = entry
+                infos[file] = entry["info"]
+        # Keep the order the files were given in
+        return {file: infos[file] for file in files if file in infos}
+
+    def move(
+        self,
+        file,
+        new_file,
+    ):
+        """Move the cached info of a file to where it was moved to, which keeps its size and modification time.
+
+        Without this the entry of a distorted video file is dropped once it is moved into its results folder,
+        so the plotter would have to probe it again.
+        """
+        key = str(Path(file).resolve())
+        entry = self._entries.pop(key, None)
+        self._probed.pop(key, None)
+        if entry is None:
+            return
+        new_key = str(Path(new_file).resolve())
+        self._entries[new_key] = entry
+        self._probed[new_key] = entry
+
+    def save(self):
+        if len(self._probed) == 0:
+            return
+        # Entries of files that were deleted are dropped, so that the cache
+        # does not keep growing with every encode that was thrown away
+        entries = self._read()
+        entries.update(self._probed)
+        entries = {key: entry for key, entry in entries.items() if Path(key).exists()}
+        try:
+            # Write to a temporary file first so an interrupted write never
+            # leaves a broken cache behind
+            tmp_file = self._cache_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as writer:
+                json.dump(entries, writer, indent=4, sort_keys=True)
+            tmp_file.replace(self._cache_file)
+        except OSError as e:
+            print("Could not write the probe cache file {}: {}".format(self._cache_file, e))
+        self._probed = {}
+
+
+def detect_scenes(
+    file,
+    fps,
+    ffmpeg="ffmpeg",
+    threshold=SCENE_THRESHOLD,
+    width=SCENE_WIDTH,
+):
+    """Detect the scene cuts of a video file with a single pass over a scaled down copy of it.
+
+    Returns the frame numbers every new scene starts at, or an empty list if the scenes could not be
+    detected, in which case the whole video counts as a single scene.
+    """
+    ff = ffmpy.FFmpeg(
+        executable=ffmpeg,
+        global_options=["-hide_banner", "-nostdin"],
+        inputs={str(file): None},
+        outputs={
+            "-": ["-vf", "scale={}:-2,select=gt(scene\\,{}),showinfo".format(width, threshold), "-an", "-f", "null"]
+        },
+    )
+    try:
+        _, err = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    except (OSError, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+        print("Could not detect the scenes of {}: {}".format(file, e))
+        return []
+
+    # Lines of showinfo look like "[Parsed_showinfo_2 @ 0x...] n:   0 pts: 3003 pts_time:1.001 ..."
+    cuts = []
+    for line in err.decode("utf-8", errors="replace").splitlines():
+        if "Parsed_showinfo" not in line or "pts_time:" not in line:
+            continue
+        try:
+            pts_time = float(line.split("pts_time:")[1].split()[0])
+        except (IndexError, ValueError):
+            continue
+        cuts.append(int(round(pts_time * fps)))
+
+    return sorted(set(cuts))
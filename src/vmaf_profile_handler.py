@@ -0,0 +1,119 @@
+import math
+import multiprocessing as mp
+from json import dump, load
+from pathlib import Path
+
+# Machine profile of the fastest layout of every resolution class, written by
+# vmaf_tuner.py next to this file
+PROFILE_FILE = "vmaf_profile.json"
+
+# Resolution classes with the number of pixels of their largest frames, from
+# smallest to largest
+RESOLUTION_CLASSES = [
+    ("sd", 720 * 576),
+    ("720p", 1280 * 720),
+    ("1080p", 1920 * 1080),
+    ("1440p", 2560 * 1440),
+    ("2160p", 3840 * 2160),
+    ("4320p", 7680 * 4320),
+]
+
+
+def get_resolution_class(
+    width,
+    height,
+):
+    """Get the smallest resolution class whose frames hold the given resolution."""
+    for name, pixels in RESOLUTION_CLASSES:
+        if width * height <= pixels:
+            return name
+    return RESOLUTION_CLASSES[-1][0]
+
+
+def get_class_pixels(name):
+    for class_name, pixels in RESOLUTION_CLASSES:
+        if class_name == name:
+            return pixels
+    return 0
+
+
+class VMAF_Profile_Handler:
+    """Saves the fastest libvmaf threads, decoder threads and processes layout of this machine.
+
+    Every resolution class gets its own layout, since the best split between threads and processes
+    changes a lot with the frame size. Resolution classes that were never tuned use the layout of
+    the closest tuned class.
+    """
+
+    def __init__(
+        self,
+        profile_file,
+        cores=None,
+    ):
+        self._profile_file = Path(profile_file)
+        self._cores = cores if cores else mp.cpu_count()
+        self._profile = {
+            "cores": self._cores,
+            "classes": {},
+        }
+
+        if self._profile_file.exists():
+            try:
+                with open(self._profile_file, "r") as reader:
+                    profile = load(reader)
+            except (OSError, ValueError) as e:
+                print("Could not read the machine profile file {}: {}".format(self._profile_file, e))
+                return
+            # Layouts tuned on a machine with a different number of cores do
+            # not carry over
+            if profile.get("cores") != self._cores:
+                print(
+                    "Ignoring the machine profile file {}, which was tuned for {} CPU threads instead of {}.".format(
+                        self._profile_file, profile.get("cores"), self._cores
+                    )
+                )
+                return
+            self._profile = profile
+
+    def get_profile_file(self):
+        return str(self._profile_file)
+
+    def get_classes(self):
+        return dict(self._profile["classes"])
+
+    def get_layout(
+        self,
+        width,
+        height,
+    ):
+        """Get the tuned layout for a resolution, or None if no resolution class was tuned yet.
+
+        Returns a dict with the "threads", "decode_threads" and "processes" keys, along with the
+        "class" it was tuned for and the "fps" it reached.
+        """
+        classes = self._profile["classes"]
+        if len(classes) == 0:
+            return None
+
+        name = get_resolution_class(width, height)
+        if name not in classes:
+            # The closest class by the ratio of their frame sizes
+            pixels = get_class_pixels(name)
+            name = min(classes.keys(), key=lambda tuned: abs(math.log(get_class_pixels(tuned) / pixels)))
+
+        return dict(classes[name], **{"class": name})
+
+    def set_layout(
+        self,
+        name,
+        layout,
+    ):
+        """Set the tuned layout of a resolution class."""
+        self._profile["classes"][name] = layout
+
+    def save(self):
+        try:
+            with open(self._profile_file, "w") as writer:
+                dump(self._profile, writer, indent=4)
+        except OSError as e:
+            print("Could not write the machine profile file {}: {}".format(self._profile_file, e))
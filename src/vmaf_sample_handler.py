@@ -0,0 +1,173 @@
+import random
+
+from vmaf_job_handler import MOTION_OVERLAP
+
+# Percentile of the per-frame VMAF scores reported as the low score estimate
+ESTIMATE_PERCENTILE = 5
+
+# Number of times the sampled clips are resampled for the confidence intervals
+BOOTSTRAP_ROUNDS = 1000
+
+# Share of the bootstrapped estimates that fall within the confidence intervals
+CONFIDENCE = 0.95
+
+
+def plan_strata(
+    frames,
+    cuts,
+    count,
+):
+    """Group the scenes between the given scene cuts into at most count strata of consecutive scenes.
+
+    Returns a list of (start, end) frame ranges that cover the whole video.
+    """
+    bounds = sorted(set([0] + [cut for cut in cuts if 0 < cut < frames] + [frames]))
+    scenes = list(zip(bounds[:-1], bounds[1:]))
+    if len(scenes) <= count:
+        return scenes
+
+    # Merge neighbouring scenes until every stratum holds about the same
+    # number of frames
+    strata = []
+    start = 0
+    for i, (_, end) in enumerate(scenes):
+        left = count - len(strata)
+        if end >= frames * (len(strata) + 1) / count or len(scenes) - i <= left - 1:
+            strata.append((start, end))
+            start = end
+    if start < frames:
+        strata[-1] = (strata[-1][0], frames)
+
+    return strata
+
+
+def plan_scene_samples(
+    frames,
+    cuts,
+    count,
+    clip_frames,
+    seed=0,
+):
+    """Spread count short clips over the scenes of a video, stratified by the scenes' lengths.
+
+    Every stratum of scenes gets a share of the clips by its number of frames, and is split into one
+    equally long span per clip, with every clip placed at a random position inside of its span. Returns
+    the clips as segments in the same layout as plan_segments, along with the "scene" index of their
+    stratum and the "weight" of frames their span stands for.
+    """
+    strata = plan_strata(frames, cuts, count)
+
+    # Every stratum gets a single clip, and every other clip goes to the
+    # stratum with the most frames per clip
+    clips = [1] * len(strata)
+    for _ in range(count - len(strata)):
+        i = max(range(len(strata)), key=lambda i: (strata[i][1] - strata[i][0]) / clips[i])
+        clips[i] += 1
+
+    rng = random.Random(seed)
+    samples = []
+    for scene, ((start, end), clip_count) in enumerate(zip(strata, clips)):
+        clip_count = min(clip_count, end - start)
+        for i in range(clip_count):
+            span_start = start + (end - start) * i // clip_count
+            span_end = start + (end - start) * (i + 1) // clip_count
+            length = min(clip_frames, span_end - span_start)
+            clip_start = rng.randint(span_start, span_end - length)
+            first = max(0, clip_start - MOTION_OVERLAP)
+            last = min(frames, clip_start + length + MOTION_OVERLAP)
+            samples.append(
+                {
+                    "index": len(samples),
+                    "start": clip_start,
+                    "end": clip_start + length,
+                    "first": first,
+                    "count": last - first,
+                    "scene": scene,
+                    "weight": span_end - span_start,
+                }
+            )
+
+    return samples
+
+
+def weighted_percentile(
+    items,
+    percentile,
+):
+    """Get the percentile of a list of (value, weight) tuples."""
+    items = sorted(items)
+    target = sum([weight for _, weight in items]) * percentile / 100
+    total = 0
+    for value, weight in items:
+        total += weight
+        if total >= target:
+            return value
+    return items[-1][0]
+
+
+def estimate_clips(
+    clips,
+    percentile=ESTIMATE_PERCENTILE,
+):
+    """Estimate the mean and percentile VMAF score of a whole video from its sampled clips.
+
+    Every clip is a dict with the per-frame VMAF "scores" of the clip and the "weight" of frames it
+    stands for, which every one of its frames shares equally.
+    """
+    clips = [clip for clip in clips if len(clip["scores"]) > 0]
+    total = sum([clip["weight"] for clip in clips])
+    mean = sum([clip["weight"] * sum(clip["scores"]) / len(clip["scores"]) for clip in clips]) / total
+    items = [(score, clip["weight"] / len(clip["scores"])) for clip in clips for score in clip["scores"]]
+
+    return (mean, weighted_percentile(items, percentile))
+
+
+def estimate_scores(
+    clips,
+    percentile=ESTIMATE_PERCENTILE,
+    rounds=BOOTSTRAP_ROUNDS,
+    confidence=CONFIDENCE,
+    seed=0,
+):
+    """Estimate the mean and percentile VMAF score of a whole video from its sampled clips, with bootstrap confidence intervals.
+
+    The confidence intervals come from resampling the clips of every scene stratum with replacement,
+    so that every bootstrapped estimate keeps the same spread of clips over the video. Strata with a
+    single clip say nothing about their own spread, so they are resampled together as one stratum.
+    Returns None if none of the clips have any scores.
+    """
+    clips = [clip for clip in clips if len(clip["scores"]) > 0]
+    if len(clips) == 0:
+        return None
+    mean, low = estimate_clips(clips, percentile)
+
+    strata = {}
+    for clip in clips:
+        strata.setdefault(clip["scene"], []).append(clip)
+    singles = [stratum[0] for stratum in strata.values() if len(stratum) == 1]
+    strata = [stratum for stratum in strata.values() if len(stratum) > 1]
+    if len(singles) > 0:
+        strata.append(singles)
+    rng = random.Random(seed)
+    means = []
+    lows = []
+    for _ in range(rounds):
+        resampled = []
+        for stratum in strata:
+            resampled += [rng.choice(stratum) for _ in stratum]
+        round_mean, round_low = estimate_clips(resampled, percentile)
+        means.append(round_mean)
+        lows.append(round_low)
+    means.sort()
+    lows.sort()
+    lower = int((1 - confidence) / 2 * (rounds - 1))
+    upper = int((1 + confidence) / 2 * (rounds - 1))
+
+    return {
+        "mean": mean,
+        "mean_ci": [means[lower], means[upper]],
+        "percentile": percentile,
+        "low": low,
+        "low_ci": [lows[lower], lows[upper]],
+        "confidence": confidence,
+    }
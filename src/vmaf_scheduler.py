@@ -0,0 +1,104 @@
+import multiprocessing as mp
+import threading
+
+
+class VMAF_Thread_Scheduler:
+    """Hands out threads to every VMAF calculation job as it gets started.
+
+    With fixed threads every job gets the user's thread count. With dynamic threads, the cores
+    that are not used by running jobs are shared between the free process slots, or between the
+    remaining jobs once there are fewer of them than free slots, so that the last jobs of a batch
+    get the cores the finished jobs left behind.
+
+    With a memory budget, the estimated peak memory of every running job is tracked as well, and
+    only jobs that fit into what is left of the budget are admitted.
+    """
+
+    def __init__(
+        self,
+        processes=1,
+        threads=0,
+        dynamic=False,
+        cores=None,
+        memory_budget=0,
+    ):
+        self._cores = cores if cores else mp.cpu_count()
+        self._processes = max(1, processes)
+        self._threads = threads
+        self._dynamic = dynamic
+        # Bytes of memory the running jobs may use together, 0 meaning no limit
+        self._memory_budget = memory_budget
+        self._running = {}
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def get_cores(self):
+        return self._cores
+
+    def get_running_count(self):
+        return len(self._running)
+
+    def get_free_slots(self):
+        return self._processes - len(self._running)
+
+    def get_free_cores(self):
+        return max(0, self._cores - sum(self._running.values()))
+
+    def is_dynamic(self):
+        return self._dynamic
+
+    def get_free_memory(self):
+        """Get the bytes of the memory budget left over by the running jobs, or None without a budget."""
+        if self._memory_budget <= 0:
+            return None
+        return self._memory_budget - sum(self._memory.values())
+
+    def fits(
+        self,
+        memory,
+    ):
+        """Check whether a job with the given estimated peak memory can be admitted next."""
+        free_memory = self.get_free_memory()
+        # A job that is larger than the whole budget still runs on its own,
+        # instead of never running at all
+        return free_memory is None or len(self._running) == 0 or memory <= free_memory
+
+    def plan(
+        self,
+        pending,
+    ):
+        """Get the number of threads for the next job to start, given the number of jobs left to start."""
+        if not self._dynamic:
+            return self._threads
+
+        with self._lock:
+            sharing = max(1, min(self.get_free_slots(), pending))
+            return max(1, self.get_free_cores() // sharing)
+
+    def plan_split(
+        self,
+        pending,
+    ):
+        """Get how many segments the next job should be split into so the remaining free slots don't sit idle."""
+        if not self._dynamic:
+            return 1
+        return max(1, self.get_free_slots() - (pending - 1))
+
+    def start(
+        self,
+        key,
+        threads,
+        memory=0,
+    ):
+        with self._lock:
+            # A thread count of 0 lets FFmpeg use every core
+            self._running[key] = threads if threads > 0 else self._cores
+            self._memory[key] = memory
+
+    def finish(
+        self,
+        key,
+    ):
+        with self._lock:
+            self._running.pop(key, None)
+            self._memory.pop(key, None)
@@ -0,0 +1,127 @@
+from copy import deepcopy
+from functools import lru_cache
+from pathlib import Path
+
+# The project's pyproject.toml holds the [vmaf.*] sections with the default
+# settings of every tool
+SETTINGS_FILE = Path(__file__).parent.parent.joinpath("pyproject.toml")
+
+# Default value of every setting in the [vmaf.*] sections, whose types every
+# value read from a settings file is converted to
+DEFAULT_SETTINGS = {
+    "general": {
+        "ffmpeg": "ffmpeg",
+    },
+    "calculator": {
+        "psnr": True,
+        "ssim": True,
+        "ms_ssim": True,
+        "subsamples": 1,
+        "log_path": "vmaf",
+        "log_format": "xml",
+        "hwaccel": False,
+        "threads": 0,
+        "processes": 1,
+        "use_remaining_threads": False,
+    },
+    "plotter": {
+        "graphing": {
+            "output": "vmaf",
+            "custom": 0,
+            "threads": 0,
+            "processes": 1,
+            "use_remaining_threads": False,
+        },
+        "image": {
+            "x": 1920.0,
+            "y": 1080.0,
+            "format": "svg",
+            "transparent": True,
+        },
+        "video": {
+            "x": 1920.0,
+            "y": 1080.0,
+            "framerate": 60.0,
+            "transparent": True,
+        },
+    },
+}
+
+
+def read_toml(file):
+    """Read a TOML file with the standard library's tomllib, or the toml package before Python 3.11."""
+    try:
+        import tomllib
+
+        with open(file, "rb") as reader:
+            return tomllib.load(reader)
+    except ImportError:
+        import toml
+
+        with open(file, "r") as reader:
+            return toml.load(reader)
+
+
+def convert_setting(
+    value,
+    default,
+):
+    """Convert a setting read from a settings file to the type of its default value."""
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise ValueError("must be true or false, not {!r}".format(value))
+        return value
+    if isinstance(default, list):
+        return list(value) if isinstance(value, list) else [value]
+
+    return type(default)(value)
+
+
+def merge_settings(
+    defaults,
+    values,
+    section="vmaf",
+):
+    """Merge the settings read from a settings file into their defaults, section by section.
+
+    Settings that are unknown or can not be converted to the type of their default are left out,
+    keeping their default value instead.
+    """
+    merged = deepcopy(defaults)
+    for key, value in values.items():
+        name = "{}.{}".format(section, key)
+        if key not in defaults:
+            print("Ignoring the unknown setting {}.".format(name))
+        elif isinstance(defaults[key], dict):
+            if isinstance(value, dict):
+                merged[key] = merge_settings(defaults[key], value, name)
+            else:
+                print("Ignoring the setting {}, which must be a section.".format(name))
+        else:
+            try:
+                merged[key] = convert_setting(value, defaults[key])
+            except (TypeError, ValueError) as e:
+                print("Ignoring the setting {}: {}".format(name, e))
+
+    return merged
+
+
+@lru_cache(maxsize=None)
+def read_settings(file):
+    if not Path(file).is_file():
+        return DEFAULT_SETTINGS
+    try:
+        data = read_toml(file)
+    except (OSError, ValueError) as e:
+        print("Could not read the settings file {}, using the default settings: {}".format(file, e))
+        return DEFAULT_SETTINGS
+
+    return merge_settings(DEFAULT_SETTINGS, data.get("vmaf", {}))
+
+
+def load_settings(file=SETTINGS_FILE):
+    """Load the [vmaf.*] sections of a settings file, falling back to the default of every missing setting.
+
+    Every file is only read once per process, and every call gets its own copy of the settings.
+    """
+    return deepcopy(read_settings(str(file)))
@@ -0,0 +1,106 @@
+import shutil
+import subprocess as sp
+from pathlib import Path
+
+import ffmpy
+
+from vmaf_common import bytes2human
+from vmaf_probe_handler import estimate_frame_bytes, get_ffprobe, probe_video
+
+
+class VMAF_Spool_Handler:
+    """Decodes a reference video file once into a raw Y4M spool that every VMAF calculation can read from.
+
+    The spool is written next to a ".part" suffix and only renamed once complete, so a finished spool
+    found on a later run with the same reference video file can be reused as-is. Given a pixel format,
+    the reference is converted to it while spooling, so that no calculation has to convert it again.
+    """
+
+    def __init__(
+        self,
+        reference,
+        spool_dir,
+        ffmpeg="ffmpeg",
+        max_size=0,
+        pix_fmt=None,
+    ):
+        self._reference = Path(reference)
+        self._spool_dir = Path(spool_dir)
+        self._ffmpeg = ffmpeg
+        # Maximum spool size in GiB, 0 meaning no limit
+        self._max_size = max_size
+        self._pix_fmt = pix_fmt
+        self._ff = None
+
+        # Name the spool after the reference's size and modification time, so
+        # that a changed reference video file never reuses a stale spool
+        stat = self._reference.stat()
+        name = "{}_{}_{}".format(self._reference.stem, stat.st_size, stat.st_mtime_ns)
+        if pix_fmt:
+            name += "_{}".format(pix_fmt)
+        name += ".y4m"
+        self._spool = self._spool_dir.joinpath(name)
+        self._part = self._spool_dir.joinpath(name + ".part")
+
+    def get_path(self):
+        return str(self._spool)
+
+    def exists(self):
+        return self._spool.exists()
+
+    def _check_size(self):
+        """Raise an OSError if the spool would not fit within the size limit or on the scratch path."""
+        info = probe_video(self._reference, get_ffprobe(self._ffmpeg))
+        if self._pix_fmt:
+            info["pix_fmt"] = self._pix_fmt
+        size = estimate_frame_bytes(info) * info["frames"]
+
+        if self._max_size > 0 and size > self._max_size * 1024**3:
+            msg = "Reference spool would be {} which is more than the spool size limit of {}GiB."
+            raise OSError(msg.format(bytes2human(size), self._max_size))
+
+        free = shutil.disk_usage(self._spool_dir).free
+        if size > free:
+            msg = "Reference spool would be {} but only {} is free in {}."
+            raise OSError(msg.format(bytes2human(size), bytes2human(free), self._spool_dir))
+
+    def create(self):
+        """Decode the reference video file into the spool, unless a finished spool already exists."""
+        if self.exists():
+            print("Reusing reference spool {}".format(self._spool))
+            return self.get_path()
+
+        self._spool_dir.mkdir(parents=True, exist_ok=True)
+        self._check_size()
+
+        print("Spooling reference video file {} to {}...".format(self._reference, self._spool))
+        self._ff = ffmpy.FFmpeg(
+            executable=self._ffmpeg,
+            global_options=["-hide_banner", "-y"],
+            inputs={str(self._reference): None},
+            outputs={
+                str(self._part): "-map 0:v:0{} -f yuv4mpegpipe -strict -1".format(
+                    " -pix_fmt {}".format(self._pix_fmt) if self._pix_fmt else ""
+                )
+            },
+        )
+        self._ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+        self._part.replace(self._spool)
+        self._ff = None
+
+        return self.get_path()
+
+    def cancel(self):
+        """Stop a running spool decode and delete its partial spool, keeping any finished spool for reuse."""
+        if self._ff is not None and self._ff.process is not None:
+            while self._ff.process.poll() is None:
+                self._ff.process.kill()
+                self._ff.process.wait()
+        if self._part.exists():
+            print("\tDeleting partial reference spool:\n\t{}...".format(self._part))
+            self._part.unlink(missing_ok=True)
+
+    def remove(self):
+        """Delete the spool once it is no longer needed."""
+        self.cancel()
+        self._spool.unlink(missing_ok=True)
@@ -0,0 +1,100 @@
+import os
+import threading
+from json import dump, dumps, load, loads
+from pathlib import Path
+
+
+class VMAF_State_Handler:
+    """Crash safe save state of every dist-model pair's calculation for a reference video file.
+
+    Every status change is appended to a journal file and synced to disk as it happens, so a crash
+    only loses the calculations that were still running. Compacting writes the full state to the
+    completions JSON file, which is also the file earlier versions of the program used, and empties
+    the journal.
+    """
+
+    def __init__(
+        self,
+        reference,
+    ):
+        ref_path = Path(reference)
+        self._completions_file = ref_path.parent.joinpath("{}_completions.json".format(ref_path.stem))
+        self._journal_file = ref_path.parent.joinpath("{}_completions.journal".format(ref_path.stem))
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def get_completions_file(self):
+        return str(self._completions_file)
+
+    def get_journal_file(self):
+        return str(self._journal_file)
+
+    def load(self):
+        """Read the completions JSON file and replay the journal on top of it."""
+        completions = {}
+        if self._completions_file.exists():
+            with open(self._completions_file, "r") as reader:
+                completions = load(reader)
+
+        if self._journal_file.exists():
+            with open(self._journal_file, "r") as reader:
+                for line in reader:
+                    # The last line may have been cut off by a crash, in which
+                    # case its status change never fully happened
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        break
+                    if record["dist"] not in completions:
+                        completions[record["dist"]] = {}
+                    completions[record["dist"]][record["model"]] = record["entry"]
+
+        return completions
+
+    def record(
+        self,
+        dist,
+        model,
+        entry,
+    ):
+        """Append the current state of a dist-model pair to the journal and sync it to disk."""
+        line = dumps({"dist": dist, "model": model, "entry": entry}) + "\n"
+        with self._lock:
+            if self._journal is None:
+                self._journal = open(self._journal_file, "a")
+            self._journal.write(line)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def compact(
+        self,
+        completions,
+    ):
+        """Write the full state to the completions JSON file and empty the journal."""
+        with self._lock:
+            # Write to a temporary file first so that a crash never leaves a
+            # broken completions file behind
+            tmp_file = self._completions_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as writer:
+                dump(
+                    completions,
+                    writer,
+                    indent=4,
+                    sort_keys=True,
+                )
+                writer.flush()
+                os.fsync(writer.fileno())
+            tmp_file.replace(self._completions_file)
+
+            # Only empty the journal once the completions file holds every
+            # status change in it
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._journal_file.unlink(missing_ok=True)
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,423 @@
+import asyncio
+import concurrent.futures as cf
+import errno
+import os
+import signal
+import subprocess as sp
+import sys
+import threading
+from collections import deque
+from pathlib import Path
+from time import perf_counter
+
+import ffmpy
+
+# Number of the last stderr lines kept for reporting a failed FFmpeg process
+STDERR_TAIL = 50
+
+
+class VMAF_Timeout_Error(ffmpy.FFRuntimeError):
+    """Raised when an FFmpeg process was killed for running longer than its timeout."""
+
+
+def read_proc_usage(pid):
+    """Read the CPU seconds and peak memory of a running process from /proc, or None where there is no /proc."""
+    try:
+        with open("/proc/{}/stat".format(pid), "r") as reader:
+            # The process name can hold spaces, so the fields are counted from
+            # after it, starting with the process state
+            fields = reader.read().rsplit(")", 1)[1].split()
+        with open("/proc/{}/status".format(pid), "r") as reader:
+            status = reader.read()
+    except (OSError, IndexError):
+        return None
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = {
+        "user": int(fields[11]) / ticks,
+        "sys": int(fields[12]) / ticks,
+        "max_rss": 0,
+    }
+    for line in status.splitlines():
+        # Lines look like "VmHWM:    123456 kB"
+        if line.startswith("VmHWM:"):
+            usage["max_rss"] = int(line.split()[1]) * 1024
+    return usage
+
+
+def parse_vmaf_score(
+    line,
+    default_index=0,
+):
+    """Return the libvmaf instance index and VMAF score of an FFmpeg stderr line, or None if it has no score."""
+    if "VMAF score" not in line:
+        return None
+
+    # Lines look like "[Parsed_libvmaf_2 @ 0x...] VMAF score: 99.891565"
+    instance = line.split("]")[0].split("@")[0].strip(" [")
+    index = instance.rsplit("_", 1)[-1]
+    index = int(index) if index.isdigit() else default_index
+    return (index, float(line.split("]")[1].split(": ")[1].strip()))
+
+
+class VMAF_Stream_Runner:
+    """Runs an FFmpeg command while reading its progress and stderr line by line.
+
+    Only the VMAF scores, the latest progress values and the last STDERR_TAIL lines of stderr are kept,
+    instead of holding the whole output of a long calculation in memory until it finishes.
+
+    The command runs in its own process group, which gets killed as a whole once the command runs
+    longer than its timeout or gets killed, along with deleting the partially written logs.
+    """
+
+    def __init__(
+        self,
+        ff,
+        frames=0,
+        timeout=0,
+        logs=None,
+    ):
+        self._ff = ff
+        # Number of frames the command is expected to process, 0 if unknown
+        self._frames = frames
+        # Seconds the command may run for, 0 meaning no limit
+        self._timeout = timeout
+        # Log files written by the command, deleted if it does not finish
+        self._logs = logs if logs else []
+        self._process = None
+        self._killed = False
+        self._timed_out = False
+        self._tail = deque(maxlen=STDERR_TAIL)
+        self._scores = []
+        self._progress = {
+            "frame": 0,
+            "fps": 0.0,
+        }
+        # Wall seconds, CPU seconds and peak memory in bytes of the command
+        self._usage = {
+            "wall": None,
+            "user": None,
+            "sys": None,
+            "max_rss": None,
+        }
+        self._started = None
+        self._sample_usage = False
+        self._lock = threading.Lock()
+
+    def get_frames(self):
+        return self._frames
+
+    def get_frame(self):
+        return self._progress["frame"]
+
+    def get_fps(self):
+        return self._progress["fps"]
+
+    def get_percent(self):
+        """Get how much of the command's frames are done, between 0 and 1."""
+        if self._frames <= 0:
+            return 0.0
+        return min(1.0, self._progress["frame"] / self._frames)
+
+    def get_scores(self):
+        """Get the VMAF score of every libvmaf instance, in the order they appear in the filter graph."""
+        with self._lock:
+            return [score for index, score in sorted(self._scores)]
+
+    def get_pid(self):
+        return self._process.pid if self._process is not None else None
+
+    def get_usage(self):
+        """Get the wall seconds, user and system CPU seconds and peak memory in bytes the command used.
+
+        The CPU seconds and peak memory are exact when the command ran from run on a POSIX system, sampled
+        from /proc while it ran from run_async, and None when neither is available.
+        """
+        return dict(self._usage)
+
+    def _get_command(self):
+        return self._ff._cmd[:1] + ["-nostdin", "-nostats", "-progress", "pipe:1"] + self._ff._cmd[1:]
+
+    def _read_stderr_line(
+        self,
+        raw,
+    ):
+        line = raw.decode("utf-8", errors="replace").rstrip()
+        self._tail.append(line)
+        score = parse_vmaf_score(line, len(self._scores))
+        if score is not None:
+            with self._lock:
+                self._scores.append(score)
+
+    def _read_progress_line(
+        self,
+        raw,
+    ):
+        # Lines of "-progress" look like "frame=120" and "fps=45.67"
+        key, _, value = raw.decode("utf-8", errors="replace").strip().partition("=")
+        try:
+            if key == "frame":
+                self._progress["frame"] = int(value)
+            elif key == "fps":
+                self._progress["fps"] = float(value)
+        except ValueError:
+            pass
+
+        # Every block of progress ends with a "progress" line, after which the
+        # resource usage is sampled when the exit status will not report it
+        if key == "progress" and self._sample_usage:
+            usage = read_proc_usage(self._process.pid)
+            if usage is not None:
+                self._usage.update(usage)
+
+    def _read_stderr(self):
+        for raw in self._process.stderr:
+            self._read_stderr_line(raw)
+
+    def _read_progress(self):
+        for raw in self._process.stdout:
+            self._read_progress_line(raw)
+
+    def kill(self):
+        """Kill the command along with every process in its process group."""
+        if self._process is not None and self._process.returncode is not None:
+            return
+        # A command killed before it started gets killed as soon as it does
+        self._killed = True
+        if self._process is None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(self._process.pid, signal.SIGKILL)
+            else:
+                self._process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _expire(self):
+        self._timed_out = True
+        self.kill()
+
+    def remove_logs(self):
+        for log in self._logs:
+            Path(log).unlink(missing_ok=True)
+
+    def _finish(self):
+        """Check how the command exited, returning its VMAF scores if it finished."""
+        returncode = self._process.returncode
+        # A command that finished right before it got killed keeps its results
+        if returncode == 0:
+            return self.get_scores()
+
+        if self._killed:
+            self.remove_logs()
+        stderr = "\n".join(self._tail).encode("utf-8")
+        if self._timed_out:
+            raise VMAF_Timeout_Error(self._ff.cmd, returncode, b"", stderr)
+        raise ffmpy.FFRuntimeError(self._ff.cmd, returncode, b"", stderr)
+
+    def _wait(self):
+        """Wait for the command to exit, reading the CPU seconds and peak memory it used along with its exit status."""
+        if os.name != "posix":
+            self._process.wait()
+            return
+        try:
+            _, status, rusage = os.wait4(self._process.pid, 0)
+        except ChildProcessError:
+            self._process.wait()
+            return
+        self._process.returncode = os.waitstatus_to_exitcode(status)
+        self._usage["user"] = rusage.ru_utime
+        self._usage["sys"] = rusage.ru_stime
+        # Linux reports the peak memory in kilobytes and macOS in bytes
+        self._usage["max_rss"] = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    def _open_process(self):
+        """Start the command in its own process group, with its progress and stderr piped for reading."""
+        return sp.Popen(
+            self._get_command(),
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE,
+            stderr=sp.PIPE,
+            start_new_session=os.name == "posix",
+        )
+
+    def run(self):
+        """Run the command until it finishes, returning its VMAF scores."""
+        self._started = perf_counter()
+        try:
+            self._process = self._open_process()
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise ffmpy.FFExecutableNotFoundError("Executable '{}' not found".format(self._ff.executable))
+            raise
+        self._ff.process = self._process
+        if self._killed:
+            self.kill()
+
+        timer = None
+        if self._timeout > 0:
+            timer = threading.Timer(self._timeout, self._expire)
+            timer.daemon = True
+            timer.start()
+
+        # Read stderr in its own thread so that neither pipe can fill up and
+        # block FFmpeg
+        reader = threading.Thread(target=self._read_stderr, daemon=True)
+        reader.start()
+        self._read_progress()
+        reader.join()
+        self._wait()
+        self._usage["wall"] = perf_counter() - self._started
+        if timer is not None:
+            timer.cancel()
+
+        return self._finish()
+
+    async def _read_stream(
+        self,
+        stream,
+        read_line,
+    ):
+        async for raw in stream:
+            read_line(raw)
+
+    async def _open_process_async(self):
+        """Start the command from an asyncio event loop, the same way as _open_process."""
+        return await asyncio.create_subprocess_exec(
+            *self._get_command(),
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE,
+            stderr=sp.PIPE,
+            start_new_session=os.name == "posix",
+        )
+
+    async def _wait_async(self):
+        """Read the progress and stderr of the command until it exits."""
+        await asyncio.gather(
+            self._read_stream(self._process.stdout, self._read_progress_line),
+            self._read_stream(self._process.stderr, self._read_stderr_line),
+            self._process.wait(),
+        )
+
+    async def _reap_async(self):
+        """Wait for the command to exit after it was killed."""
+        await self._process.wait()
+
+    async def run_async(self):
+        """Run the command from an asyncio event loop until it finishes, returning its VMAF scores."""
+        # The event loop reaps the command itself, so its resource usage can
+        # only be sampled while it runs
+        self._sample_usage = True
+        self._started = perf_counter()
+        try:
+            self._process = await self._open_process_async()
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise ffmpy.FFExecutableNotFoundError("Executable '{}' not found".format(self._ff.executable))
+            raise
+        if self._killed:
+            self.kill()
+
+        try:
+            await asyncio.wait_for(self._wait_async(), timeout=self._timeout if self._timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self._expire()
+            await self._reap_async()
+        except asyncio.CancelledError:
+            # Never leave an FFmpeg process or its partial logs behind
+            self.kill()
+            await self._reap_async()
+            self.remove_logs()
+            raise
+        self._usage["wall"] = perf_counter() - self._started
+
+        return self._finish()
+
+
+class VMAF_Async_Engine:
+    """Runs the FFmpeg commands of VMAF calculation jobs from a single asyncio event loop.
+
+    Works like a ThreadPoolExecutor whose submit takes a coroutine function such as
+    VMAF_Stream_Runner.run_async, returning a concurrent.futures.Future, except that every
+    running command is driven by the same thread and a semaphore bounds how many run at once.
+    """
+
+    def __init__(
+        self,
+        max_workers=1,
+    ):
+        self._max_workers = max(1, max_workers)
+        self._semaphore = None
+        self._futures = set()
+        self._shutdown = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def _run(
+        self,
+        fn,
+        *args,
+    ):
+        # The semaphore has to be created inside the event loop it is used by
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_workers)
+        async with self._semaphore:
+            return await fn(*args)
+
+    def submit(
+        self,
+        fn,
+        *args,
+    ):
+        if self._shutdown:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        future = asyncio.run_coroutine_threadsafe(self._run(fn, *args), self._loop)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    async def _drain(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(
+        self,
+        wait=True,
+        cancel_futures=False,
+    ):
+        """Stop taking new jobs, optionally cancelling the queued and running ones.
+
+        Cancelled jobs kill their FFmpeg processes and delete their partial logs, which waiting
+        also waits for before the event loop is stopped.
+        """
+        self._shutdown = True
+        if cancel_futures:
+            for future in list(self._futures):
+                future.cancel()
+        if not wait or self._loop.is_closed():
+            return
+
+        asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def create_engine(
+    engine="threads",
+    max_workers=1,
+):
+    """Create the executor that runs the FFmpeg commands, either a thread per command or a single asyncio event loop."""
+    if engine == "async":
+        return VMAF_Async_Engine(max_workers=max_workers)
+    return cf.ThreadPoolExecutor(max_workers=max_workers)
+
+
+def get_run(
+    runner,
+    engine="threads",
+):
+    """Get the run method of a VMAF_Stream_Runner to submit to an executor made by create_engine."""
+    return runner.run_async if engine == "async" else runner.run
@@ -0,0 +1,245 @@
+import csv
+import json
+from pathlib import Path
+from time import time
+
+from vmaf_common import bytes2human
+
+# Columns of the telemetry file, in the order they are written
+TELEMETRY_FIELDS = [
+    "finished",
+    "kind",
+    "distorted",
+    "models",
+    "segment",
+    "frames",
+    "resolution",
+    "input_bytes",
+    "threads",
+    "wall",
+    "user",
+    "sys",
+    "max_rss",
+    "fps",
+    "error",
+]
+
+# Resource usage summed up in the save state of every dist-model pair
+USAGE_KEYS = ["wall", "user", "sys"]
+
+
+def get_job_kind(job):
+    """Get what kind of calculation a job runs, for telling the rows of the telemetry file apart."""
+    if job.get("subsamples"):
+        return "coarse"
+    elif job.get("refine"):
+        return "refine"
+    elif job.get("sample"):
+        return "sample"
+    elif job["segment"] is not None:
+        return "segment"
+    return "full"
+
+
+def get_resolution(
+    file,
+    infos,
+):
+    """Get the resolution of a probed video file as "WIDTHxHEIGHT", or "unknown" if it was not probed."""
+    if file not in infos:
+        return "unknown"
+    return "{}x{}".format(infos[file]["width"], infos[file]["height"])
+
+
+def add_usage(
+    entry,
+    row,
+    pairs=1,
+):
+    """Add the resource usage of a finished job to the save state entry of one of its dist-model pairs.
+
+    Jobs running several pairs at once split their wall and CPU seconds evenly between them, while
+    every pair keeps the peak memory of the whole job.
+    """
+    telemetry = entry.setdefault(
+        "telemetry",
+        {
+            "jobs": 0,
+            "frames": 0,
+            "wall": 0.0,
+            "user": 0.0,
+            "sys": 0.0,
+            "max_rss": 0,
+            "fps": None,
+        },
+    )
+    # libvmaf's own frames per second, averaged over the frames of every job
+    if row["fps"] is not None:
+        if telemetry["fps"] is None or telemetry["frames"] == 0:
+            telemetry["fps"] = row["fps"]
+        else:
+            total = telemetry["frames"] + row["frames"]
+            telemetry["fps"] = (telemetry["fps"] * telemetry["frames"] + row["fps"] * row["frames"]) / max(total, 1)
+    telemetry["jobs"] += 1
+    telemetry["frames"] += row["frames"]
+    for key in USAGE_KEYS:
+        if row[key] is not None:
+            telemetry[key] += row[key] / pairs
+    if row["max_rss"] is not None:
+        telemetry["max_rss"] = max(telemetry["max_rss"], row["max_rss"])
+
+
+def build_row(
+    job,
+    usage,
+    infos,
+    reference,
+    threads=0,
+    fps=None,
+    error=None,
+):
+    """Build the telemetry row of a finished job from the resource usage of its FFmpeg process.
+
+    usage is a dict from VMAF_Stream_Runner.get_usage, and infos the probed video files by path.
+    """
+    dists = list(dict.fromkeys([dist for dist, _ in job["pairs"]]))
+    usage = usage if usage else {}
+    return {
+        "finished": time(),
+        "kind": get_job_kind(job),
+        "distorted": dists,
+        # Models and resolutions are listed for every dist-model pair, so that
+        # they line up when a job runs several distorted video files
+        "models": [Path(model).stem for _, model in job["pairs"]],
+        "segment": job["segment"]["index"] if job["segment"] is not None else None,
+        "frames": job.get("size", (0, 0))[0],
+        "resolution": [get_resolution(dist, infos) for dist, _ in job["pairs"]],
+        "input_bytes": sum([infos[file]["size"] for file in dists + [reference] if file in infos]),
+        "threads": threads,
+        "wall": usage.get("wall"),
+        "user": usage.get("user"),
+        "sys": usage.get("sys"),
+        "max_rss": usage.get("max_rss"),
+        "fps": fps,
+        "error": error,
+    }
+
+
+class VMAF_Telemetry_Handler:
+    """Collects the wall time, CPU time, peak memory and speed of every finished VMAF calculation job.
+
+    Every job becomes a row of the telemetry file, written as CSV or JSON by the file's extension,
+    and the rows are summarized by model and resolution for planning how many processes and threads
+    a machine can run.
+    """
+
+    def __init__(
+        self,
+        telemetry_file=None,
+    ):
+        self._telemetry_file = Path(telemetry_file) if telemetry_file else None
+        self._rows = []
+
+    def get_rows(self):
+        return list(self._rows)
+
+    def record(
+        self,
+        job,
+        usage,
+        infos,
+        reference,
+        threads=0,
+        fps=None,
+        error=None,
+    ):
+        """Add a row for a finished job from the resource usage of its FFmpeg process, returning the row."""
+        row = build_row(job, usage, infos, reference, threads, fps, error)
+        self._rows.append(row)
+
+        return row
+
+    def summarize(self):
+        """Sum up the rows of every model and distorted video resolution.
+
+        Returns a dict with (model, resolution) keys, holding the number of jobs, frames, wall and CPU
+        seconds, the peak memory, the frames per second of wall time and libvmaf's own frames per second.
+        """
+        summary = {}
+        for row in self._rows:
+            if row["error"] is not None:
+                continue
+            pairs = len(row["models"])
+            for key in zip(row["models"], row["resolution"]):
+                stats = summary.setdefault(
+                    key,
+                    {
+                        "jobs": 0,
+                        "frames": 0,
+                        "wall": 0.0,
+                        "cpu": 0.0,
+                        "max_rss": 0,
+                        "fps": [],
+                    },
+                )
+                stats["jobs"] += 1
+                stats["frames"] += row["frames"]
+                if row["wall"] is not None:
+                    stats["wall"] += row["wall"] / pairs
+                if row["user"] is not None and row["sys"] is not None:
+                    stats["cpu"] += (row["user"] + row["sys"]) / pairs
+                if row["max_rss"] is not None:
+                    stats["max_rss"] = max(stats["max_rss"], row["max_rss"])
+                if row["fps"] is not None:
+                    stats["fps"].append(row["fps"])
+
+        for stats in summary.values():
+            stats["wall_fps"] = stats["frames"] / stats["wall"] if stats["wall"] > 0 else None
+            stats["fps"] = sum(stats["fps"]) / len(stats["fps"]) if len(stats["fps"]) > 0 else None
+
+        return summary
+
+    def print_summary(self):
+        """Print the throughput of every model and resolution."""
+        summary = self.summarize()
+        if len(summary) == 0:
+            return
+
+        print("Throughput by VMAF model and distorted resolution:")
+        for (model, resolution), stats in sorted(summary.items()):
+            msg = "\t{} @ {}: {} jobs, {} frames".format(model, resolution, stats["jobs"], stats["frames"])
+            if stats["wall_fps"] is not None:
+                msg += ", {:.1f} frames/s".format(stats["wall_fps"])
+            if stats["fps"] is not None:
+                msg += " (libvmaf {:.1f} frames/s)".format(stats["fps"])
+            # Cores kept busy by a single job, which bounds how many processes
+            # fit on the machine at once
+            if stats["wall"] > 0 and stats["cpu"] > 0:
+                msg += ", {:.1f} cores per job".format(stats["cpu"] / stats["wall"])
+            if stats["max_rss"] > 0:
+                msg += ", {} peak memory".format(bytes2human(stats["max_rss"]))
+            print(msg)
+        print()
+
+    def save(self):
+        """Write every row to the telemetry file, if one was given."""
+        if self._telemetry_file is None:
+            return
+        try:
+            if self._telemetry_file.suffix.lower() == ".csv":
+                with open(self._telemetry_file, "w", newline="") as writer:
+                    csv_writer = csv.DictWriter(writer, fieldnames=TELEMETRY_FIELDS)
+                    csv_writer.writeheader()
+                    for row in self._rows:
+                        # Jobs can run several distorted video files and models
+                        csv_writer.writerow(
+                            {
+                                key: ";".join([str(v) for v in value]) if isinstance(value, list) else value
+                                for key, value in row.items()
+                            }
+                        )
+            else:
+                with open(self._telemetry_file, "w") as writer:
+                    json.dump(self._rows, writer, indent=4)
+        except OSError as e:
+            print("Could not write the VMAF telemetry file {}: {}".format(self._telemetry_file, e))
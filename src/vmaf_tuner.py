@@ -0,0 +1,279 @@
+import argparse as argp
+import concurrent.futures as cf
+import multiprocessing as mp
+import shutil
+import tempfile
+from pathlib import Path
+from time import time
+
+import ffmpy
+
+from vmaf_job_handler import build_job, build_vmaf_filter, escape_log_path
+from vmaf_probe_handler import get_ffprobe, probe_video
+from vmaf_profile_handler import (
+    PROFILE_FILE,
+    VMAF_Profile_Handler,
+    get_resolution_class,
+)
+from vmaf_stream_handler import VMAF_Stream_Runner
+
+# Number of frames every calibration process calculates
+CALIBRATION_FRAMES = 240
+
+
+def get_powers_of_two(limit):
+    """Get the powers of two up to and including the given limit, along with the limit itself."""
+    values = []
+    value = 1
+    while value < limit:
+        values.append(value)
+        value *= 2
+    values.append(limit)
+
+    return values
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for tuning the threads and processes of the VMAF Calculator."""
+    main_help = "Finds the fastest split of libvmaf threads, decoder threads and processes for this machine, "
+    main_help += "by running short calibration calculations on a sample clip over a grid of layouts.\n"
+    main_help += "The fastest layout is saved to the machine profile for the resolution class of the sample clip, "
+    main_help += "which the VMAF Calculator uses by default for video files of that resolution."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+
+    reference_help = "Sample clip to calibrate with, at the resolution the profile is tuned for."
+    parser.add_argument(
+        "-r",
+        "--reference",
+        dest="reference",
+        type=str,
+        required=True,
+        help=reference_help,
+    )
+
+    distorted_help = "Distorted version of the sample clip (Default is to compare the sample clip against itself)."
+    parser.add_argument(
+        "-d",
+        "--distorted",
+        dest="distorted",
+        type=str,
+        help=distorted_help,
+    )
+
+    model_help = "Specify the VMAF model file to calibrate with."
+    parser.add_argument(
+        "-m",
+        "--model",
+        dest="model",
+        type=str,
+        required=True,
+        help=model_help,
+    )
+
+    ffmpeg_help = 'Specify the path to the FFmpeg executable (Default is "ffmpeg").'
+    parser.add_argument(
+        "-f",
+        "--ffmpeg",
+        dest="ffmpeg",
+        type=str,
+        default="ffmpeg",
+        help=ffmpeg_help,
+    )
+
+    frames_help = "Specify the number of frames every calibration process calculates (Default is {}).".format(
+        CALIBRATION_FRAMES
+    )
+    parser.add_argument(
+        "--frames",
+        dest="frames",
+        type=int,
+        default=CALIBRATION_FRAMES,
+        help=frames_help,
+    )
+
+    threads_help = "Specify the libvmaf thread counts to try (Default is every power of two up to the CPU threads)."
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        nargs="+",
+        type=int,
+        default=get_powers_of_two(mp.cpu_count()),
+        help=threads_help,
+    )
+
+    decode_threads_help = "Specify the decoder thread counts of every input to try (Default is 1 2)."
+    parser.add_argument(
+        "--decode-threads",
+        "--decode_threads",
+        dest="decode_threads",
+        nargs="+",
+        type=int,
+        default=[1, 2],
+        help=decode_threads_help,
+    )
+
+    proc_help = "Specify the process counts to try (Default is every power of two up to the CPU threads).\n"
+    proc_help += "Only layouts whose libvmaf threads of all processes fit into the CPU threads are tried."
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        nargs="+",
+        type=int,
+        default=get_powers_of_two(mp.cpu_count()),
+        help=proc_help,
+    )
+
+    profile_help = (
+        "Specify the machine profile file to save the fastest layout to (Default is {} next to this program).".format(
+            PROFILE_FILE
+        )
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        type=str,
+        default=str(Path(__file__).parent.joinpath(PROFILE_FILE)),
+        help=profile_help,
+    )
+
+    args = parser.parse_args()
+    if args.frames < 1:
+        parser.error("The calibration needs at least 1 frame.")
+
+    return args
+
+
+def plan_layouts(
+    threads,
+    decode_threads,
+    processes,
+    cores,
+):
+    """Get every layout of the grid whose libvmaf threads fit into the given cores, from the fewest processes up."""
+    layouts = []
+    for process_count in sorted(set(processes)):
+        for thread_count in sorted(set(threads)):
+            if process_count < 1 or thread_count < 1 or process_count * thread_count > cores:
+                continue
+            for decode_count in sorted(set(decode_threads)):
+                layouts.append(
+                    {
+                        "threads": thread_count,
+                        "decode_threads": max(1, decode_count),
+                        "processes": process_count,
+                    }
+                )
+
+    return layouts
+
+
+def run_layout(
+    layout,
+    reference,
+    distorted,
+    model,
+    ffmpeg,
+    frames,
+    fps,
+    log_dir,
+):
+    """Run a calibration process in every process slot of a layout at once, returning the frames per second of all of them."""
+    runners = []
+    for i in range(layout["processes"]):
+        log_path = escape_log_path(Path(log_dir).joinpath("calibration{}.json".format(i)))
+        io = {distorted: {model: {"commands": build_vmaf_filter(model, "json"), "log_path": log_path}}}
+        job = {
+            "pairs": [(distorted, model)],
+            "segment": {"index": 0, "start": 0, "end": frames, "first": 0, "count": frames, "fps": fps},
+        }
+        ff = build_job(
+            job,
+            io,
+            reference,
+            "",
+            "",
+            ffmpeg,
+            threads=layout["threads"],
+            decode_threads=layout["decode_threads"],
+        )
+        runners.append(VMAF_Stream_Runner(ff, frames=frames))
+
+    start = time()
+    with cf.ThreadPoolExecutor(max_workers=layout["processes"]) as pool:
+        tasks = [pool.submit(runner.run) for runner in runners]
+        try:
+            for task in cf.as_completed(tasks):
+                task.result()
+        except (KeyboardInterrupt, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError):
+            # The processes run in their own process groups, which never see
+            # the KeyboardInterrupt
+            for runner in runners:
+                runner.kill()
+            raise
+    seconds = time() - start
+
+    return layout["processes"] * frames / seconds if seconds > 0 else 0.0
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    # FFmpeg's file protocol lets the sample clip be both inputs of the
+    # calibration processes
+    distorted = args.distorted if args.distorted else "file:{}".format(args.reference)
+    cores = mp.cpu_count()
+
+    try:
+        info = probe_video(args.reference, get_ffprobe(args.ffmpeg))
+    except (OSError, ValueError, ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+        print("Could not probe the sample clip {}: {}".format(args.reference, e))
+        exit(1)
+    frames = min(args.frames, info["frames"]) if info["frames"] > 0 else args.frames
+    resolution_class = get_resolution_class(info["width"], info["height"])
+
+    layouts = plan_layouts(args.threads, args.decode_threads, args.processes, cores)
+    if len(layouts) == 0:
+        print("None of the given layouts fit into the {} CPU threads of this machine.".format(cores))
+        exit(1)
+    print(
+        "Tuning {} layouts for {} ({}x{}) on {} CPU threads, with {} frames per calibration process.\n".format(
+            len(layouts), resolution_class, info["width"], info["height"], cores, frames
+        )
+    )
+
+    best = None
+    log_dir = tempfile.mkdtemp(prefix="vmaf_tuner_")
+    try:
+        for layout in layouts:
+            try:
+                layout["fps"] = run_layout(
+                    layout, args.reference, distorted, args.model, args.ffmpeg, frames, info["fps"], log_dir
+                )
+            except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+                print("Calibration failed, stopping:\n{}".format(e))
+                exit(1)
+            print(
+                "{} processes x {} threads, {} decoder threads: {:.1f} frames/s".format(
+                    layout["processes"], layout["threads"], layout["decode_threads"], layout["fps"]
+                )
+            )
+            if best is None or layout["fps"] > best["fps"]:
+                best = layout
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected, keeping the fastest layout so far...")
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    if best is None:
+        exit(1)
+
+    profile = VMAF_Profile_Handler(args.profile, cores=cores)
+    profile.set_layout(resolution_class, best)
+    profile.save()
+    print(
+        "\nFastest layout for {}: {} processes x {} threads with {} decoder threads at {:.1f} frames/s".format(
+            resolution_class, best["processes"], best["threads"], best["decode_threads"], best["fps"]
+        )
+    )
+    print("Saved to {}".format(profile.get_profile_file()))
@@ -0,0 +1,86 @@
+from pathlib import Path
+from time import monotonic
+
+from vmaf_common import search_handler
+
+# Seconds between scans of the watched locations by default
+WATCH_INTERVAL = 5
+
+
+class VMAF_Watch_Handler:
+    """Polls the distorted locations for new video files, handing every file out once it stopped changing.
+
+    A file still being written by an encoder keeps changing its size or modification time, so it is only
+    handed out once both stayed the same for a whole interval. Files are found with the same rules as
+    the distorted locations given at the start, so only the video files directly inside a directory count.
+    """
+
+    def __init__(
+        self,
+        locations,
+        interval=WATCH_INTERVAL,
+    ):
+        self._locations = list(locations)
+        self._interval = max(0.1, interval)
+        # Size and modification time of every file that has not been handed
+        # out yet, along with when they last changed
+        self._seen = {}
+        self._polled = None
+
+    def get_interval(self):
+        return self._interval
+
+    def get_waiting(self):
+        """Get the files that were found but are still changing."""
+        return list(self._seen.keys())
+
+    def _scan(self):
+        files = []
+        for location in self._locations:
+            # A location that is missing for a moment, such as an unmounted
+            # network drive, is scanned again on the next poll
+            try:
+                files += search_handler(location, search_for="distorted") or []
+            except OSError:
+                continue
+
+        return list(dict.fromkeys([str(file) for file in files]))
+
+    def poll(
+        self,
+        known,
+    ):
+        """Scan the watched locations once an interval has passed, returning the new files that stopped changing.
+
+        Files in known are never handed out, which are the distorted video files that already have calculations.
+        """
+        now = monotonic()
+        if self._polled is not None and now - self._polled < self._interval:
+            return []
+        self._polled = now
+
+        known = set([str(file) for file in known])
+        settled = []
+        found = set()
+        for file in self._scan():
+            if file in known:
+                continue
+            found.add(file)
+            try:
+                stat = Path(file).stat()
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if file not in self._seen or self._seen[file][0] != signature:
+                self._seen[file] = (signature, now)
+            # Empty files are only created so far, even when they stay empty
+            elif stat.st_size > 0 and now - self._seen[file][1] >= self._interval:
+                settled.append(file)
+                del self._seen[file]
+
+        # Forget files that were deleted or moved away before they settled
+        for file in list(self._seen.keys()):
+            if file not in found:
+                del self._seen[file]
+
+        return settled
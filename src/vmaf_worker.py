@@ -0,0 +1,205 @@
+import argparse as argp
+import concurrent.futures as cf
+import multiprocessing as mp
+import signal
+from time import sleep, time
+
+import ffmpy
+
+from vmaf_common import handle_terminate
+from vmaf_job_handler import build_job, get_job_logs, get_log_file
+from vmaf_lease_handler import LEASE_TIME, VMAF_Lease_Handler
+from vmaf_scheduler import VMAF_Thread_Scheduler
+from vmaf_stream_handler import VMAF_Stream_Runner, create_engine, get_run
+
+# Seconds between checks for finished calculations, new jobs and lease renewals
+POLL_INTERVAL = 1
+
+
+def parse_arguments() -> argp.Namespace:
+    """Parse user given arguments for running a VMAF calculation worker."""
+    main_help = "Worker that claims and runs the VMAF calculations published to a shared lease directory by the VMAF Calculator."
+    parser = argp.ArgumentParser(description=main_help, formatter_class=argp.RawTextHelpFormatter)
+    parser.add_argument(
+        "lease_dir",
+        type=str,
+        help="The shared directory given to the VMAF Calculator's --lease-dir argument.",
+    )
+
+    ffmpeg_help = 'Specify the path to the FFmpeg executable (Default is "ffmpeg").'
+    parser.add_argument(
+        "-f",
+        "--ffmpeg",
+        dest="ffmpeg",
+        type=str,
+        default="ffmpeg",
+        help=ffmpeg_help,
+    )
+
+    threads_help = 'Specify number of threads to be used for each process (Default is 0 for "autodetect").'
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        type=int,
+        default=0,
+        help=threads_help,
+    )
+
+    proc_help = "Specify number of simultaneous VMAF calculation processes to run (Default is 1)."
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        type=int,
+        default=1,
+        help=proc_help,
+    )
+
+    hwaccel_help = "Enable FFmpeg to automatically attempt to use hardware acceleration for video decoding."
+    parser.add_argument(
+        "--hwaccel",
+        dest="hwaccel",
+        action="store_true",
+        help=hwaccel_help,
+    )
+
+    lease_time_help = "Specify the number of seconds a worker can go without renewing its claim on a calculation (Default is {}).".format(
+        LEASE_TIME
+    )
+    parser.add_argument(
+        "--lease-time",
+        "--lease_time",
+        dest="lease_time",
+        type=int,
+        default=LEASE_TIME,
+        help=lease_time_help,
+    )
+
+    engine_help = 'Specify how the FFmpeg processes are run, either "threads" or "async" (Default is "threads").'
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=["threads", "async"],
+        default="threads",
+        help=engine_help,
+    )
+
+    timeout_help = (
+        "Specify the number of seconds a single VMAF calculation process may run for (Default is 0 for no limit)."
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=int,
+        default=0,
+        help=timeout_help,
+    )
+
+    wait_help = (
+        "Keep waiting for new calculations once the lease directory has no more pending ones, instead of exiting."
+    )
+    parser.add_argument(
+        "-w",
+        "--wait",
+        dest="wait",
+        action="store_true",
+        help=wait_help,
+    )
+
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, mp.cpu_count()))
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    leases = VMAF_Lease_Handler(args.lease_dir, lease_time=args.lease_time)
+    scheduler = VMAF_Thread_Scheduler(processes=args.processes, threads=args.threads)
+    decode = "-hwaccel auto" if args.hwaccel else ""
+    print("Worker {} is waiting for VMAF calculations in {}".format(leases.get_worker(), args.lease_dir))
+
+    # Holds the running Futures as keys, with the lease ID, VMAF_Stream_Runner,
+    # threads and start time of their job as values
+    running = {}
+    finished = 0
+
+    # Stop the same way as on a KeyboardInterrupt when terminated
+    signal.signal(signal.SIGTERM, handle_terminate)
+
+    cf_handler = create_engine(args.engine, args.processes)
+    try:
+        while True:
+            # Fill every free process slot with the next pending job
+            while scheduler.get_free_slots() > 0:
+                claimed = leases.claim()
+                if claimed is None:
+                    break
+                lease_id, lease = claimed
+                job = lease["job"]
+
+                msg = "Claimed VMAF calculation {}:\n\tReference: {}\n".format(lease_id, lease["reference"])
+                for dist, model in job["pairs"]:
+                    msg += "\tDistorted: {}\n\tModel: {}\n".format(dist, model)
+                print(msg)
+
+                threads = scheduler.plan(1)
+                ff_tmp = build_job(
+                    job,
+                    lease["io"],
+                    lease["reference"],
+                    decode,
+                    decode,
+                    args.ffmpeg,
+                    threads=threads,
+                    normalize=job.get("normalize"),
+                )
+                runner = VMAF_Stream_Runner(
+                    ff_tmp,
+                    frames=job.get("size", (0, 0))[0],
+                    timeout=args.timeout,
+                    logs=[get_log_file(log_path) for _, _, log_path in get_job_logs(job, lease["io"])],
+                )
+                task = cf_handler.submit(get_run(runner, args.engine))
+                running[task] = {
+                    "lease": lease_id,
+                    "runner": runner,
+                    "threads": threads,
+                    "start": time(),
+                }
+                scheduler.start(task, threads)
+
+            if len(running) == 0:
+                if leases.count_pending() == 0 and not args.wait:
+                    break
+                sleep(POLL_INTERVAL)
+                continue
+
+            done, _ = cf.wait(running.keys(), timeout=POLL_INTERVAL, return_when=cf.FIRST_COMPLETED)
+            leases.renew()
+            for task in done:
+                info = running.pop(task)
+                scheduler.finish(task)
+                seconds = time() - info["start"]
+                usage = dict(info["runner"].get_usage(), threads=info["threads"])
+                try:
+                    scores = task.result()
+                    leases.complete(info["lease"], scores, seconds, usage=usage)
+                    print("Finished VMAF calculation {} with scores {}".format(info["lease"], scores))
+                except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e:
+                    leases.complete(info["lease"], [], seconds, error=str(e), usage=usage)
+                    print("VMAF calculation {} failed:\n{}".format(info["lease"], e))
+                finished += 1
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected, handing the claimed calculations back...")
+        for task, info in running.items():
+            info["runner"].kill()
+        cf_handler.shutdown(wait=True, cancel_futures=True)
+        leases.release_all()
+        exit(1)
+    else:
+        cf_handler.shutdown()
+
+    print("Worker {} finished {} VMAF calculations".format(leases.get_worker(), finished))